@@ -56,7 +56,7 @@ def main():
         if suite is not None:
             for testcase in runner.run():
                 pass
-            if not runner.options["info"] and not runner.options["length"] and not runner.options["quiet"]:
+            if not any(runner.options[option] for option in ["info", "length", "shardPlan", "quiet"]):
                 print(f"{suite.getRate():2.2f}%")
 
             if suite.mode == TestSuiteMode.Continuous:
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Scanning files for bad words. (see :py:class:`WordScanner`)
+
+Every file is memory-mapped and searched as a whole buffer. Line
+numbers are only computed for the lines with a match, which are then
+checked word by word, so the hits are the same as checking every line
+against every word.
+"""
+
+from typing import List, Tuple, Iterable, Union, Pattern, Optional, Dict
+from concurrent.futures import ProcessPoolExecutor
+
+import os
+import re
+import json
+import mmap
+import time
+import locale
+import hashlib
+import tempfile
+import multiprocessing
+
+from .capture import decodeOutput
+from .golden import fileDigest
+from .utils import logger
+
+Hit = Tuple[str, int, str, str]
+"""A bad word: the file, the line number (0-based), the line and the matching word"""
+
+BinaryProbe = 8000
+"""Files with a NUL byte within this number of bytes are skipped as binary"""
+PoolThreshold = 256
+"""From this number of files on, the files are scanned by a process pool"""
+DefaultIndex = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "nightmare", "badwords")
+"""The default directory of the bad word indices (see :py:class:`WordIndex`)"""
+
+NotAscii = re.compile(rb"[^\x01-\x0c\x0e-\x7f]")
+"""Bytes which prevent the search of the raw buffer (non ASCII and carriage returns)"""
+AsciiEncodings = ["utf8", "ascii", "ansix3.41968", "latin1", "iso88591", "cp1252"]
+"""The encodings of text files, which are compatible with ASCII"""
+
+
+def bufferPattern(word: str) -> str:
+    """
+    Rewrites a word to search the whole buffer instead of a single line,
+    which ends with its line break. The rewritten word must match at
+    least on every line the word matches on: the ends of the line
+    (`$`, `\\A` and `\\Z`) also match at every line break. Negative
+    lookbehinds can not be rewritten, they are checked on every line.
+    """
+    if "(?<!" in word:
+        return "^"
+    result = []
+    escaped = inClass = False
+    for ch in word:
+        if escaped:
+            escaped = False
+            if ch in "AZ" and not inClass:
+                result[-1] = r"(?:\A|(?<=\n))" if ch == "A" else r"(?:\Z|(?<=\n))"
+                continue
+        elif ch == "\\":
+            escaped = True
+        elif ch == "[":
+            inClass = True
+        elif ch == "]":
+            inClass = False
+        elif ch == "$" and not inClass:
+            result.append(r"(?:$|(?<=\n))")
+            continue
+        result.append(ch)
+    return "".join(result)
+
+
+Escapes = {"x": 2, "u": 4, "U": 8}
+"""The number of hex digits following an escape of a character code"""
+
+
+def requiredLiteral(word: str) -> str:
+    """
+    The longest text, which is part of every match of a word. Empty, if
+    no such text is found: only literal characters outside of groups
+    are considered.
+    """
+    if re.compile(word).flags & (re.IGNORECASE | re.VERBOSE):
+        return ""
+    runs = [""]
+    depth = 0
+    pos = 0
+    while pos < len(word):
+        ch = word[pos]
+        literal = None
+        if ch == "\\":
+            pos += 1
+            escape = word[pos : pos + 1]
+            if escape != "" and not escape.isalnum():
+                literal = escape
+            elif escape in Escapes:
+                # The code of the character is part of the escape
+                pos += Escapes[escape]
+            elif escape == "N":
+                pos = word.find("}", pos)
+                pos = len(word) if pos < 0 else pos
+            elif escape.isdigit():
+                # Octal escapes and group references take up to three digits
+                end = pos + 1
+                while end < min(pos + 3, len(word)) and word[end].isdigit():
+                    end += 1
+                pos = end - 1
+        elif ch == "[":
+            # Skip the class, a leading ']' is part of it
+            pos += 2 if word[pos + 1 : pos + 2] == "^" else 1
+            pos = word.find("]", pos + 1)
+            pos = len(word) if pos < 0 else pos
+        elif ch == "{":
+            pos = word.find("}", pos)
+            pos = len(word) if pos < 0 else pos
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "|" and depth == 0:
+            return ""
+        elif ch not in ".^$*+?":
+            literal = ch
+        pos += 1
+        following = word[pos : pos + 1]
+        if literal is not None and depth == 0 and following not in ["*", "?", "{"]:
+            runs[-1] += literal
+            if following != "+":
+                continue
+        if runs[-1] != "":
+            runs.append("")
+    return max(runs, key=len)
+
+
+class WordScanner:
+    """
+    Searches files for a list of words (regular expressions).
+
+    A file is only searched for a word, if it contains the required
+    text of the word. (see :py:func:`requiredLiteral`)
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words = [re.compile(word) for word in words]
+        """The compiled words, to check a matching line"""
+        self.patterns = [re.compile(bufferPattern(word.pattern), re.MULTILINE) for word in self.words]
+        """The words, searching the decoded text"""
+        self.bytePatterns: Optional[List[Pattern]] = None
+        """The words, searching the raw buffer of ASCII files"""
+        self.literals: List[bytes] = [b""] * len(self.words)
+        """The encoded required text of every word, empty if unknown"""
+        encoding = locale.getpreferredencoding(False)
+        if encoding.lower().replace("-", "").replace("_", "") in AsciiEncodings:
+            self.literals = [requiredLiteral(word.pattern).encode(encoding, errors="ignore") for word in self.words]
+            if all(word.pattern.isascii() for word in self.words):
+                self.bytePatterns = [
+                    re.compile(bufferPattern(word.pattern).encode("ascii"), re.MULTILINE) for word in self.words
+                ]
+
+    def candidates(self, buffer: mmap.mmap) -> List[int]:
+        """
+        The indices of the words, whose required text is in the buffer.
+        """
+        return [nr for nr, literal in enumerate(self.literals) if literal == b"" or buffer.find(literal) >= 0]
+
+    def lines(self, buffer: Union[str, mmap.mmap], patterns: List[Pattern]) -> List[Tuple[int, int]]:
+        """
+        The start and end of every line with a match of the patterns.
+        """
+        newline = "\n" if isinstance(buffer, str) else b"\n"
+        lines = set()
+        for pattern in patterns:
+            pos = 0
+            while pos < len(buffer):
+                match = pattern.search(buffer, pos)
+                if match is None:
+                    break
+                start = buffer.rfind(newline, 0, match.start()) + 1
+                end = buffer.find(newline, match.start())
+                end = len(buffer) if end < 0 else end + 1
+                if start < len(buffer):
+                    lines.add((start, end))
+                pos = max(end, pos + 1)
+        return sorted(lines)
+
+    def search(self, buffer: Union[str, mmap.mmap], patterns: List[Pattern]) -> List[Tuple[int, str, str]]:
+        """
+        Searches a buffer. Returns the line number, the line and the word
+        of every hit.
+        """
+        hits = []
+        lineNr = 0
+        counted = 0
+        for start, end in self.lines(buffer, patterns):
+            if isinstance(buffer, str):
+                lineNr += buffer.count("\n", counted, start)
+                line = buffer[start:end]
+            else:
+                lineNr += buffer[counted:start].count(b"\n")
+                line = buffer[start:end].decode("ascii")
+            counted = start
+            for word in self.words:
+                if word.search(line) is not None:
+                    hits.append((lineNr, line.rstrip(), word.pattern))
+        return hits
+
+    def scanFile(self, fname: os.PathLike) -> List[Hit]:
+        """
+        Scans a single file. Binary files are skipped.
+        """
+        with open(fname, "rb") as fHnd:
+            if os.fstat(fHnd.fileno()).st_size == 0 or len(self.words) == 0:
+                return []
+            with mmap.mmap(fHnd.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if buffer.find(b"\0", 0, BinaryProbe) >= 0:
+                    return []
+                candidates = self.candidates(buffer)
+                if len(candidates) == 0:
+                    return []
+                if self.bytePatterns is not None and NotAscii.search(buffer) is None:
+                    hits = self.search(buffer, [self.bytePatterns[nr] for nr in candidates])
+                else:
+                    hits = self.search(decodeOutput(buffer[:]), [self.patterns[nr] for nr in candidates])
+        relative = os.path.relpath(fname)
+        return [(relative, lineNr, line, word) for lineNr, line, word in hits]
+
+    def scanFiles(self, files: List[os.PathLike], jobs: Optional[int] = None) -> List[List[Hit]]:
+        """
+        Scans files, many files in parallel by up to `jobs` processes.
+        Returns the hits of every file.
+        """
+        jobs = (os.cpu_count() or 1) if jobs is None else jobs
+        if len(files) < PoolThreshold or jobs < 2:
+            return [self.scanFile(fname) for fname in files]
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+            return list(pool.map(self.scanFile, files, chunksize=max(1, len(files) // (4 * jobs))))
+
+    def scan(self, files: Iterable[os.PathLike], jobs: Optional[int] = None, index: Optional["WordIndex"] = None) -> List[Hit]:
+        """
+        Scans files, the hits are ordered like the files. With an index,
+        only new and modified files are scanned.
+        """
+        files = [fname for fname in files if os.path.isfile(fname)]
+        if index is not None:
+            return index.scan(self, files, jobs)
+        return [hit for hits in self.scanFiles(files, jobs) for hit in hits]
+
+
+class WordIndex:
+    """
+    The hits of earlier scans, stored as a JSON file.
+
+    Every file is stored with its size, modification time and content
+    hash. A file is only scanned again, if its size or modification
+    time changed and its content hash differs. The index is discarded,
+    if the words change.
+    """
+
+    def __init__(self, fname: os.PathLike, words: Iterable[str]):
+        self.fname = fname
+        """The index file"""
+        self.words = hashlib.sha256(json.dumps(list(words)).encode()).hexdigest()
+        """The hash of the words"""
+        self.scanned = 0
+        """The number of files scanned by the last scan"""
+
+    def load(self) -> Dict[str, list]:
+        """
+        The stored files: size, modification time, content hash and hits
+        (line number, line and word) by the absolute path.
+        """
+        try:
+            with open(self.fname) as fHnd:
+                content = json.load(fHnd)
+            if content.get("words") == self.words:
+                return content["files"]
+        except (OSError, ValueError, AttributeError):
+            pass
+        return {}
+
+    def save(self, files: Dict[str, list]):
+        directory = os.path.dirname(os.path.abspath(self.fname))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmpName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fHnd:
+            json.dump({"words": self.words, "files": files}, fHnd)
+        os.replace(tmpName, self.fname)
+
+    def scan(self, scanner: WordScanner, files: List[os.PathLike], jobs: Optional[int] = None) -> List[Hit]:
+        stored = self.load()
+        entries: Dict[str, list] = {}
+        modified = []
+        for fname in files:
+            path = os.path.abspath(fname)
+            info = os.stat(path)
+            entry = stored.get(path)
+            # Files modified within the resolution of the timestamps could change unnoticed
+            recent = time.time_ns() - info.st_mtime_ns < 2_000_000_000
+            if entry is not None and entry[:2] == [info.st_size, info.st_mtime_ns] and not recent:
+                entries[path] = entry
+                continue
+            digest = fileDigest(path)
+            if entry is not None and entry[0] == info.st_size and entry[2] == digest:
+                entries[path] = [info.st_size, info.st_mtime_ns, digest, entry[3]]
+            else:
+                modified.append(fname)
+                entries[path] = [info.st_size, info.st_mtime_ns, digest, []]
+        for fname, hits in zip(modified, scanner.scanFiles(modified, jobs)):
+            entries[os.path.abspath(fname)][3] = [[lineNr, line, word] for _, lineNr, line, word in hits]
+        self.scanned = len(modified)
+        logger.log(f"\tI scanned {self.scanned} of {len(files)} files, the others are unchanged in the index")
+        if entries != stored:
+            try:
+                self.save(entries)
+            except OSError as e:
+                logger.log(f"Sorry, but I couldn't save the bad word index '{self.fname}': {e}")
+        hits = []
+        for fname in files:
+            relative = os.path.relpath(fname)
+            hits.extend((relative, lineNr, line, word) for lineNr, line, word in entries[os.path.abspath(fname)][3])
+        return hits
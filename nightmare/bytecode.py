@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Compiled testbench files, cached like the `__pycache__` of imported
+modules. (see :py:func:`compileBench`)
+
+Large (generated) testbenches take longer to compile than to execute.
+The code object of a bench is marshalled into a cache file, which is
+valid as long as the path, size and modification time of the bench, the
+version of nightmare and the bytecode of the interpreter are unchanged.
+"""
+
+from types import CodeType
+from typing import Optional
+
+import os
+import sys
+import marshal
+import hashlib
+import tempfile
+import importlib.util
+
+import nightmare
+
+DefaultBytecode = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "nightmare", "bytecode")
+"""The default directory of the compiled testbenches"""
+
+
+def cacheFile(directory: os.PathLike, fname: os.PathLike) -> str:
+    """
+    The cache file of a testbench, named by the hash of its path.
+    """
+    key = hashlib.sha256(os.path.abspath(fname).encode(errors="surrogateescape")).hexdigest()[:32]
+    return os.path.join(directory, f"{key}.{sys.implementation.cache_tag}.bench")
+
+
+def header(fname: os.PathLike) -> bytes:
+    """
+    Identifies the compiled testbench: the magic number of the
+    interpreter, the nightmare version, the path, size and modification
+    time of the testbench.
+    """
+    info = os.stat(fname)
+    key = f"{nightmare.__version__}\0{os.path.abspath(fname)}\0{info.st_size}\0{info.st_mtime_ns}\0"
+    return importlib.util.MAGIC_NUMBER + key.encode(errors="surrogateescape")
+
+
+def loadCode(directory: os.PathLike, fname: os.PathLike) -> Optional[CodeType]:
+    """
+    The cached code of a testbench, None if it is missing or outdated.
+    """
+    expected = header(fname)
+    try:
+        with open(cacheFile(directory, fname), "rb") as fHnd:
+            if fHnd.read(len(expected)) != expected:
+                return None
+            return marshal.load(fHnd)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def storeCode(directory: os.PathLike, fname: os.PathLike, code: CodeType, stamp: bytes):
+    os.makedirs(directory, exist_ok=True)
+    fd, tmpName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as fHnd:
+        fHnd.write(stamp)
+        marshal.dump(code, fHnd)
+    os.replace(tmpName, cacheFile(directory, fname))
+
+
+def compileBench(fname: os.PathLike, directory: Optional[os.PathLike] = None) -> CodeType:
+    """
+    Compiles a testbench, or loads its code from the cache in
+    `directory`. Without a directory the bench is always compiled.
+    """
+    if directory is not None:
+        code = loadCode(directory, fname)
+        if code is not None:
+            return code
+        # The header is taken before reading, a bench modified meanwhile is compiled again next time
+        stamp = header(fname)
+    with open(fname) as fHnd:
+        code = compile(fHnd.read(), os.path.abspath(fname), "exec", dont_inherit=True)
+    if directory is not None:
+        try:
+            storeCode(directory, fname, code, stamp)
+        except OSError:
+            # A read-only cache only costs the compilation
+            pass
+    return code
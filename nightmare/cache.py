@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Content-addressed cache for test results. (see :py:class:`ResultCache`)
+
+A test is keyed on everything that can influence its result: the
+expanded commands, the contents of the executables and files they
+reference, the expectations, the relevant environment variables and the
+working directory.
+If none of them changed, the stored result is replayed instead of
+spawning the DUT again.
+"""
+
+from typing import Optional, Dict, Tuple, Iterable, List, Any
+
+import os
+import re
+import json
+import types
+import base64
+import shlex
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from .case import Test, Benchmark, TestState, ResourceUsage
+from .capture import ChunkSize, SpilledOutput, StreamResult, release
+from .utils import logger
+
+CacheableStates = [TestState.Success, TestState.Fail, TestState.Error, TestState.Assertion, TestState.SegFault]
+"""The states of a test, which are reproducible and will be cached"""
+
+CacheEnvironment = [
+    "PATH",
+    "LD_LIBRARY_PATH",
+    "LD_PRELOAD",
+    "PYTHONPATH",
+    "HOME",
+    "SHELL",
+    "TMPDIR",
+    "TZ",
+    "LANG",
+    "LANGUAGE",
+    "LC_ALL",
+    "LC_CTYPE",
+    "LC_COLLATE",
+    "LC_MESSAGES",
+    "LC_NUMERIC",
+    "LC_TIME",
+]
+"""
+The environment variables in the cache key. Other variables (e.g. the
+build number of a CI job) change with every run, they are only part of
+the key, if a command refers to them.
+"""
+
+Variable = re.compile(r"\$(?:\{)?([A-Za-z_][A-Za-z0-9_]*)")
+"""A variable of the shell in a command"""
+
+
+def fingerprint(value: Any) -> Any:
+    """
+    Converts an expectation (or any other value) into a JSON compatible
+    structure, which is stable between two runs of nightmare.
+
+    Functions are represented by their bytecode, objects by their type
+    and attributes. Objects can provide their own `fingerprint` method.
+    Raises a TypeError for values which can not be represented.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, bytes):
+        return hashlib.sha256(value).hexdigest()
+    elif isinstance(value, (list, tuple)):
+        return [fingerprint(v) for v in value]
+    elif isinstance(value, (set, frozenset)):
+        return sorted((fingerprint(v) for v in value), key=json.dumps)
+    elif isinstance(value, dict):
+        return {str(k): fingerprint(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    elif isinstance(value, TestState):
+        return value.name
+    elif isinstance(value, re.Pattern):
+        return ["re", value.pattern, value.flags]
+    elif isinstance(value, types.CodeType):
+        return ["code", value.co_code.hex(), fingerprint(value.co_consts), list(value.co_names)]
+    elif isinstance(value, types.FunctionType):
+        cells = [cell.cell_contents for cell in value.__closure__ or []]
+        return ["function", fingerprint(value.__code__), fingerprint(value.__defaults__), fingerprint(cells)]
+    elif hasattr(value, "fingerprint"):
+        return value.fingerprint()
+    elif hasattr(value, "__dict__"):
+        return [type(value).__qualname__, fingerprint(vars(value))]
+    raise TypeError(f"Can not fingerprint {type(value).__name__}")
+
+
+class ResultCache:
+    """
+    Stores the results of tests in a directory, addressed by the hash of
+    their inputs.
+
+    With `refresh`, no result is replayed, but the results of the run
+    are stored. Besides the variables referenced by a command, only the
+    `environment` variables are part of the key.
+
+    Spilled outputs are copied chunk by chunk into files of their own,
+    next to the entry, and memory-mapped again when they are replayed.
+    """
+
+    def __init__(self, directory: os.PathLike, refresh=False, environment: Iterable[str] = CacheEnvironment):
+        self.directory = directory
+        """The directory holding the cache entries"""
+        self.refresh = refresh
+        """Flag, set if stored results are ignored"""
+        self.environment = list(environment)
+        """The names of the environment variables in the key of every test"""
+        self.hits = 0
+        """The number of replayed results"""
+        self.misses = 0
+        """The number of executed tests"""
+        self.lock = threading.Lock()
+        """Guards the counters and the digests, tests are looked up concurrently"""
+        self.digests: Dict[Tuple[str, int, int], str] = {}
+        """The content hashes of files, by path, size and modification time"""
+
+    def digest(self, fname: str) -> str:
+        """
+        Hashes the contents of a file. Files are hashed only once, as
+        long as they are not modified.
+        """
+        info = os.stat(fname)
+        stamp = (os.path.abspath(fname), info.st_size, info.st_mtime_ns)
+        with self.lock:
+            digest = self.digests.get(stamp)
+        if digest is None:
+            hsh = hashlib.sha256()
+            with open(fname, "rb") as fHnd:
+                for chunk in iter(lambda: fHnd.read(ChunkSize), b""):
+                    hsh.update(chunk)
+            digest = hsh.hexdigest()
+            with self.lock:
+                self.digests[stamp] = digest
+        return digest
+
+    def files(self, command: str) -> Dict[str, str]:
+        """
+        Hashes the files a command references: the executable and every
+        argument naming an existing file.
+        """
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            argv = command.split()
+        files = {}
+        for nr, arg in enumerate(argv):
+            fname = shutil.which(arg) if nr == 0 else None
+            fname = arg if fname is None else fname
+            if os.path.isfile(fname):
+                files[arg] = self.digest(fname)
+        return files
+
+    def variables(self, commands: List[str]) -> Dict[str, Optional[str]]:
+        """
+        The values of the environment variables, which can influence the
+        commands.
+        """
+        names = set(self.environment)
+        for cmd in commands:
+            names.update(Variable.findall(cmd))
+        return {name: os.environ.get(name) for name in sorted(names)}
+
+    def key(self, test: Test) -> Optional[str]:
+        """
+        Computes the cache key of a test, None if the test can not be
+        cached.
+
+        The key has to be computed before the test is executed, since
+        the DUT might modify the files it references.
+        """
+        if not isinstance(test, Test) or isinstance(test, Benchmark) or test.cmd is None or test.name == "Badword":
+            return None
+        if test.state in [TestState.Disabled, TestState.InfoOnly]:
+            return None
+        commands = test.cmd if isinstance(test.cmd, list) else [test.cmd]
+        if test.DUT is None and any("$DUT" in cmd for cmd in commands):
+            return None
+        commands = [cmd if test.DUT is None else cmd.replace("$DUT", test.DUT) for cmd in commands]
+        try:
+            inputs = {
+                "commands": commands,
+                "files": [self.files(cmd) for cmd in commands],
+                "test": test.fingerprint(),
+                "env": self.variables(commands),
+                "cwd": os.getcwd(),
+            }
+            content = json.dumps(fingerprint(inputs), sort_keys=True)
+        except (TypeError, OSError, ValueError, KeyError):
+            return None
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def path(self, key: str, suffix: str = ".json") -> str:
+        """
+        The file of an entry, or with another `suffix` the file of a
+        spilled output of the entry.
+        """
+        return os.path.join(self.directory, key[:2], key[2:] + suffix)
+
+    def lookup(self, test: Test, key: Optional[str]) -> bool:
+        """
+        Replays the stored result of a test.
+
+        Returns False, if the test needs to be executed.
+        """
+        test.cached = False
+        if key is None:
+            return False
+        if self.refresh or not os.path.exists(self.path(key)):
+            with self.lock:
+                self.misses += 1
+            return False
+        output = error = None
+        try:
+            with open(self.path(key)) as fHnd:
+                entry = json.load(fHnd)
+            state = TestState[entry["state"]]
+            output = self.decode(key, entry["output"], test.binary)
+            error = self.decode(key, entry["error"], test.binary)
+            usage = ResourceUsage(**entry["usage"])
+            retCode = entry["retCode"]
+        except (OSError, ValueError, KeyError, TypeError):
+            release(output, error)
+            # A damaged entry is replaced by the next run
+            with self.lock:
+                self.misses += 1
+            return False
+        release(getattr(test, "output", None), getattr(test, "error", None))
+        test.state, test.retCode, test.output, test.error, test.usage = state, retCode, output, error, usage
+        test.cached = True
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, test: Test, key: Optional[str]):
+        """
+        Stores the result of an executed test. A cache which can not be
+        written only logs the error.
+        """
+        if key is None or test.state not in CacheableStates or getattr(test, "cancelled", False):
+            return
+        usage = test.usage if test.usage is not None else ResourceUsage()
+        try:
+            os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+            # The spilled outputs are written first, an entry never refers to a missing file
+            entry = {
+                "name": test.name,
+                "state": test.state.name,
+                "retCode": test.retCode,
+                "output": self.encode(key, ".stdout", test.output),
+                "error": self.encode(key, ".stderr", test.error),
+                "usage": {
+                    "wall": usage.wall,
+                    "user": usage.user,
+                    "system": usage.system,
+                    "maxRSS": usage.maxRSS,
+                    "rssFloor": usage.rssFloor,
+                },
+            }
+            self.write(self.path(key), [json.dumps(entry).encode()])
+        except OSError as e:
+            logger.log(f"Sorry, but I couldn't store the result of '{test.name}' in the cache: {e}")
+
+    @staticmethod
+    def write(fname: str, chunks: Iterable[bytes]):
+        """
+        Replaces a file of the cache. Concurrent readers must not see
+        partial files.
+        """
+        fd, tmpName = tempfile.mkstemp(dir=os.path.dirname(fname), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fHnd:
+                for chunk in chunks:
+                    fHnd.write(chunk)
+            os.replace(tmpName, fname)
+        except OSError:
+            os.unlink(tmpName)
+            raise
+
+    def encode(self, key: str, suffix: str, output: StreamResult) -> Any:
+        """
+        Converts an output into its stored form.
+        """
+        if isinstance(output, SpilledOutput):
+            buffer = output.buffer
+            chunks = (buffer[offset : offset + ChunkSize] for offset in range(0, len(buffer), ChunkSize))
+            self.write(self.path(key, suffix), chunks)
+            return {"spilled": suffix}
+        if isinstance(output, (bytes, bytearray)):
+            return {"base64": base64.b64encode(output).decode("ascii")}
+        return str(output)
+
+    def decode(self, key: str, output: Any, binary: bool) -> StreamResult:
+        """
+        Restores an output from its stored form.
+        """
+        if isinstance(output, dict) and "spilled" in output:
+            if output["spilled"] not in [".stdout", ".stderr"]:
+                raise ValueError(f"unknown output file '{output['spilled']}'")
+            fHnd = open(self.path(key, output["spilled"]), "rb")
+            try:
+                return SpilledOutput(fHnd, binary)
+            except (OSError, ValueError):
+                fHnd.close()
+                raise
+        if isinstance(output, dict):
+            return base64.b64decode(output["base64"])
+        return output
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Capturing the output streams of a DUT with bounded memory.
+
+Small outputs are kept in memory, outputs above a threshold are spilled
+into a temporary file and handed to the expectations as a memory-mapped
+buffer. (see :py:class:`OutputCapture`)
+"""
+
+from typing import Union, Optional, Dict, Callable, Iterator, IO
+
+import os
+import sys
+import mmap
+import codecs
+import locale
+import tempfile
+import selectors
+import threading
+
+ChunkSize = 64 * 1024
+"""The number of bytes read from a pipe at once"""
+SpillLimit = 16 * 1024 * 1024
+"""Default size in bytes, after which an output is spilled to disk"""
+
+
+def decodeOutput(data: bytes, binary=False) -> Union[str, bytes]:
+    """
+    Decodes the raw output like a subprocess in text mode would do.
+    """
+    if binary:
+        return data
+    return data.decode(locale.getpreferredencoding(False), errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+
+
+class StreamDecoder:
+    """
+    Decodes a stream chunk by chunk, the same way :py:func:`decodeOutput`
+    decodes the complete output.
+    """
+
+    def __init__(self, binary=False):
+        self.binary = binary
+        self.decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace")
+        self.pendingCR = False
+
+    def decode(self, chunk: bytes, final=False) -> Union[str, bytes]:
+        """
+        Decodes the next chunk, with `final` the end of the stream is
+        decoded as well.
+        """
+        if self.binary:
+            return chunk
+        text = self.decoder.decode(chunk, final)
+        if self.pendingCR:
+            text = "\r" + text
+        # A line break might be split between two chunks
+        self.pendingCR = text.endswith("\r") and not final
+        if self.pendingCR:
+            text = text[:-1]
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+class SpilledOutput:
+    """
+    The output of a stream that was too large to be kept in memory.
+
+    The raw bytes are memory-mapped from a temporary file. The most
+    common string operations (`in`, `startswith`, `find`, `len` and
+    comparisons) decode the buffer chunk by chunk and behave like on the
+    decoded text of a smaller output: line breaks are normalized and
+    offsets count characters. Binary outputs are searched directly.
+    Every other attribute is looked up on the decoded text, which loads
+    the whole output.
+    """
+
+    def __init__(self, fHnd: IO[bytes], binary=False):
+        self.file = fHnd
+        """The temporary file holding the output"""
+        self.buffer = mmap.mmap(fHnd.fileno(), 0, access=mmap.ACCESS_READ)
+        """The memory-mapped output"""
+        self.binary = binary
+        self.length: Optional[int] = None
+        """The length of the decoded output, once it is known"""
+
+    def chunks(self) -> Iterator[Union[str, bytes]]:
+        """
+        The decoded output, chunk by chunk.
+        """
+        decoder = StreamDecoder(self.binary)
+        for offset in range(0, len(self.buffer), ChunkSize):
+            yield decoder.decode(self.buffer[offset : offset + ChunkSize])
+        yield decoder.decode(b"", final=True)
+
+    def encode(self, text: Union[str, bytes]) -> bytes:
+        if isinstance(text, str):
+            return text.encode(locale.getpreferredencoding(False))
+        return text
+
+    def __len__(self):
+        if self.binary:
+            return len(self.buffer)
+        if self.length is None:
+            self.length = sum(len(chunk) for chunk in self.chunks())
+        return self.length
+
+    def __bytes__(self):
+        return self.buffer[:]
+
+    def __str__(self):
+        return decodeOutput(self.buffer[:])
+
+    def __contains__(self, text: Union[str, bytes]) -> bool:
+        return self.find(text) >= 0
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, SpilledOutput):
+            other = other.buffer
+        if isinstance(other, (bytes, bytearray, mmap.mmap)):
+            if len(other) != len(self.buffer):
+                return False
+            for offset in range(0, len(self.buffer), ChunkSize):
+                if self.buffer[offset : offset + ChunkSize] != other[offset : offset + ChunkSize]:
+                    return False
+            return True
+        if isinstance(other, str):
+            offset = 0
+            for chunk in self.chunks():
+                if other[offset : offset + len(chunk)] != chunk:
+                    return False
+                offset += len(chunk)
+            return offset == len(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return id(self)
+
+    def find(self, text: Union[str, bytes], start: Optional[int] = None, end: Optional[int] = None) -> int:
+        """
+        The offset of the first occurrence of `text` between `start` and
+        `end` (like `str.find`), -1 if it is not found.
+        """
+        if self.binary or not isinstance(text, str):
+            return self.buffer.find(self.encode(text), *slice(start, end).indices(len(self.buffer))[:2])
+        start, end, _ = slice(start, end).indices(len(self))
+        window, offset = "", 0
+        for chunk in self.chunks():
+            window += chunk
+            found = window.find(text, max(start - offset, 0), end - offset)
+            if found >= 0:
+                return offset + found
+            # Only a partial match at the end of the window is kept for the next chunk
+            keep = min(len(window), max(len(text) - 1, 0))
+            offset += len(window) - keep
+            window = window[len(window) - keep :]
+            if offset >= end:
+                break
+        return -1
+
+    def startswith(self, text: Union[str, bytes]) -> bool:
+        if self.binary or not isinstance(text, str):
+            prefix = self.encode(text)
+            return self.buffer[: len(prefix)] == prefix
+        head = ""
+        for chunk in self.chunks():
+            head += chunk
+            if len(head) >= len(text):
+                break
+        return head.startswith(text)
+
+    def __getattr__(self, name):
+        return getattr(str(self), name)
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+
+StreamResult = Union[str, bytes, SpilledOutput]
+"""A captured stream: (decoded) data or a memory-mapped spill file"""
+
+
+def release(*results: StreamResult):
+    """
+    Closes the spill files of captured streams, which are no longer used.
+    """
+    for result in results:
+        if isinstance(result, SpilledOutput):
+            result.close()
+
+
+class OutputCapture:
+    """
+    Buffers the output of a single stream.
+
+    The data is held in memory, until it exceeds the spill limit. From
+    then on it is written to a temporary file. Independent of the
+    spilling, the first bytes up to the preview limit are kept for
+    piping the output.
+    """
+
+    def __init__(
+        self,
+        binary=False,
+        spillLimit: int = SpillLimit,
+        previewLimit: int = 2000,
+        listener: Optional[Callable[[bytes], None]] = None,
+    ):
+        self.binary = binary
+        self.listener = listener
+        """Called with every captured chunk"""
+        self.spillLimit = spillLimit
+        self.previewLimit = previewLimit
+        self.size = 0
+        """The total number of captured bytes"""
+        self.head = bytearray()
+        """The first bytes of the stream"""
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=spillLimit)
+
+    def write(self, chunk: bytes):
+        """
+        Appends a chunk of data to the capture.
+        """
+        if len(self.head) < self.previewLimit:
+            self.head += chunk[: self.previewLimit - len(self.head)]
+        self.size += len(chunk)
+        self.buffer.write(chunk)
+        if self.listener is not None:
+            self.listener(chunk)
+
+    @property
+    def spilled(self) -> bool:
+        return self.size > self.spillLimit
+
+    def preview(self) -> str:
+        """
+        The beginning of the stream, limited to the preview limit.
+        """
+        return decodeOutput(bytes(self.head), binary=False)
+
+    def result(self) -> StreamResult:
+        """
+        The complete output, either in memory or memory-mapped.
+        """
+        if self.spilled:
+            self.buffer.flush()
+            return SpilledOutput(self.buffer, self.binary)
+        self.buffer.seek(0)
+        data = self.buffer.read()
+        self.buffer.close()
+        return decodeOutput(data, self.binary)
+
+
+def pump(streams: Dict[IO[bytes], OutputCapture]):
+    """
+    Reads the pipes until all of them are closed and writes the data
+    into their captures.
+
+    On POSIX systems the pipes are multiplexed in the calling thread,
+    otherwise an additional thread reads every pipe.
+    """
+    if sys.platform == "win32":
+        threads = [threading.Thread(target=drain, args=(pipe, capture)) for pipe, capture in streams.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return
+    with selectors.DefaultSelector() as selector:
+        for pipe, capture in streams.items():
+            selector.register(pipe, selectors.EVENT_READ, capture)
+        while len(selector.get_map()) > 0:
+            for key, events in selector.select():
+                chunk = os.read(key.fd, ChunkSize)
+                if chunk:
+                    key.data.write(chunk)
+                else:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+
+
+def drain(pipe: IO[bytes], capture: OutputCapture):
+    """
+    Reads a single pipe until it is closed.
+    """
+    with pipe:
+        for chunk in iter(lambda: pipe.read1(ChunkSize), b""):
+            capture.write(chunk)
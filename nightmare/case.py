@@ -5,13 +5,19 @@
 Specification for a single Test-Case. (see :py:class:`Test`)
 """
 
-from typing import Optional, Union, List, Set, Tuple, Callable
+from typing import Optional, Union, List, Set, Tuple, Callable, Dict, Iterable
 
 import os
 import re
 import sys
 import signal
-import difflib
+import shlex
+import shutil
+import time
+import json
+import hashlib
+import asyncio
+import statistics
 import subprocess
 import pathlib
 
@@ -19,7 +25,31 @@ from enum import Enum
 
 import threading
 
-from .utils import TermColor, logger
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+from .utils import TermColor, logger, formatBytes, summarize
+from .diff import unifiedDiff
+from .normalize import Normalizer, Normalization, compileNormalization
+from .needles import NeedleSet, compileNeedles
+from . import golden
+from .capture import (
+    OutputCapture,
+    StreamDecoder,
+    StreamResult,
+    SpilledOutput,
+    SpillLimit,
+    ChunkSize,
+    pump,
+    decodeOutput,
+    release,
+)
+from .snapshot import SnapshotStore
+from .badwords import WordScanner, WordIndex, DefaultIndex
+from .walk import findFiles
 
 
 class TestState(Enum):
@@ -101,6 +131,139 @@ Currently the following types can be handled:
 """
 
 
+ShellSpecial = re.compile(r"[|&;<>()$`\\*?\[\]#~{}!\n]")
+"""
+Characters with a special meaning to the shell. Commands containing
+any of them are always executed by the shell.
+"""
+
+ShellBuiltins = {"echo", "printf", "test", "[", "time", "kill", "pwd", "type", "command"}
+"""
+Commands which are builtins of the shell and also programs on the PATH.
+Their options and output differ (e.g. the escapes of `echo` or the
+report of `time`), they are always executed by the shell.
+"""
+
+CancelLock = threading.Lock()
+"""
+Orders cancelling a test against starting it and its commands, a test
+is cancelled from another thread than it runs in.
+"""
+
+
+def splitCommand(cmd: str, shell: Optional[bool] = None) -> Optional[List[str]]:
+    """
+    Splits a command into its arguments, if it can be executed without a
+    shell.
+
+    With `shell` set to None, simple commands (no shell special
+    characters, no variable assignment, an executable on the PATH, which
+    is not also a shell builtin) are detected automatically. Returns
+    None, if the shell is required.
+    """
+    if shell or (shell is None and (sys.platform == "win32" or ShellSpecial.search(cmd) is not None)):
+        return None
+    try:
+        argv = shlex.split(cmd)
+    except ValueError:
+        return None
+    if shell is None and (len(argv) == 0 or "=" in argv[0] or argv[0] in ShellBuiltins or shutil.which(argv[0]) is None):
+        return None
+    return argv
+
+
+def rssBytes(maxrss: int) -> int:
+    """
+    Converts the `ru_maxrss` of a `resource.struct_rusage` into bytes.
+    """
+    # Linux reports KiB, macOS reports bytes
+    return maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def inheritedRSS() -> Optional[int]:
+    """
+    The peak resident set size of nightmare in bytes, None if unknown.
+
+    Until the DUT is executed, its process is a copy of nightmare. The
+    kernel counts this copy into the peak RSS of the process, so a DUT
+    with a smaller peak is reported with about this size.
+    """
+    if resource is None:
+        return None
+    return rssBytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+class ResourceUsage:
+    """
+    The resources consumed by the process tree of a test.
+
+    The peak RSS has a floor: the memory of nightmare, which the process
+    holds before the DUT is executed. (see :py:func:`inheritedRSS`) A
+    peak at or below the floor only tells, that the DUT used no more.
+    """
+
+    def __init__(
+        self,
+        wall: float = 0.0,
+        user: Optional[float] = None,
+        system: Optional[float] = None,
+        maxRSS: Optional[int] = None,
+        rssFloor: Optional[int] = None,
+    ):
+        self.wall = wall
+        """Wall-clock duration in seconds"""
+        self.user = user
+        """User CPU time in seconds"""
+        self.system = system
+        """System CPU time in seconds"""
+        self.maxRSS = maxRSS
+        """Peak resident set size in bytes"""
+        self.rssFloor = rssFloor
+        """The RSS of nightmare inherited by the process, hiding smaller peaks of the DUT"""
+
+    @property
+    def cpu(self) -> Optional[float]:
+        """The total CPU time in seconds"""
+        if self.user is None or self.system is None:
+            return None
+        return self.user + self.system
+
+    @property
+    def hiddenRSS(self) -> bool:
+        """Flag, set if the peak RSS of the DUT is hidden by the floor"""
+        return self.maxRSS is not None and self.rssFloor is not None and self.maxRSS <= self.rssFloor
+
+    def record(self, rusage, rssFloor: Optional[int] = None):
+        """
+        Takes the CPU times and the peak RSS from a `resource.struct_rusage`.
+        """
+        self.user = rusage.ru_utime
+        self.system = rusage.ru_stime
+        self.maxRSS = rssBytes(rusage.ru_maxrss)
+        self.rssFloor = rssFloor
+
+    def add(self, other: "ResourceUsage"):
+        """
+        Accumulates the usage of consecutive processes.
+        """
+        self.wall += other.wall
+        if other.user is not None:
+            self.user = (self.user or 0.0) + other.user
+            self.system = (self.system or 0.0) + other.system
+        if other.maxRSS is not None:
+            self.maxRSS = max(self.maxRSS or 0, other.maxRSS)
+        if other.rssFloor is not None:
+            self.rssFloor = max(self.rssFloor or 0, other.rssFloor)
+
+    def __str__(self):
+        text = f"{self.wall:.3f}s"
+        if self.cpu is not None:
+            text += f" (cpu {self.cpu:.3f}s)"
+        if self.maxRSS is not None:
+            text += f" {'<=' if self.hiddenRSS else ''}{formatBytes(self.maxRSS)}"
+        return text
+
+
 class Command:
     """
     Wrapper for shell commands.
@@ -108,28 +271,166 @@ class Command:
     Executes and buffers the output of a shell command.
     """
 
-    def __init__(self, cmd: str, binary=False):
+    def __init__(
+        self, cmd: str, binary=False, shell: Optional[bool] = None, pipeLimit: int = 2000, spillLimit: int = SpillLimit
+    ):
         self.cmd = cmd
-        self.out = ""
-        self.err = ""
+        self.argv = splitCommand(cmd, shell)
+        """The arguments for a direct execution, None if the shell is used"""
+        self.out: StreamResult = ""
+        self.err: StreamResult = ""
+        self.outHead = ""
+        """The beginning of stdout, limited to the pipe limit"""
+        self.errHead = ""
+        """The beginning of stderr, limited to the pipe limit"""
+        self.pipeLimit = pipeLimit
+        self.spillLimit = spillLimit
         self.ret = 0
         self.killed = False
         self.binary = binary
+        self.proc = None
+        self.cancelled = False
+        self.killGrace = 0.5
+        """Time between SIGTERM and SIGKILL, when the process gets killed"""
+        self.matchers: Tuple[Optional["StreamMatcher"], Optional["StreamMatcher"]] = (None, None)
+        """Matchers for stdout and stderr, checking the output while it is streamed"""
+        self.aborted = False
+        """Flag, set if the process was killed because a matcher failed"""
+        self.usage = ResourceUsage()
+        """The resources used by the process"""
+        self.cpus: Optional[Set[int]] = None
+        """The CPUs the process is pinned to, None for no restriction"""
+        self.rssFloor: Optional[int] = None
+        """The RSS of nightmare, when the process was started (see :py:func:`inheritedRSS`)"""
+
+    def watch(self, stdout: Optional["StreamMatcher"], stderr: Optional["StreamMatcher"]):
+        """
+        Checks stdout and stderr while they are streamed. The process
+        gets killed as soon as one of the matchers fails.
+        """
+        self.matchers = (stdout, stderr)
+
+    def listener(self, matcher: "StreamMatcher") -> Callable[[bytes], None]:
+        """
+        Creates a capture listener, feeding a matcher.
+        """
+        decoder = StreamDecoder(self.binary)
+
+        def listen(chunk: bytes):
+            if matcher.feed(decoder.decode(chunk)) is False and not self.aborted:
+                self.abort()
+
+        return listen
+
+    def abort(self):
+        """
+        Aborts the process, because the output failed a matcher.
+        """
+        self.aborted = True
+        self.killTree()
+
+    def killTree(self):
+        """
+        Kills the process tree immediately, without a grace period.
+        """
+        if sys.platform == "win32":
+            subprocess.Popen(["taskkill", "/F", "/T", "/PID", str(self.proc.pid)]).communicate()
+        else:
+            self.sendSignal(signal.SIGKILL)
+
+    def pin(self):
+        """
+        Pins the calling process to the CPU set of the command.
+        Executed in the child process, before the DUT is started.
+        """
+        os.sched_setaffinity(0, self.cpus)
+
+    @property
+    def preexec(self) -> Optional[Callable[[], None]]:
+        """The function executed in the child process before the DUT"""
+        if self.cpus is None or not hasattr(os, "sched_setaffinity"):
+            return None
+        return self.pin
+
+    def capture(self) -> Tuple[OutputCapture, OutputCapture]:
+        """
+        Creates the captures for stdout and stderr.
+        """
+        return tuple(
+            OutputCapture(
+                self.binary,
+                spillLimit=self.spillLimit,
+                previewLimit=2 * self.pipeLimit,
+                listener=None if matcher is None else self.listener(matcher),
+            )
+            for matcher in self.matchers
+        )
+
+    def collect(self, out: OutputCapture, err: OutputCapture):
+        """
+        Stores the results of the captures.
+        """
+        self.out, self.err = out.result(), err.result()
+        self.outHead, self.errHead = out.preview(), err.preview()
 
     def commandFunc(self):
         """
         Creates a new subprocess and buffers stdout and stderr.
+
+        The process is started in a new session, its process group
+        contains the whole process tree of the DUT.
         """
-        self.proc = subprocess.Popen(
-            self.cmd,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            universal_newlines=not self.binary,
-            shell=True,
-            cwd=os.getcwd(),
-        )
-        self.out, self.err = self.proc.communicate()
-        self.ret = self.proc.wait()
+        if self.cancelled:
+            return
+        self.rssFloor = inheritedRSS()
+        start = time.perf_counter()
+        try:
+            self.proc = subprocess.Popen(
+                self.cmd if self.argv is None else self.argv,
+                stderr=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                shell=self.argv is None,
+                cwd=os.getcwd(),
+                start_new_session=True,
+                preexec_fn=self.preexec,
+            )
+        except OSError as e:
+            self.refuse(e)
+            return
+        if self.cancelled:
+            self.killTree()
+        out, err = self.capture()
+        pump({self.proc.stdout: out, self.proc.stderr: err})
+        self.ret = self.wait()
+        self.usage.wall = time.perf_counter() - start
+        self.collect(out, err)
+
+    def refuse(self, e: OSError):
+        """
+        Records a command, whose process could not be started, like a
+        shell would: return code 126 if the program can not be
+        executed, 127 if it is missing, the reason on stderr.
+        """
+        self.ret = 126 if isinstance(e, PermissionError) else 127
+        message = f"{self.argv[0] if self.argv else self.cmd}: {e.strerror or e}\n"
+        self.err = message.encode() if self.binary else message
+        self.errHead = message
+
+    def wait(self) -> int:
+        """
+        Waits for the process to exit and reaps it.
+
+        Where available, the process is reaped with `os.wait4` to record
+        the resource usage of the whole process tree.
+        """
+        if hasattr(os, "wait4"):
+            try:
+                pid, status, rusage = os.wait4(self.proc.pid, 0)
+                self.proc.returncode = os.waitstatus_to_exitcode(status)
+                self.usage.record(rusage, self.rssFloor)
+            except ChildProcessError:
+                pass
+        return self.proc.wait()
 
     def execute(self, timeout: float) -> TestState:
         """
@@ -142,20 +443,291 @@ class Command:
         self.thread = threading.Thread(target=self.commandFunc)
         self.thread.start()
         self.thread.join(timeout)
-        if self.proc is not None and self.proc.poll() is None:
-            if sys.platform == "win32":
-                subprocess.Popen(["taskkill", "/F", "/T", "/PID", str(self.proc.pid)]).communicate()
+        if self.thread.is_alive():
+            # Either the DUT is still running, or one of its children
+            # keeps the output pipes open
+            if self.proc is not None:
+                self.terminate()
+            self.thread.join()
+            return TestState.Waiting if self.cancelled else TestState.Timeout
+        if self.cancelled:
+            return TestState.Waiting
+        return TestState.Success
+
+    def sendSignal(self, sig: int) -> bool:
+        """
+        Sends a signal to the process group of the command.
+
+        Returns False, if there is no process left in the group.
+        """
+        try:
+            os.killpg(self.proc.pid, sig)
+            return True
+        except ProcessLookupError:
+            return False
+
+    def terminate(self):
+        """
+        Kills the whole process tree and waits until the command thread
+        has reaped the process.
+
+        The process group gets a SIGTERM first and a SIGKILL after the
+        grace period, to take down every child that is still running.
+        """
+        if sys.platform == "win32":
+            subprocess.Popen(["taskkill", "/F", "/T", "/PID", str(self.proc.pid)]).communicate()
+        elif self.sendSignal(signal.SIGTERM):
+            self.thread.join(self.killGrace)
+            if self.thread.is_alive():
+                self.sendSignal(signal.SIGKILL)
+        self.thread.join()
+
+    def kill(self):
+        """
+        Cancels the command.
+
+        A running process will be killed, a command that has not been
+        started yet will never spawn its process.
+        """
+        self.cancelled = True
+        if self.proc is not None:
+            self.terminate()
+
+
+class AsyncCommand(Command):
+    """
+    Wrapper for shell commands, executed on an asyncio event loop.
+
+    Instead of a thread per process, a single event loop can supervise
+    any number of concurrent commands. Methods controlling the process
+    are coroutines.
+
+    The event loop reaps the processes, so only the wall time is
+    recorded: the CPU time and the peak RSS are not measured, and the
+    performance expectations on them fail.
+    """
+
+    async def terminate(self):
+        """
+        Kills the whole process tree and reaps the process.
+        (see :py:meth:`Command.terminate`)
+        """
+        if sys.platform == "win32":
+            subprocess.Popen(["taskkill", "/F", "/T", "/PID", str(self.proc.pid)]).communicate()
+        elif self.sendSignal(signal.SIGTERM):
+            try:
+                await asyncio.wait_for(self.proc.wait(), self.killGrace)
+            except asyncio.TimeoutError:
+                pass
+            self.sendSignal(signal.SIGKILL)
+        await self.proc.wait()
+
+    async def kill(self):
+        """
+        Cancels the command.
+        """
+        self.cancelled = True
+        if self.proc is not None:
+            await self.terminate()
+
+    async def aexecute(self, timeout: float) -> TestState:
+        """
+        Executes the command as a subprocess of the running event loop.
+
+        If the process takes longer than the specified timeout,
+        the process will be killed.
+        """
+        start = time.perf_counter()
+        options = dict(
+            stderr=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=os.getcwd(),
+            start_new_session=True,
+            preexec_fn=self.preexec,
+        )
+        try:
+            if self.argv is None:
+                self.proc = await asyncio.create_subprocess_shell(self.cmd, **options)
             else:
-                childProc = int(
-                    subprocess.check_output(f"pgrep -P {self.proc.pid}", shell=True, universal_newlines=True).strip()
-                )
-                os.kill(childProc, signal.SIGKILL)
-                if self.proc.poll() is None:
-                    os.kill(self.proc.pid, signal.SIGTERM)
-                # os.killpg(os.getpgid(self.proc.pid), signal.SIGTERM)
+                self.proc = await asyncio.create_subprocess_exec(*self.argv, **options)
+        except OSError as e:
+            self.refuse(e)
+            return TestState.Success
+        out, err = self.capture()
+        communication = asyncio.ensure_future(self.communicate(out, err))
+        try:
+            await asyncio.wait_for(asyncio.shield(communication), timeout)
+        except asyncio.TimeoutError:
+            await self.terminate()
+            await asyncio.gather(communication, return_exceptions=True)
+            self.usage.wall = time.perf_counter() - start
             return TestState.Timeout
+        except asyncio.CancelledError:
+            await asyncio.shield(self.kill())
+            await asyncio.gather(communication, return_exceptions=True)
+            raise
+        self.collect(out, err)
+        self.ret = self.proc.returncode
+        self.usage.wall = time.perf_counter() - start
         return TestState.Success
 
+    async def communicate(self, out: OutputCapture, err: OutputCapture):
+        """
+        Reads stdout and stderr into their captures and waits for the
+        process to exit.
+        """
+
+        async def drain(reader: asyncio.StreamReader, capture: OutputCapture):
+            while True:
+                chunk = await reader.read(ChunkSize)
+                if not chunk:
+                    break
+                capture.write(chunk)
+
+        await asyncio.gather(drain(self.proc.stdout, out), drain(self.proc.stderr, err))
+        await self.proc.wait()
+
+
+class StreamMatcher:
+    """
+    Incremental check of an expectation, while the output is streamed.
+
+    The output is fed chunk by chunk into the matcher. As soon as the
+    result of the check can no longer change, the matcher settles its
+    verdict. A verdict of None means undecided.
+    """
+
+    def __init__(self):
+        self.verdict: Optional[bool] = None
+        """The settled result of the check"""
+
+    def feed(self, chunk: str) -> Optional[bool]:
+        """
+        Consumes the next chunk of the output and returns the verdict.
+        """
+        return self.verdict
+
+
+class AllMatcher(StreamMatcher):
+    """
+    Combines matchers, all of them must match. (A list of expectations)
+    """
+
+    def __init__(self, matchers: List[StreamMatcher]):
+        StreamMatcher.__init__(self)
+        self.matchers = matchers
+
+    def feed(self, chunk: str) -> Optional[bool]:
+        verdicts = [m.feed(chunk) for m in self.matchers]
+        if False in verdicts:
+            self.verdict = False
+        elif all(verdicts):
+            self.verdict = True
+        return self.verdict
+
+
+class AnyMatcher(StreamMatcher):
+    """
+    Combines matchers, one of them must match. (A set of expectations)
+    """
+
+    def __init__(self, matchers: List[StreamMatcher]):
+        StreamMatcher.__init__(self)
+        self.matchers = matchers
+
+    def feed(self, chunk: str) -> Optional[bool]:
+        verdicts = [m.feed(chunk) for m in self.matchers]
+        if True in verdicts:
+            self.verdict = True
+        elif all(v is False for v in verdicts):
+            self.verdict = False
+        return self.verdict
+
+
+class ContainsMatcher(StreamMatcher):
+    """
+    Finds texts in a streamed output. With `present` set to False, the
+    texts must not be found.
+    """
+
+    def __init__(self, needles: NeedleSet, present=True):
+        StreamMatcher.__init__(self)
+        self.needles = needles
+        self.missing = set(needles.texts)
+        self.present = present
+        self.overlap = max((len(t) for t in needles.texts), default=1) - 1
+        self.tail = ""
+
+    def feed(self, chunk: str) -> Optional[bool]:
+        if self.verdict is None:
+            # Texts might be split between two chunks
+            text = self.tail + chunk
+            found = self.needles.find(text, stopAtFirst=not self.present) & self.missing
+            self.missing -= found
+            self.tail = text[-self.overlap :] if self.overlap > 0 else ""
+            if self.present and len(self.missing) == 0:
+                self.verdict = True
+            elif not self.present and len(found) > 0:
+                self.verdict = False
+        return self.verdict
+
+
+class StartswithMatcher(StreamMatcher):
+    """
+    Checks the beginning of a streamed output.
+    """
+
+    def __init__(self, text: str):
+        StreamMatcher.__init__(self)
+        self.text = text
+        self.head = ""
+
+    def feed(self, chunk: str) -> Optional[bool]:
+        if self.verdict is None:
+            self.head += chunk[: len(self.text) - len(self.head)]
+            if not self.text.startswith(self.head):
+                self.verdict = False
+            elif len(self.head) == len(self.text):
+                self.verdict = True
+        return self.verdict
+
+
+LineBreaks = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+"""Characters that end a line (see :py:meth:`str.splitlines`)"""
+
+
+class LinesMatcher(StreamMatcher):
+    """
+    Compares a streamed output line by line against the expected lines
+    of a plain string expectation.
+
+    Only settles on a mismatch, the final comparison strips trailing
+    whitespace from the complete output.
+    """
+
+    def __init__(self, expLines: Stringified, ignoreEmptyLines=False):
+        StreamMatcher.__init__(self)
+        self.ignoreEmptyLines = ignoreEmptyLines
+        self.expLines = [line for line in expLines if not ignoreEmptyLines or line != ""]
+        self.lineNr = 0
+        self.partial = ""
+
+    def feed(self, chunk: str) -> Optional[bool]:
+        if self.verdict is None:
+            lines = (self.partial + chunk).splitlines(True)
+            self.partial = lines.pop() if len(lines) > 0 and lines[-1][-1] not in LineBreaks else ""
+            for line in lines:
+                line = line.splitlines()[0]
+                if self.ignoreEmptyLines and line == "":
+                    continue
+                if self.lineNr < len(self.expLines):
+                    if line.rstrip() != self.expLines[self.lineNr].rstrip():
+                        self.verdict = False
+                elif line.strip() != "":
+                    self.verdict = False
+                self.lineNr += 1
+        return self.verdict
+
 
 class Expectation:
     """
@@ -171,21 +743,42 @@ class Expectation:
     def __call__(self, out: StreamOutput) -> bool:
         return True
 
+    def matcher(self) -> Optional[StreamMatcher]:
+        """
+        Creates a matcher, to check the output while it is streamed.
+        Returns None, if the expectation can only check the complete
+        output.
+        """
+        return None
+
 
 class ExpectFile(Expectation):
     """
     Standard Expectation to compare the output against the contents of
     a file.
+
+    The file is only opened to check the output. With a digest
+    `manifest`, it is compared by its hash. (see
+    :py:mod:`nightmare.golden`)
     """
 
-    def __init__(self, fname: os.PathLike):
-        self.exp = open(fname, "rb").read()
+    def __init__(self, fname: os.PathLike, manifest: Optional[os.PathLike] = None):
+        self.fname = os.path.abspath(fname)
+        self.manifest = os.path.abspath(manifest) if manifest is not None else None
 
     def __call__(self, out: StreamOutput) -> bool:
-        return self.exp == out
+        return golden.compareOutput(self.fname, out, golden.loadManifest(self.manifest))
+
+    def fingerprint(self) -> list:
+        """
+        Identifies the expectation by the content of the expected file.
+        (see :py:func:`nightmare.cache.fingerprint`)
+        """
+        return ["ExpectFile", self.fname, golden.goldenDigest(self.fname, golden.loadManifest(self.manifest))]
 
     def __str__(self):
-        return self.exp
+        with open(self.fname, "rb") as fHnd:
+            return fHnd.read().decode(errors="replace")
 
 
 class Regex(Expectation):
@@ -200,28 +793,69 @@ class Regex(Expectation):
         return self.regex.match(str(out)) != None
 
 
-class Contains(Expectation):
+class Needles(Expectation):
     """
-    Syntactic sugar Expectation for finding multiple texts in the output
+    Base of the Expectations searching multiple texts in the output.
+
+    The texts are searched in a single pass. (see
+    :py:class:`nightmare.needles.NeedleSet`)
     """
 
     def __init__(self, *texts: str):
         self.texts = texts
+        self._needles: Optional[NeedleSet] = None
+
+    @property
+    def needles(self) -> NeedleSet:
+        """The texts, compiled on first use"""
+        if self._needles is None:
+            self._needles = compileNeedles(self.texts)
+        return self._needles
 
     def __call__(self, out: StreamOutput) -> bool:
-        return all(text in out for text in self.texts)
+        return self.verdict(self.needles.find(out))
+
+    def verdict(self, found: Set[str]) -> bool:
+        """
+        Decides on the texts found in the output.
+        """
+        return True
 
+    def fingerprint(self) -> list:
+        return [type(self).__name__, list(self.texts)]
 
-class ContainsNot(Expectation):
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(repr(t) for t in self.texts)})"
+
+
+class Contains(Needles):
     """
     Syntactic sugar Expectation for finding multiple texts in the output
     """
 
-    def __init__(self, *texts: str):
-        self.texts = texts
+    def verdict(self, found: Set[str]) -> bool:
+        missing = [text for text in self.texts if text not in found]
+        if len(missing) > 0:
+            logger.log(f"{self!r}: missing {', '.join(repr(t) for t in missing)}")
+        return len(missing) == 0
+
+    def matcher(self) -> Optional[StreamMatcher]:
+        return ContainsMatcher(self.needles)
 
-    def __call__(self, out: StreamOutput) -> bool:
-        return all(text not in out for text in self.texts)
+
+class ContainsNot(Needles):
+    """
+    Syntactic sugar Expectation for finding multiple texts in the output
+    """
+
+    def verdict(self, found: Set[str]) -> bool:
+        hits = [text for text in self.texts if text in found]
+        if len(hits) > 0:
+            logger.log(f"{self!r}: found {', '.join(repr(t) for t in hits)}")
+        return len(hits) == 0
+
+    def matcher(self) -> Optional[StreamMatcher]:
+        return ContainsMatcher(self.needles, present=False)
 
 
 class Startswith(Expectation):
@@ -235,6 +869,9 @@ class Startswith(Expectation):
     def __call__(self, out: StreamOutput) -> bool:
         return out.startswith(self.text)
 
+    def matcher(self) -> Optional[StreamMatcher]:
+        return StartswithMatcher(self.text)
+
 
 class NonZero(Expectation):
     """
@@ -254,6 +891,28 @@ class Negative(Expectation):
         return int(out) < 0
 
 
+class Snapshot(Expectation):
+    """
+    Compares an output with its recorded snapshot. The snapshots are
+    recorded and verified by the store of the suite. (see
+    :py:class:`nightmare.snapshot.SnapshotStore`)
+    """
+
+    def __call__(self, out: StreamOutput) -> bool:
+        # Snapshots are checked by the test (see :py:meth:`Test.checkSnapshot`)
+        return False
+
+    def fingerprint(self):
+        """
+        Snapshots can change without changing the test, their results
+        are never cached. (see :py:func:`nightmare.cache.fingerprint`)
+        """
+        raise TypeError("Snapshots are not cached")
+
+    def __repr__(self):
+        return "Snapshot()"
+
+
 class Stringifier:
     """
     To give the user better information where the output isn't valid
@@ -290,15 +949,135 @@ class CompareFiles(Expectation):
     The comparison will be binary.
     """
 
-    def __init__(self, expect_file: os.PathLike, out_file: os.PathLike):
+    def __init__(self, expect_file: os.PathLike, out_file: os.PathLike, manifest: Optional[os.PathLike] = None):
         self.expect = expect_file
         self.out = out_file
+        self.manifest = manifest
 
     def __call__(self, out: StreamOutput) -> bool:
         # Since we want to compare files, actual output is ignored
-        expect = open(self.expect, "rb").read()
-        out = open(self.out, "rb").read()
-        return expect == out
+        return golden.compareFiles(self.expect, self.out, golden.loadManifest(self.manifest))
+
+    def fingerprint(self) -> list:
+        """
+        Identifies the expectation by the content of the expected file.
+        (see :py:func:`nightmare.cache.fingerprint`)
+        """
+        return ["CompareFiles", self.expect, self.out, golden.goldenDigest(self.expect, golden.loadManifest(self.manifest))]
+
+
+class PerformanceExpectation(Expectation):
+    """
+    Expectations on the resources a DUT consumes. Instead of an output
+    stream, they are called with the :py:class:`ResourceUsage` of the
+    test run. (see the `performance` field of :py:class:`Test`)
+    """
+
+    def __init__(self, limit: float):
+        self.limit = limit
+
+    def measure(self, usage: ResourceUsage) -> Optional[float]:
+        """
+        Extracts the checked value from the resource usage.
+        """
+        return None
+
+    def __call__(self, usage: ResourceUsage) -> bool:
+        value = self.measure(usage) if usage is not None else None
+        if value is None:
+            logger.log(f"{self!r}: not measured")
+            return False
+        if value > self.limit:
+            logger.log(f"{self!r}: {self.format(value)} exceeds {self.format(self.limit)}")
+            return False
+        return True
+
+    def format(self, value: float) -> str:
+        return f"{value:.3f}s"
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.limit!r})"
+
+
+class MaxDuration(PerformanceExpectation):
+    """
+    The wall-clock duration of the test must not exceed a number of
+    seconds.
+    """
+
+    def measure(self, usage: ResourceUsage) -> Optional[float]:
+        return usage.wall
+
+
+class MaxCPU(PerformanceExpectation):
+    """
+    The CPU time (user and system) of the test must not exceed a number
+    of seconds.
+    """
+
+    def measure(self, usage: ResourceUsage) -> Optional[float]:
+        return usage.cpu
+
+
+class MaxRSS(PerformanceExpectation):
+    """
+    The peak resident set size of the test must not exceed a number of
+    bytes.
+    """
+
+    def measure(self, usage: ResourceUsage) -> Optional[float]:
+        return usage.maxRSS
+
+    def __call__(self, usage: ResourceUsage) -> bool:
+        if usage is not None and usage.hiddenRSS and usage.maxRSS > self.limit:
+            logger.log(f"{self!r}: the peak is hidden by the {formatBytes(usage.rssFloor)} inherited from nightmare")
+            return False
+        return super().__call__(usage)
+
+    def format(self, value: float) -> str:
+        return formatBytes(value)
+
+
+class NoSlowerThan(PerformanceExpectation):
+    """
+    Relative performance expectation against a baseline.
+
+    The baseline is either a number of seconds, or the name of a JSON
+    file mapping keys to seconds (e.g. from an earlier run) or to the
+    results of a :py:class:`Benchmark`, which are compared by median. The measured
+    value may exceed the baseline by the tolerance (default 10%).
+    Use `metric="cpu"` to compare the CPU time instead of the duration.
+    """
+
+    def __init__(self, baseline: Union[float, os.PathLike], tolerance: float = 0.10, key: str = None, metric="wall"):
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.key = key
+        self.metric = metric
+
+    @property
+    def limit(self) -> float:
+        baseline = self.baseline
+        if isinstance(baseline, (str, os.PathLike)):
+            with open(baseline) as fHnd:
+                baseline = json.load(fHnd)[self.key]
+            if isinstance(baseline, dict):
+                # The results of a benchmark (see :py:meth:`Benchmark.results`)
+                baseline = baseline[self.metric]["median"]
+        return float(baseline) * (1.0 + self.tolerance)
+
+    def measure(self, usage: ResourceUsage) -> Optional[float]:
+        return usage.cpu if self.metric == "cpu" else usage.wall
+
+    def fingerprint(self) -> list:
+        """
+        Identifies the expectation by its limit, which is read from the
+        baseline file. (see :py:func:`nightmare.cache.fingerprint`)
+        """
+        return ["NoSlowerThan", self.limit, self.metric]
+
+    def __repr__(self):
+        return f"NoSlowerThan({self.baseline!r}, tolerance={self.tolerance!r}, key={self.key!r}, metric={self.metric!r})"
 
 
 class Test:
@@ -330,9 +1109,16 @@ class Test:
         diff=None,
         state=TestState.Waiting,
         binary=False,
+        shell=None,
+        performance=None,
+        normalize=None,
     ):
         self.name = name
         """The name of the test"""
+        self.occurrence = 0
+        """The number of earlier tests with the same name in the suite"""
+        self.declared: Dict[str, object] = {}
+        """The values of the testbench for the fields overridden from the command line"""
         self.descr = description
         """The description of the test"""
         self.cmd = command
@@ -344,6 +1130,14 @@ class Test:
         self.expectRetCode = returnCode
         self.timeout = timeout
         """The expected return code"""
+        self.expectPerformance = performance
+        """The expected resource usage (see :py:class:`PerformanceExpectation`)"""
+        self.normalize: Optional[List[Normalizer]] = normalize
+        """The normalization stages applied to the output before it is checked"""
+        self.suiteNormalize: List[Normalizer] = []
+        """The normalization stages of the suite, applied before the stages of the test"""
+        self.normalization: Optional[Normalization] = None
+        """The compiled normalization stages"""
         self.DUT = DUT
         """The Device under Test - could be None"""
         self.output = ""
@@ -367,35 +1161,119 @@ class Test:
         self.ignoreEmptyLines = False
         """Ignore empty lines Flag"""
         self.pipeLimit = 2000
-        """Work in binary mode"""
+        """Number of bytes kept for piping the output"""
+        self.spillLimit = SpillLimit
+        """Number of bytes, after which the output is spilled to disk"""
         self.binary: bool = binary
+        self.shell: Optional[bool] = shell
+        """Flag, force (True) or avoid (False) the shell. Detected for each command if None"""
+        self.earlyKill = False
+        """Flag, kill the DUT as soon as the streamed output fails an expectation"""
+        self.usage: Optional[ResourceUsage] = None
+        """The resources used by the last run"""
+        self.command: Optional[Command] = None
+        """The currently executed command"""
+        self.cancelled = False
+        """Flag, set if the test run was cancelled"""
+        self.snapshots: Optional[SnapshotStore] = None
+        """The store of the :py:class:`Snapshot` expectations"""
+        self.cached = False
+        """Flag, set if the result was replayed from the cache"""
+        self.compiled: Dict[Tuple[str, str], ExpectationFunc] = {}
+        """The compiled 'lambda' and 'regex:' expectations, by string and line separator"""
+        self.compileError: Optional[Exception] = None
+        """The error raised while compiling the expectations"""
+
+    def compile(self) -> bool:
+        """
+        Compiles the normalization stages and the 'lambda' and 'regex:'
+        strings of the expectations once, for the current line separator.
+        (see :py:meth:`check`)
+
+        Returns False and stores the error, if an expectation is invalid.
+        """
+        self.compileError = None
+        try:
+            stages = self.suiteNormalize + (self.normalize or [])
+            self.normalization = compileNormalization(stages)
+            if self.normalization is not None and self.normalization.linesep is not None:
+                # The line ending policy overrides the line separator
+                self.linesep = self.normalization.linesep
+            for exp in [self.expectStdout, self.expectStderr, self.expectRetCode]:
+                if isinstance(exp, (str, list, set)):
+                    self.compileExpectation(exp)
+        except (SyntaxError, ValueError, TypeError, NameError, re.error) as e:
+            self.compileError = e
+            return False
+        return True
+
+    def compileExpectation(self, exp: ExpectationT):
+        """
+        Compiles the expectation strings inside of an expectation.
+        """
+        if isinstance(exp, (list, set)):
+            for e in exp:
+                self.compileExpectation(e)
+        elif isinstance(exp, str) and (exp, self.linesep) not in self.compiled:
+            if exp.startswith("lambda"):
+                self.compiled[(exp, self.linesep)] = eval(exp)
+            elif exp.startswith("regex:"):
+                self.compiled[(exp, self.linesep)] = Regex(exp[6:].replace("$n", self.linesep))
 
     def lineComparison(self, expLines: Stringified, outLines: Stringified, stream="") -> bool:
         """
         Compares to lines of strings.
 
-        Outputs a colored unified diff on stdout.
+        The expected lines are normalized like the output. Equal lines
+        are detected without building a difference. If the
+        diff is requested, a colored unified diff is logged.
+        (see :py:func:`nightmare.diff.unifiedDiff`)
         """
-        same = True
+        if self.normalization is not None:
+            # The output is already normalized (see :py:meth:`evaluate`)
+            expLines = self.normalization.normalizeLines(expLines)
         if self.ignoreEmptyLines:
-            while expLines.count("") > 0:
-                expLines.remove("")
-            while outLines.count("") > 0:
-                outLines.remove("")
-        for line in difflib.unified_diff(outLines, expLines, stream, "expectation"):
+            expLines = [line for line in expLines if line != ""]
+            outLines = [line for line in outLines if line != ""]
+        if expLines == outLines:
+            return True
+        if self.diff:
+            self.logDiff(expLines, outLines, stream)
+        return False
+
+    def logDiff(self, expLines: Stringified, outLines: Stringified, stream="", label="expectation"):
+        """
+        Logs the colored unified diff of the output and the expectation.
+        """
+        for line in unifiedDiff(outLines, expLines, stream, label):
             col = TermColor.White
             if line.startswith("+"):
-                same = False
                 col = TermColor.Green
             elif line.startswith("-"):
-                same = False
                 col = TermColor.Red
             elif line.startswith("@"):
-                same = False
                 col = TermColor.Cyan
-            if self.diff:
-                logger.log(TermColor.colorText(line.rstrip(), col))
-        return same
+            logger.log(TermColor.colorText(line.rstrip(), col))
+
+    def checkSnapshot(self, out: Optional[Union[str, int]], stream: str) -> bool:
+        """
+        Checks an output against its snapshot, or records it. (see
+        :py:class:`Snapshot`)
+
+        The recorded snapshot is only read to show the diff.
+        """
+        if self.snapshots is None:
+            logger.log(f"Sorry, but there is no snapshot store for the {stream} of {self.name}")
+            return False
+        if self.snapshots.check((self.name, self.occurrence), stream, out):
+            return True
+        digest = self.snapshots.snapshotDigest((self.name, self.occurrence), stream)
+        if digest is None:
+            logger.log(f"Sorry, but there is no snapshot of the {stream} of {self.name}")
+        elif self.diff and not self.binary:
+            recorded = decodeOutput(self.snapshots.read(digest))
+            self.logDiff(recorded.splitlines(), str(out).splitlines(), stream, "snapshot")
+        return False
 
     def check(self, exp: ExpectationT, out: Optional[Union[str, int]], stream="returnCode") -> bool:
         """
@@ -405,10 +1283,13 @@ class Test:
         - Strings prefixed with 'regex:' will be interpreted as a
           regular expression. The output is valid, if it matches the
           expression.
+        - 'lambda' and 'regex:' strings are evaluated once by
+          :py:meth:`compile`, uncompiled strings on every check.
         - lambda functions and custom :py:class:`Expectation` will be
           executed. The function should return a boolean value
           indicating the validity of the output.
         - Stringifiers will trigger a line by line comparison
+        - :py:class:`Snapshot` compares against the recorded output
         - For lists, each item will be checked individually.
           The output must be valid for all items. (AND)
         - For sets, each item will be checked individually.
@@ -418,17 +1299,22 @@ class Test:
             return True
         elif isinstance(exp, Stringifier):
             return self.lineComparison(*(exp(out)), stream=stream)
+        elif isinstance(exp, Snapshot):
+            return self.checkSnapshot(out, stream)
         elif callable(exp) or isinstance(exp, Expectation):
             return exp(out)
         elif isinstance(exp, int) and isinstance(out, int):
             return exp == out
         elif isinstance(exp, list):
-            return self.checkList(exp, out)
+            return self.checkList(exp, out, stream)
         elif isinstance(exp, set):
-            return self.checkSet(exp, out)
+            return self.checkSet(exp, out, stream)
         elif isinstance(exp, bytes):
             return exp == out
         elif isinstance(exp, str):
+            compiled = self.compiled.get((exp, self.linesep))
+            if compiled is not None:
+                return compiled(out)
             if exp.startswith("lambda"):
                 f = eval(exp)
                 return f(out)
@@ -441,26 +1327,82 @@ class Test:
                 return self.lineComparison(expLines, outLines, stream)
         return False
 
-    def checkList(self, lst: List[ExpectationT], out: Optional[Union[str, int]]) -> bool:
+    def checkList(self, lst: List[ExpectationT], out: Optional[Union[str, int]], stream="returnCode") -> bool:
         """
         Tests a list of expectations against an output
         all elements in the list must match to be successful
+
+        The texts of several :py:class:`Contains` and
+        :py:class:`ContainsNot` items are searched in a single pass.
         """
+        found = None
+        needles = [exp for exp in lst if isinstance(exp, Needles)]
+        if len(needles) > 1:
+            found = compileNeedles(text for exp in needles for text in exp.texts).find(out)
         for exp in lst:
-            if not self.check(exp, out):
+            if found is not None and isinstance(exp, Needles):
+                if not exp.verdict(found):
+                    return False
+            elif not self.check(exp, out, stream):
                 return False
         return True
 
-    def checkSet(self, st: Set[ExpectationT], out: Optional[Union[str, int]]) -> bool:
+    def checkSet(self, st: Set[ExpectationT], out: Optional[Union[str, int]], stream="returnCode") -> bool:
         """
         Tests a set of expectations against an output
         one element in the set must match to be successful
         """
         for exp in st:
-            if self.check(exp, out):
+            if self.check(exp, out, stream):
                 return True
         return False
 
+    def streamMatcher(self, exp: ExpectationT) -> Optional[StreamMatcher]:
+        """
+        Creates a matcher for an expectation, to check the output while
+        it is streamed. (see :py:meth:`check`)
+
+        Returns None, if the expectation can not be checked
+        incrementally.
+        """
+        if exp is None or self.binary:
+            return None
+        elif self.normalization is not None and self.normalization.changesText:
+            # The matchers see the raw output
+            return None
+        elif isinstance(exp, Expectation):
+            return exp.matcher()
+        elif isinstance(exp, list):
+            matchers = [self.streamMatcher(e) for e in exp]
+            matchers = [m for m in matchers if m is not None]
+            return AllMatcher(matchers) if len(matchers) > 0 else None
+        elif isinstance(exp, set):
+            matchers = [self.streamMatcher(e) for e in exp]
+            return AnyMatcher(matchers) if len(matchers) > 0 and None not in matchers else None
+        elif isinstance(exp, str) and not exp.startswith("lambda") and not exp.startswith("regex:"):
+            return LinesMatcher(exp.replace("$n", self.linesep).splitlines(), self.ignoreEmptyLines)
+        return None
+
+    def fingerprint(self) -> dict:
+        """
+        The fields which influence the evaluation of the test.
+        (see :py:class:`nightmare.cache.ResultCache`)
+        """
+        return {
+            "type": type(self).__qualname__,
+            "stdout": self.expectStdout,
+            "stderr": self.expectStderr,
+            "returnCode": self.expectRetCode,
+            "performance": self.expectPerformance,
+            "timeout": self.timeout,
+            "binary": self.binary,
+            "shell": self.shell,
+            "linesep": self.linesep,
+            "ignoreEmptyLines": self.ignoreEmptyLines,
+            "earlyKill": self.earlyKill,
+            "normalize": repr(self.suiteNormalize + (self.normalize or [])),
+        }
+
     def pipeOutputStream(self, stream, lines: List[str], color: int):
         bytes = 0
         for line in lines:
@@ -470,10 +1412,34 @@ class Test:
                 stream.write(TermColor.colorText(f"Stopped after {bytes} Bytes", fg=TermColor.Yellow) + "\n")
                 break
 
-    def runCmd(self, command: str):
+    def createCommand(self, command: str, commandType: type = None) -> Optional["Command"]:
         """
-        Runs the DUT shell command and performs individual checks for
-        stdout, stderr and the returncode.
+        Creates the command object for a shell command by replacing the
+        `$DUT` pattern.
+
+        If the command needs a DUT, but none is set, the test state
+        is set to error and no command is created.
+        """
+        commandType = Command if commandType is None else commandType
+        if "$DUT" in command:
+            if self.DUT is None:
+                self.state = TestState.Error
+                return None
+            else:
+                return commandType(
+                    cmd=str(command).replace("$DUT", self.DUT),
+                    binary=self.binary,
+                    shell=self.shell,
+                    pipeLimit=self.pipeLimit,
+                    spillLimit=self.spillLimit,
+                )
+        else:
+            return commandType(cmd=str(command), shell=self.shell, pipeLimit=self.pipeLimit, spillLimit=self.spillLimit)
+
+    def evaluate(self, _cmd: "Command", cmdRet: TestState):
+        """
+        Performs individual checks for stdout, stderr and the returncode
+        of an executed command. The output streams are normalized first.
 
         If requested the output of the command will be piped through
         their respective streams.
@@ -482,25 +1448,24 @@ class Test:
         assertions or segmentation faults will deduce whether or not the
         program terminated correctly or not.
         """
-        if "$DUT" in command:
-            if self.DUT is None:
-                self.state = TestState.Error
-                return
-            else:
-                _cmd = Command(cmd=str(command).replace("$DUT", self.DUT), binary=self.binary)
-        else:
-            _cmd = Command(cmd=str(command))
-        cmdRet = _cmd.execute(self.timeout)
         if cmdRet == TestState.Success:
+            self.release()
             self.output = _cmd.out
             self.error = _cmd.err
             self.retCode = _cmd.ret
+            output, error = self.output, self.error
+            if self.normalization is not None and not self.binary:
+                output, error = self.normalizeOutput(output), self.normalizeOutput(error)
             if (
                 self.check(self.expectRetCode, self.retCode)
-                and self.check(self.expectStdout, self.output, "stdout")
-                and self.check(self.expectStderr, self.error, "stderr")
-            ):
+                and self.check(self.expectStdout, output, "stdout")
+                and self.check(self.expectStderr, error, "stderr")
+                and self.check(self.expectPerformance, self.usage, "performance")
+            ) and not _cmd.aborted:
                 self.state = TestState.Success
+            elif _cmd.aborted:
+                # The DUT was killed, the signal does not indicate a crash
+                self.state = TestState.Fail
             else:
                 if "Assertion" in self.error or "assertion" in self.error:
                     self.state = TestState.Assertion
@@ -515,15 +1480,73 @@ class Test:
                     self.state = TestState.Fail
             if (self.pipe) or (self.outputOnFail and self.state is TestState.Fail):
                 sys.stdout.write(TermColor.colorText(f"{self.retCode}", fg=TermColor.Yellow) + " ")
-                self.pipeOutputStream(sys.stdout, self.output.splitlines(), TermColor.Green)
-                self.pipeOutputStream(sys.stderr, self.error.splitlines(), TermColor.Red)
+                self.pipeOutputStream(sys.stdout, _cmd.outHead.splitlines(), TermColor.Green)
+                self.pipeOutputStream(sys.stderr, _cmd.errHead.splitlines(), TermColor.Red)
+            if output is not self.output:
+                release(output, error)
         else:
+            release(_cmd.out, _cmd.err)
             self.state = cmdRet
 
+    def normalizeOutput(self, out: StreamResult) -> StreamResult:
+        """
+        Normalizes an output stream. A spilled output is normalized
+        block by block. (see :py:meth:`nightmare.normalize.Normalization.normalizeSpilled`)
+        """
+        if isinstance(out, SpilledOutput):
+            return self.normalization.normalizeSpilled(out, self.spillLimit)
+        return self.normalization(str(out))
+
+    def release(self):
+        """
+        Closes the spill files of the kept output, before it is replaced.
+        """
+        release(self.output, self.error)
+
+    def runCmd(self, command: str):
+        """
+        Runs the DUT shell command and evaluates its output.
+        (see :py:meth:`evaluate`)
+        """
+        _cmd = self.createCommand(command)
+        if _cmd is None:
+            return
+        if self.earlyKill:
+            _cmd.watch(self.streamMatcher(self.expectStdout), self.streamMatcher(self.expectStderr))
+        with CancelLock:
+            if self.cancelled:
+                return
+            self.command = _cmd
+        cmdRet = _cmd.execute(self.timeout)
+        with CancelLock:
+            self.command = None
+        self.usage.add(_cmd.usage)
+        self.evaluate(_cmd, cmdRet)
+
+    async def arunCmd(self, command: str):
+        """
+        Runs the DUT shell command on the asyncio event loop and
+        evaluates its output.
+        (see :py:meth:`evaluate`)
+        """
+        _cmd = self.createCommand(command, AsyncCommand)
+        if _cmd is None:
+            return
+        if self.earlyKill:
+            _cmd.watch(self.streamMatcher(self.expectStdout), self.streamMatcher(self.expectStderr))
+        cmdRet = await _cmd.aexecute(self.timeout)
+        self.usage.add(_cmd.usage)
+        self.evaluate(_cmd, cmdRet)
+
     def run(self) -> TestState:
         """
         Execute this test case.
+
+        A test cancelled before it was started is not executed, it stays
+        in the waiting state.
         """
+        if self.cancelledBeforeStart():
+            return self.state
         if self.state == TestState.Disabled:
             return TestState.Disabled
         if self.state == TestState.InfoOnly:
@@ -532,35 +1555,83 @@ class Test:
             else:
                 print(f"{self.name} - {self.descr}")
             return TestState.InfoOnly
+        if self.compileError is not None:
+            # The invalid expectation was reported by the suite
+            self.state = TestState.Error
+            return self.state
         if self.name == "Badword":
             # Bad Word Detection Mode
             # Description holds a matching file patterns
             # Recursive look through the directory of DUT
             # Treat command as a list of Badwords
-            words = [re.compile(s) for s in self.cmd]
-            searchpath = pathlib.Path(self.DUT).parent
-            hits = []
-            for fname in searchpath.glob(self.descr):
-                with open(fname, "r") as fHnd:
-                    for nr, line in enumerate(fHnd.readlines()):
-                        for word in words:
-                            if word.search(line) is not None:
-                                hits.append((os.path.relpath(fname), nr, line.rstrip(), word.pattern))
-            if len(hits) > 0:
-                for file, lineno, text, pattern in hits:
-                    logger.log(f"{TestState.BadWord} {file}[{lineno}]: '{text}' matches '{pattern}'")
-                self.state = TestState.BadWord
-            else:
-                self.state = TestState.Clean
+            self.state = scanBadWords(self.cmd, pathlib.Path(self.DUT).parent.glob(self.descr))
             return self.state
+        self.usage = ResourceUsage()
         if self.cmd is not None:
             if isinstance(self.cmd, list):
                 for cmd_ in self.cmd:
                     self.runCmd(cmd_)
+                    if self.cancelled:
+                        break
             else:
                 self.runCmd(self.cmd)
         else:
             self.state = TestState.Error
+        if self.cancelled:
+            self.state = TestState.Waiting
+        return self.state
+
+    def cancel(self):
+        """
+        Cancels a running test.
+
+        The currently executed command will be killed and the test
+        returns to the waiting state.
+        """
+        with CancelLock:
+            self.cancelled = True
+            command = self.command
+        if command is not None:
+            command.kill()
+
+    def cancelledBeforeStart(self) -> bool:
+        """
+        Checks if the test was cancelled before it was started and
+        returns it to the waiting state.
+
+        The flag is reset by the suite before a test run, not by the
+        test itself: otherwise a test cancelled while it is queued would
+        still run.
+        """
+        with CancelLock:
+            if not self.cancelled:
+                return False
+        self.state = TestState.Waiting
+        return True
+
+    async def arun(self) -> TestState:
+        """
+        Execute this test case on the asyncio event loop.
+
+        Cancelling the awaiting task kills the running command and
+        returns the test to the waiting state.
+        """
+        if (
+            self.state in [TestState.Disabled, TestState.InfoOnly]
+            or self.compileError is not None
+            or self.name == "Badword"
+            or self.cmd is None
+        ):
+            return self.run()
+        if self.cancelledBeforeStart():
+            return self.state
+        self.usage = ResourceUsage()
+        try:
+            for cmd_ in self.cmd if isinstance(self.cmd, list) else [self.cmd]:
+                await self.arunCmd(cmd_)
+        except asyncio.CancelledError:
+            self.state = TestState.Waiting
+            raise
         return self.state
 
     def __str__(self):
@@ -571,6 +1642,12 @@ class Test:
         Creates a textual representation of the test.
         The output can be saved to a file.
         """
+        return ",\n".join(["Test ("] + self.fields(prefix) + [prefix + ")"])
+
+    def fields(self, prefix="\t") -> List[str]:
+        """
+        The textual representation of the fields of the test.
+        """
         fields = []
         fields.append(f"{prefix}\tname = '{self.name:s}'")
         if self.descr is not None and self.descr != "":
@@ -584,40 +1661,273 @@ class Test:
             fields.append(f'{prefix}\treturnCode = "{self.expectRetCode}"')
         if self.timeout is not None:
             fields.append(f"{prefix}\ttimeout = {self.timeout:.1f}")
-        return ",\n".join(["Test ("] + fields + [prefix + ")"])
+        if self.shell is not None:
+            fields.append(f"{prefix}\tshell = {self.shell}")
+        if self.expectPerformance is not None:
+            fields.append(f"{prefix}\tperformance = {self.expectPerformance!r}")
+        if self.normalize is not None:
+            fields.append(f"{prefix}\tnormalize = {self.normalize!r}")
+        return fields
+
+
+class Benchmark(Test):
+    """
+    A Benchmark measures the performance of a command.
+
+    The command is executed for a number of warmup rounds, followed by
+    `repeat` measured rounds. Every round is evaluated like a
+    :py:class:`Test`, the benchmark fails with the first failing round.
+    Performance expectations are checked against the median of the
+    measured rounds.
+
+    To reduce the noise, the DUT can be pinned to a set of CPUs
+    (where the platform supports `sched_setaffinity`).
+    """
+
+    def __init__(self, *args, warmup: int = 1, repeat: int = 10, cpus: Optional[Set[int]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.warmup = warmup
+        """The number of unmeasured rounds"""
+        self.repeat = repeat
+        """The number of measured rounds"""
+        self.cpus = cpus
+        """The CPUs the DUT is pinned to"""
+        self.samples: List[ResourceUsage] = []
+        """The resource usage of each measured round"""
+
+    def createCommand(self, command: str, commandType: type = None) -> Optional["Command"]:
+        _cmd = super().createCommand(command, commandType)
+        if _cmd is not None and self.cpus is not None:
+            _cmd.cpus = set(self.cpus)
+        return _cmd
+
+    def available(self) -> bool:
+        """
+        Checks whether the DUT can be pinned to the requested CPUs.
+        """
+        if self.cpus is None or not hasattr(os, "sched_getaffinity"):
+            return True
+        missing = set(self.cpus) - os.sched_getaffinity(0)
+        if len(missing) > 0:
+            logger.log(f"{self.name}: CPUs {sorted(missing)} are not available")
+            return False
+        return True
+
+    def measureRound(self, nr: int, state: TestState) -> bool:
+        """
+        Records the usage of a finished round.
+
+        Returns False, if the benchmark can not continue.
+        """
+        if state != TestState.Success or self.cancelled:
+            return False
+        if nr >= self.warmup:
+            self.samples.append(self.usage)
+        return True
+
+    def summarize(self, performance: ExpectationT) -> TestState:
+        """
+        Combines the measured rounds and checks the performance
+        expectations.
+        """
+        self.expectPerformance = performance
+        if self.state != TestState.Success or len(self.samples) == 0:
+            return self.state
+        cpus = [usage.cpu for usage in self.samples]
+        rss = [usage.maxRSS for usage in self.samples if usage.maxRSS is not None]
+        floors = [usage.rssFloor for usage in self.samples if usage.rssFloor is not None]
+        self.usage = ResourceUsage(
+            wall=statistics.median(usage.wall for usage in self.samples),
+            user=None if None in cpus else statistics.median(usage.user for usage in self.samples),
+            system=None if None in cpus else statistics.median(usage.system for usage in self.samples),
+            maxRSS=max(rss) if len(rss) > 0 else None,
+            rssFloor=max(floors) if len(floors) > 0 else None,
+        )
+        if not self.check(self.expectPerformance, self.usage, "performance"):
+            self.state = TestState.Fail
+        return self.state
+
+    def run(self) -> TestState:
+        """
+        Executes the warmup and the measured rounds.
+        """
+        self.samples = []
+        if self.state not in [TestState.Disabled, TestState.InfoOnly] and not self.available():
+            self.state = TestState.Error
+            return self.state
+        # The expectations are checked once, against the median
+        performance, self.expectPerformance = self.expectPerformance, None
+        try:
+            for nr in range(self.warmup + self.repeat):
+                if not self.measureRound(nr, super().run()):
+                    break
+        finally:
+            state = self.summarize(performance)
+        return state
+
+    async def arun(self) -> TestState:
+        """
+        Executes the warmup and the measured rounds on the asyncio event
+        loop.
+        """
+        self.samples = []
+        if self.state not in [TestState.Disabled, TestState.InfoOnly] and not self.available():
+            self.state = TestState.Error
+            return self.state
+        performance, self.expectPerformance = self.expectPerformance, None
+        try:
+            for nr in range(self.warmup + self.repeat):
+                if not self.measureRound(nr, await super().arun()):
+                    break
+        finally:
+            state = self.summarize(performance)
+        return state
+
+    def results(self) -> Optional[dict]:
+        """
+        The statistics of the measured rounds, None if nothing was
+        measured.
+        """
+        if len(self.samples) == 0:
+            return None
+        results = {
+            "command": self.cmd,
+            "state": self.state.name,
+            "warmup": self.warmup,
+            "repeat": len(self.samples),
+            "cpus": None if self.cpus is None else sorted(self.cpus),
+            "wall": summarize([usage.wall for usage in self.samples]),
+            "cpu": None,
+            "maxRSS": self.usage.maxRSS,
+        }
+        if self.usage.cpu is not None:
+            results["cpu"] = summarize([usage.cpu for usage in self.samples])
+        return results
+
+    def toString(self, prefix="\t") -> str:
+        """
+        Creates a textual representation of the benchmark.
+        The output can be saved to a file.
+        """
+        return ",\n".join(["Benchmark ("] + self.fields(prefix) + [prefix + ")"])
+
+    def fields(self, prefix="\t") -> List[str]:
+        fields = super().fields(prefix)
+        fields.append(f"{prefix}\twarmup = {self.warmup}")
+        fields.append(f"{prefix}\trepeat = {self.repeat}")
+        if self.cpus is not None:
+            fields.append(f"{prefix}\tcpus = {set(self.cpus)}")
+        return fields
+
+
+def scanBadWords(
+    words: List[str], files: Iterable[os.PathLike], jobs: Optional[int] = None, index: Optional[WordIndex] = None
+) -> TestState:
+    """
+    Scans files for bad words and logs every hit.
+    (see :py:class:`nightmare.badwords.WordScanner`)
+    """
+    hits = WordScanner(words).scan(files, jobs, index)
+    for file, lineno, text, pattern in hits:
+        logger.log(f"{TestState.BadWord} {file}[{lineno}]: '{text}' matches '{pattern}'")
+    return TestState.BadWord if len(hits) > 0 else TestState.Clean
 
 
 class BadWord(Test):
-    def __init__(self, name, description="", path : os.PathLike = None, pattern="", words: List[str] = []):
+    def __init__(
+        self,
+        name,
+        description="",
+        path: os.PathLike = None,
+        pattern="",
+        words: List[str] = [],
+        jobs: Optional[int] = None,
+        index: Union[bool, os.PathLike] = False,
+        exclude: List[str] = [],
+        gitignore: bool = False,
+        maxSize: Optional[int] = None,
+    ):
         self.name = name
+        self.occurrence = 0
+        self.declared: Dict[str, object] = {}
         self.descr = description
         self.pattern = pattern
         self.path = path
         self.words = words
+        self.cmd = None
+        self.command = None
+        self.cancelled = False
+        self.usage = None
+        self.compileError = None
+        self.jobs = jobs
+        """The number of processes scanning the files (None for the number of CPUs)"""
+        self.index = index
+        """The file of the index of earlier hits, True for the default location, False to scan all files (default)"""
+        self.exclude = exclude
+        """Patterns of files and directories, which are not scanned (see :py:class:`nightmare.walk.IgnoreRules`)"""
+        self.gitignore = gitignore
+        """Flag, set to skip the files ignored by git"""
+        self.maxSize = maxSize
+        """The size of the largest scanned file in bytes (None for no limit)"""
+
+    def compile(self) -> bool:
+        """
+        A bad word scan has no expectations to compile.
+        """
+        self.compileError = None
+        return True
+
+    def fingerprint(self) -> list:
+        """
+        Identifies the scan by its words and files.
+        (see :py:func:`nightmare.cache.fingerprint`)
+        """
+        return ["BadWord", list(self.words), str(self.path), self.pattern, list(self.exclude), self.gitignore, self.maxSize]
 
     def run(self) -> TestState:
-        words = [re.compile(s) for s in self.words]
-        if self.path is None:
+        if self.cancelledBeforeStart():
+            return self.state
+        start = time.perf_counter()
+        if self.path is not None:
             searchpath = pathlib.Path(self.path)
-        elif hasattr(self, "DUT"):
+        elif getattr(self, "DUT", None) is not None:
             searchpath = pathlib.Path(self.DUT).parent
         else:
             searchpath = pathlib.Path(".")
-        hits = []
-        for fname in searchpath.glob(self.pattern):
-            with open(fname, "r") as fHnd:
-                for nr, line in enumerate(fHnd.readlines()):
-                    for word in words:
-                        if word.search(line) is not None:
-                            hits.append((os.path.relpath(fname), nr, line.rstrip(), word.pattern))
-        if len(hits) > 0:
-            for file, lineno, text, pattern in hits:
-                logger.log(f"{TestState.BadWord} {file}[{lineno}]: '{text}' matches '{pattern}'")
-            self.state = TestState.BadWord
-        else:
-            self.state = TestState.Clean
+        self.state = scanBadWords(self.words, self.files(searchpath), self.jobs, self.wordIndex(searchpath))
+        self.usage = ResourceUsage(wall=time.perf_counter() - start)
         return self.state
 
+    def files(self, searchpath: pathlib.Path) -> List[str]:
+        """
+        The files to scan. Excluded and ignored directories are not
+        walked. (see :py:func:`nightmare.walk.findFiles`)
+        """
+        if os.path.isabs(self.pattern) or ".." in pathlib.PurePath(self.pattern).parts:
+            # Patterns leaving the search path can not be walked
+            return [str(fname) for fname in sorted(searchpath.glob(self.pattern))]
+        return findFiles(searchpath, self.pattern, self.exclude, self.gitignore, self.maxSize)
+
+    def wordIndex(self, searchpath: pathlib.Path) -> Optional[WordIndex]:
+        """
+        The index of earlier hits. (see :py:class:`nightmare.badwords.WordIndex`)
+        """
+        if self.index is False:
+            return None
+        fname = self.index
+        if fname is True:
+            files = [str(searchpath.resolve()), self.pattern, list(self.exclude), self.gitignore, self.maxSize]
+            key = json.dumps(files + [list(self.words)])
+            fname = os.path.join(DefaultIndex, hashlib.sha256(key.encode()).hexdigest()[:32] + ".json")
+        return WordIndex(fname, self.words)
+
+    async def arun(self) -> TestState:
+        """
+        The file scan does not spawn a process, it is moved to a worker
+        thread to keep the event loop responsive.
+        """
+        return await asyncio.to_thread(self.run)
+
     def __str__(self):
         return self.toString(prefix="")
 
@@ -658,6 +1968,8 @@ class TestGroup:
     def __init__(self, *tests: Test, name: str = None, predicate: Callable[[List[bool]], bool] = all):
         self.tests = [t for t in tests]
         self._name = name
+        self.occurrence = 0
+        self.declared: Dict[str, object] = {}
         self.state = TestState.Waiting
         self.predicate = predicate
 
@@ -671,10 +1983,32 @@ class TestGroup:
     def descr(self) -> Optional[str]:
         return None
 
+    @property
+    def cancelled(self) -> bool:
+        """
+        Flag, set if any test of the group was cancelled
+        """
+        return any(t.cancelled for t in self.tests)
+
+    @cancelled.setter
+    def cancelled(self, cancelled: bool):
+        for t in self.tests:
+            t.cancelled = cancelled
+
     @property
     def cmd(self) -> Optional[str]:
         return " --> ".join(t.cmd for t in self.tests)
 
+    @property
+    def usage(self) -> Optional[ResourceUsage]:
+        usages = [t.usage for t in self.tests if getattr(t, "usage", None) is not None]
+        if len(usages) == 0:
+            return None
+        total = ResourceUsage()
+        for usage in usages:
+            total.add(usage)
+        return total
+
     def log_test(self, t, nr=0):
         if t.descr is not None:
             logger.log(f"  {TermColor.colorText('Test', TermColor.Purple)}[{nr: 03}] {t.name} - {t.descr}: {t.state}")
@@ -691,9 +2025,41 @@ class TestGroup:
         for nr, t in enumerate(self.tests):
             results.append(t.run())
             self.log_test(t, nr)
+        if self.cancelled:
+            self.state = TestState.Waiting
+            return self.state
+        self.state = TestState.Success if self.predicate(result == TestState.Success for result in results) else TestState.Fail
+        return self.state
+
+    async def arun(self) -> TestState:
+        """
+        Runs all Test in the group on the asyncio event loop.
+        """
+        results = []
+        for nr, t in enumerate(self.tests):
+            results.append(await t.arun())
+            self.log_test(t, nr)
         self.state = TestState.Success if self.predicate(result == TestState.Success for result in results) else TestState.Fail
         return self.state
 
+    def compile(self) -> bool:
+        """
+        Compiles the expectations of all tests in the group.
+        """
+        return all([t.compile() for t in self.tests])
+
+    @property
+    def compileError(self) -> Optional[Exception]:
+        errors = [t.compileError for t in self.tests if t.compileError is not None]
+        return errors[0] if len(errors) > 0 else None
+
+    def cancel(self):
+        """
+        Cancels all tests in the group.
+        """
+        for t in self.tests:
+            t.cancel()
+
     def toString(self, prefix="\t") -> str:
         """
         Creates a textual representation of the testgroup.
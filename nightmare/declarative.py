@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Declarative testbenches: suites of tests stored as JSON or TOML, which
+are built without executing any code. (see :py:func:`loadBench`)
+
+    {
+        "DUT": "./a.out",
+        "suites": {
+            "suite": {
+                "mode": "Continuous",
+                "tests": [
+                    {"name": "Echo", "command": "$DUT 42", "stdout": "42", "returnCode": 0},
+                    {"name": "Words", "command": "$DUT a b", "stdout": {"Contains": ["a", "b"]}},
+                    {"type": "Benchmark", "name": "Speed", "command": "$DUT", "performance": {"MaxDuration": 0.5}}
+                ]
+            }
+        }
+    }
+
+The fields of a test are the arguments of its class (`type`: Test,
+Benchmark or BadWord; All and Any group the `tests` of the entry).
+Expectations and normalization stages are tagged values: an object with
+the name of the class as its only key and the arguments as value (a
+single argument, a list of arguments, an object of keyword arguments or
+null). Lists of expectations are lists, sets are tagged with `Set`.
+Lambda expectations are code and can not be loaded. Paths are relative
+to the working directory.
+"""
+
+from typing import Any, Dict, Iterator, List, Tuple, Optional, Union
+
+import os
+import re
+import gc
+import json
+import inspect
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+from .case import Test, Benchmark, BadWord, TestGroup
+from .case import ExpectFile, Stringifier, StringifiedFile, CompareFiles, Snapshot
+from .case import Regex, NonZero, Negative, Contains, ContainsNot, Startswith
+from .case import MaxDuration, MaxCPU, MaxRSS, NoSlowerThan
+from .normalize import IgnoreEmptyLines, CollapseWhitespace, Mask, LineEndings
+from .suite import TestSuite, TestSuiteMode
+
+Extensions = [".json", ".toml"]
+"""The file extensions of declarative testbenches"""
+
+Tags: Dict[str, type] = {
+    cls.__name__: cls
+    for cls in [
+        Regex,
+        Contains,
+        ContainsNot,
+        Startswith,
+        NonZero,
+        Negative,
+        Snapshot,
+        ExpectFile,
+        CompareFiles,
+        Stringifier,
+        MaxDuration,
+        MaxCPU,
+        MaxRSS,
+        NoSlowerThan,
+        IgnoreEmptyLines,
+        CollapseWhitespace,
+        Mask,
+        LineEndings,
+    ]
+}
+"""The classes of the tagged values, by their tag"""
+
+Encoders = {
+    Regex: lambda exp: exp.regex.pattern,
+    Contains: lambda exp: list(exp.texts),
+    ContainsNot: lambda exp: list(exp.texts),
+    Startswith: lambda exp: exp.text,
+    NonZero: lambda exp: None,
+    Negative: lambda exp: None,
+    Snapshot: lambda exp: None,
+    ExpectFile: lambda exp: (
+        relative(exp.fname) if exp.manifest is None else {"fname": relative(exp.fname), "manifest": relative(exp.manifest)}
+    ),
+    CompareFiles: lambda exp: [relative(fname) for fname in [exp.expect, exp.out, exp.manifest] if fname is not None],
+    Stringifier: lambda exp: exp.exp,
+    StringifiedFile: lambda exp: exp.exp,
+    MaxDuration: lambda exp: exp.limit,
+    MaxCPU: lambda exp: exp.limit,
+    MaxRSS: lambda exp: exp.limit,
+    NoSlowerThan: lambda exp: {
+        "baseline": relative(exp.baseline) if isinstance(exp.baseline, (str, os.PathLike)) else exp.baseline,
+        "tolerance": exp.tolerance,
+        "key": exp.key,
+        "metric": exp.metric,
+    },
+    IgnoreEmptyLines: lambda stage: None,
+    CollapseWhitespace: lambda stage: None,
+    Mask: lambda stage: [stage.pattern, stage.replacement],
+    LineEndings: lambda stage: stage.linesep,
+}
+"""The arguments of the tagged values, by their class"""
+
+TestTypes: Dict[str, type] = {"Test": Test, "Benchmark": Benchmark, "BadWord": BadWord}
+"""The classes of the tests, by their type"""
+GroupTypes = {"All": all, "Any": any}
+"""The predicates of the test groups, by their type"""
+
+Attributes = {
+    "description": "descr",
+    "command": "cmd",
+    "stdout": "expectStdout",
+    "stderr": "expectStderr",
+    "returnCode": "expectRetCode",
+    "performance": "expectPerformance",
+}
+"""The attributes of the tests, which are named differently than their field"""
+ExpectationFields = frozenset(["stdout", "stderr", "returnCode", "performance", "normalize"])
+"""The fields of the tests holding expectations or normalization stages"""
+SuiteFields = ["mode", "DUT", "pipe", "outputOnFail", "timeout", "ignoreEmptyLines", "pipeLimit", "spillLimit", "earlyKill"]
+SuiteFields += ["normalize"]
+"""The options of a suite, besides its tests"""
+Whitespace = re.compile(r"[ \t\n\r]*")
+"""The whitespace between the tokens of JSON"""
+
+
+def relative(path: os.PathLike) -> str:
+    """
+    A path relative to the working directory, to move the testbench
+    together with its files.
+    """
+    try:
+        return os.path.relpath(path)
+    except ValueError:
+        # Another drive on Windows
+        return os.fspath(path)
+
+
+def parameters(cls: type) -> Dict[str, Any]:
+    """
+    The fields of a test class with their default values.
+    """
+    fields = {}
+    for klass in [Test, cls] if cls is Benchmark else [cls]:
+        for name, param in inspect.signature(klass.__init__).parameters.items():
+            if param.kind in [param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY] and name not in ["self", "DUT", "state"]:
+                fields.setdefault(name, param.default)
+    return fields
+
+
+Fields: Dict[type, Dict[str, Any]] = {cls: parameters(cls) for cls in TestTypes.values()}
+"""The fields of the tests with their default values, by class"""
+FieldNames: Dict[type, frozenset] = {cls: frozenset(fields) for cls, fields in Fields.items()}
+
+
+def isDeclarative(fname: os.PathLike) -> bool:
+    """
+    Checks whether a testbench file is declarative, by its extension.
+    """
+    return os.path.splitext(str(fname))[1].lower() in Extensions
+
+
+def decodeValue(value: Any) -> Any:
+    """
+    Builds an expectation (or normalization stage) from its stored form.
+    Raises a ValueError for unknown tags and lambda expectations.
+    """
+    if isinstance(value, str):
+        if value.startswith("lambda"):
+            raise ValueError(f"the lambda expectation '{value}' is code")
+        return value
+    elif isinstance(value, list):
+        return [decodeValue(v) for v in value]
+    elif isinstance(value, dict):
+        if len(value) != 1:
+            raise ValueError(f"a tagged value needs exactly one tag, not {', '.join(value) or 'none'}")
+        ((tag, args),) = value.items()
+        if tag == "Set":
+            return {decodeValue(v) for v in args}
+        if tag not in Tags:
+            raise ValueError(f"'{tag}' is no known expectation")
+        try:
+            if args is None:
+                return Tags[tag]()
+            elif isinstance(args, dict):
+                return Tags[tag](**args)
+            elif isinstance(args, list):
+                return Tags[tag](*args)
+            return Tags[tag](args)
+        except (TypeError, re.error) as e:
+            raise ValueError(f"invalid arguments of '{tag}': {e}")
+    return value
+
+
+def decodeTest(entry: Dict[str, Any]) -> Union[Test, TestGroup]:
+    """
+    Builds a test or test group from its stored form.
+    """
+    kwargs = dict(entry)
+    kind = kwargs.pop("type", "Test")
+    cls = TestTypes.get(kind)
+    if cls is None:
+        if kind in GroupTypes:
+            tests = [decodeTest(test) for test in entry.get("tests", [])]
+            return TestGroup(*tests, name=entry.get("name"), predicate=GroupTypes[kind])
+        raise ValueError(f"'{kind}' is no known test type")
+    if not FieldNames[cls].issuperset(kwargs):
+        unknown = kwargs.keys() - FieldNames[cls]
+        raise ValueError(f"{kind} '{entry.get('name', '')}' has no field {', '.join(repr(k) for k in sorted(unknown))}")
+    for key in ExpectationFields.intersection(kwargs):
+        if not isinstance(kwargs[key], (int, float)):
+            kwargs[key] = decodeValue(kwargs[key])
+    if "cpus" in kwargs and kwargs["cpus"] is not None:
+        kwargs["cpus"] = set(kwargs["cpus"])
+    try:
+        return cls(**kwargs)
+    except TypeError as e:
+        raise ValueError(f"{kind} '{entry.get('name', '')}': {e}")
+
+
+def decodeSuite(entry: Union[list, Dict[str, Any]]) -> Union[TestSuite, List[Test]]:
+    """
+    Builds a suite from its stored form. A plain list of tests is
+    returned as list, to receive the options of the runner.
+    """
+    if isinstance(entry, list):
+        return [decodeTest(test) for test in entry]
+    return TestSuite(*[decodeTest(test) for test in entry.get("tests", [])], **decodeOptions(entry))
+
+
+def decodeOptions(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the options of a suite from its stored form.
+    """
+    options = {}
+    for key, value in entry.items():
+        if key == "tests":
+            continue
+        if key not in SuiteFields:
+            raise ValueError(f"a suite has no option '{key}'")
+        if key == "mode":
+            if value not in TestSuiteMode.__members__:
+                raise ValueError(f"'{value}' is no suite mode ({', '.join(TestSuiteMode.__members__)})")
+            value = TestSuiteMode[value]
+        options[key] = decodeValue(value) if key == "normalize" else value
+    return options
+
+
+class JSONReader:
+    """
+    Reads a JSON document piece by piece: objects and arrays are walked
+    member by member, only the values requested by the caller are
+    decoded as a whole.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.scan = json.JSONDecoder().scan_once
+        self.whitespace = Whitespace.match
+        self.pos = self.whitespace(text, 0).end()
+        """The offset of the next token, whitespace is skipped after every token"""
+
+    def skip(self, pos: int):
+        self.pos = self.whitespace(self.text, pos).end()
+
+    def peek(self) -> str:
+        """
+        The first character of the next token, empty at the end.
+        """
+        return self.text[self.pos : self.pos + 1]
+
+    def expect(self, token: str):
+        if self.peek() != token:
+            raise ValueError(f"expected '{token}' at offset {self.pos}")
+        self.skip(self.pos + 1)
+
+    def value(self) -> Any:
+        """
+        Decodes the next value.
+        """
+        try:
+            value, end = self.scan(self.text, self.pos)
+        except StopIteration as e:
+            raise ValueError(f"expected a value at offset {e.value}")
+        self.pos = self.whitespace(self.text, end).end()
+        return value
+
+    def members(self) -> Iterator[str]:
+        """
+        The keys of an object. The caller reads the value of every key.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.skip(self.pos + 1)
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError(f"expected a key at offset {self.pos}")
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() != ",":
+                break
+            self.skip(self.pos + 1)
+        self.expect("}")
+
+    def values(self) -> Iterator[Any]:
+        """
+        Decodes the elements of an array one by one.
+        """
+        text, scan, whitespace = self.text, self.scan, self.whitespace
+        self.expect("[")
+        if self.peek() == "]":
+            self.skip(self.pos + 1)
+            return
+        pos = self.pos
+        while True:
+            try:
+                value, pos = scan(text, pos)
+            except StopIteration as e:
+                raise ValueError(f"expected a value at offset {e.value}")
+            pos = whitespace(text, pos).end()
+            yield value
+            if text[pos : pos + 1] != ",":
+                break
+            pos = whitespace(text, pos + 1).end()
+        self.pos = pos
+        self.expect("]")
+
+
+def streamSuite(reader: JSONReader) -> Union[TestSuite, List[Test]]:
+    """
+    Builds a suite while reading it. (see :py:func:`decodeSuite`)
+    """
+    if reader.peek() == "[":
+        return [decodeTest(entry) for entry in reader.values()]
+    if reader.peek() != "{":
+        raise ValueError(f"a suite is a list of tests or an object, at offset {reader.pos}")
+    tests, entry = [], {}
+    for key in reader.members():
+        if key == "tests":
+            tests = [decodeTest(entry) for entry in reader.values()]
+        else:
+            entry[key] = reader.value()
+    return TestSuite(*tests, **decodeOptions(entry))
+
+
+def streamBench(text: str) -> Tuple[Dict[str, Union[TestSuite, List[Test]]], Optional[str]]:
+    """
+    Builds the suites of a JSON testbench while reading it. Every test
+    is decoded and built on its own, the document is never held as a
+    whole.
+    """
+    reader = JSONReader(text)
+    suites, DUT = None, None
+    if reader.peek() != "{":
+        raise ValueError("a testbench needs an object of 'suites'")
+    for key in reader.members():
+        if key == "suites":
+            if reader.peek() != "{":
+                raise ValueError("a testbench needs an object of 'suites'")
+            suites = {name: streamSuite(reader) for name in reader.members()}
+        elif key == "DUT":
+            DUT = reader.value()
+        else:
+            reader.value()
+    if reader.peek() != "":
+        raise ValueError(f"extra data at offset {reader.pos}")
+    if suites is None:
+        raise ValueError("a testbench needs an object of 'suites'")
+    return suites, DUT
+
+
+def readBench(fname: os.PathLike) -> Tuple[Dict[str, Union[TestSuite, List[Test]]], Optional[str]]:
+    """
+    Reads a declarative testbench file and builds its suites.
+    """
+    if os.path.splitext(str(fname))[1].lower() == ".toml":
+        if tomllib is None:
+            raise ValueError("reading TOML requires Python 3.11 or the tomli module")
+        with open(fname, "rb") as fHnd:
+            content = tomllib.load(fHnd)
+        if not isinstance(content, dict) or not isinstance(content.get("suites"), dict):
+            raise ValueError("a testbench needs an object of 'suites'")
+        return {name: decodeSuite(suite) for name, suite in content["suites"].items()}, content.get("DUT")
+    with open(fname, encoding="utf-8") as fHnd:
+        return streamBench(fHnd.read())
+
+
+def loadBench(fname: os.PathLike) -> Tuple[Dict[str, Union[TestSuite, List[Test]]], Optional[str]]:
+    """
+    Loads the suites and the DUT of a declarative testbench. Raises a
+    ValueError, if the testbench is invalid.
+
+    JSON testbenches are turned into tests while they are read. The
+    garbage collector is paused meanwhile: all new objects are kept,
+    scanning them again and again would take longer than building them.
+    """
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return readBench(fname)
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def encodeValue(value: Any) -> Any:
+    """
+    Converts an expectation (or normalization stage) into its stored
+    form. (see :py:func:`decodeValue`)
+
+    Raises a TypeError for values which can not be represented, like
+    functions and custom expectations.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    elif isinstance(value, str):
+        if value.startswith("lambda"):
+            raise TypeError(f"Can not store the lambda expectation '{value}'")
+        return value
+    elif isinstance(value, (list, tuple)):
+        return [encodeValue(v) for v in value]
+    elif isinstance(value, (set, frozenset)):
+        return {"Set": sorted((encodeValue(v) for v in value), key=json.dumps)}
+    elif type(value) in Encoders:
+        tag = "Stringifier" if isinstance(value, Stringifier) else type(value).__name__
+        return {tag: Encoders[type(value)](value)}
+    raise TypeError(f"Can not store {type(value).__name__}")
+
+
+def encodeTest(test: Union[Test, TestGroup]) -> Dict[str, Any]:
+    """
+    Converts a test into its stored form. Only fields differing from
+    their default value are stored.
+    """
+    if isinstance(test, TestGroup):
+        kind = {all: "All", any: "Any"}.get(test.predicate)
+        if kind is None:
+            raise TypeError(f"Can not store the predicate {test.predicate.__name__} of group '{test.name}'")
+        entry = {"type": kind} if test._name is None else {"type": kind, "name": test._name}
+        entry["tests"] = [encodeTest(t) for t in test.tests]
+        return entry
+    kind = next((name for name, cls in TestTypes.items() if type(test) is cls), None)
+    if kind is None:
+        raise TypeError(f"Can not store {type(test).__name__}")
+    entry: Dict[str, Any] = {} if kind == "Test" else {"type": kind}
+    for field, default in Fields[type(test)].items():
+        # Options of the command line are not part of the testbench
+        value = test.declared.get(field, getattr(test, Attributes.get(field, field)))
+        if field in ExpectationFields:
+            value = encodeValue(value)
+        elif isinstance(value, (set, frozenset)):
+            value = sorted(value)
+        elif isinstance(value, os.PathLike):
+            value = os.fspath(value)
+        if value != default and not (field == "description" and value is None):
+            entry[field] = value
+    return entry
+
+
+def saveBench(fname: os.PathLike, suites: Dict[str, TestSuite], DUT: Optional[str] = None):
+    """
+    Saves suites as a declarative testbench (JSON). Raises a TypeError,
+    if a test can not be represented.
+    """
+    content: Dict[str, Any] = {} if DUT is None else {"DUT": DUT}
+    content["suites"] = {}
+    for name, suite in suites.items():
+        entry: Dict[str, Any] = {"mode": suite.mode.name}
+        if suite.DUT is not None and (DUT is None or os.path.abspath(suite.DUT) != os.path.abspath(DUT)):
+            entry["DUT"] = suite.DUT
+        if suite.options["normalize"] is not None:
+            entry["normalize"] = encodeValue(suite.options["normalize"])
+        entry["tests"] = [encodeTest(test) for test in suite.getTests()]
+        content["suites"][name] = entry
+    with open(fname, "w", encoding="utf-8") as fHnd:
+        json.dump(content, fHnd, indent=1, ensure_ascii=False)
+        fHnd.write("\n")
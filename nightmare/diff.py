@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Line based difference of large outputs. (see :py:func:`unifiedDiff`)
+
+The lines are matched with the patience algorithm: lines occurring
+exactly once in both sequences are used as anchors, the longest
+increasing sequence of anchors splits the problem into independent
+parts. Unlike `difflib`, the runtime stays close to linear for large and
+mostly different outputs.
+"""
+
+from typing import List, Tuple, Iterator, Sequence, Dict
+
+import bisect
+import difflib
+
+MaxHunks = 20
+"""The default number of hunks, after which the difference is cut off"""
+SmallRegion = 256 * 256
+"""Regions without anchors up to this size (lines a * lines b) are matched by difflib"""
+
+Block = Tuple[int, int, int]
+"""A matching block: start in a, start in b, number of lines"""
+
+
+def longestIncreasing(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    The longest sequence of pairs, increasing in both positions.
+    The pairs must be sorted by their first position. (patience sorting)
+    """
+    tails: List[int] = []
+    tailIndex: List[int] = []
+    previous = [-1] * len(pairs)
+    for nr, (i, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos > 0:
+            previous[nr] = tailIndex[pos - 1]
+        if pos == len(tails):
+            tails.append(j)
+            tailIndex.append(nr)
+        else:
+            tails[pos] = j
+            tailIndex[pos] = nr
+    result = []
+    nr = tailIndex[-1] if len(tailIndex) > 0 else -1
+    while nr >= 0:
+        result.append(pairs[nr])
+        nr = previous[nr]
+    return result[::-1]
+
+
+def uniqueAnchors(a: Sequence[str], alo: int, ahi: int, b: Sequence[str], blo: int, bhi: int) -> List[Tuple[int, int]]:
+    """
+    The positions of lines, which occur exactly once in both regions.
+    """
+    countA: Dict[str, int] = {}
+    for i in range(alo, ahi):
+        countA[a[i]] = -1 if a[i] in countA else i
+    countB: Dict[str, int] = {}
+    for j in range(blo, bhi):
+        countB[b[j]] = -1 if b[j] in countB else j
+    return sorted((i, countB[line]) for line, i in countA.items() if i >= 0 and countB.get(line, -1) >= 0)
+
+
+def matchingBlocks(a: Sequence[str], b: Sequence[str]) -> List[Block]:
+    """
+    Computes the matching blocks of two sequences of lines, terminated
+    by the empty block `(len(a), len(b), 0)`.
+    """
+    matches: List[Tuple[int, int]] = []
+    regions = [(0, len(a), 0, len(b))]
+    while len(regions) > 0:
+        alo, ahi, blo, bhi = regions.pop()
+        # Common prefix and suffix
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo, blo = alo + 1, blo + 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi, bhi = ahi - 1, bhi - 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+        anchors = longestIncreasing(uniqueAnchors(a, alo, ahi, b, blo, bhi))
+        if len(anchors) > 0:
+            for i, j in anchors:
+                matches.append((i, j))
+                regions.append((alo, i, blo, j))
+                alo, blo = i + 1, j + 1
+            regions.append((alo, ahi, blo, bhi))
+        elif (ahi - alo) * (bhi - blo) <= SmallRegion:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                matches.extend((alo + i + k, blo + j + k) for k in range(size))
+        # Large regions without anchors are reported as replaced
+    blocks: List[Block] = []
+    for i, j in sorted(matches):
+        if len(blocks) > 0 and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + 1)
+        else:
+            blocks.append((i, j, 1))
+    blocks.append((len(a), len(b), 0))
+    return blocks
+
+
+def opcodes(blocks: List[Block]) -> List[Tuple[str, int, int, int, int]]:
+    """
+    Converts matching blocks into `difflib` style opcodes.
+    """
+    codes = []
+    i = j = 0
+    for ai, bj, size in blocks:
+        tag = "replace" if i < ai and j < bj else "delete" if i < ai else "insert" if j < bj else None
+        if tag is not None:
+            codes.append((tag, i, ai, j, bj))
+        if size > 0:
+            codes.append(("equal", ai, ai + size, bj, bj + size))
+        i, j = ai + size, bj + size
+    return codes
+
+
+def groupOpcodes(codes: List[Tuple[str, int, int, int, int]], context: int = 3) -> Iterator[list]:
+    """
+    Groups the opcodes into hunks with `context` lines of context.
+    (see `difflib.SequenceMatcher.get_grouped_opcodes`)
+    """
+    if len(codes) == 0 or all(code[0] == "equal" for code in codes):
+        return
+    codes = list(codes)
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if len(group) > 0 and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def formatRange(start: int, stop: int) -> str:
+    """
+    Formats a line range like the unified diff format.
+    """
+    length = stop - start
+    beginning = start + 1 if length > 0 else start
+    return f"{beginning}" if length == 1 else f"{beginning},{length}"
+
+
+def unifiedDiff(
+    a: Sequence[str], b: Sequence[str], fromfile="", tofile="", context: int = 3, maxHunks: int = MaxHunks
+) -> Iterator[str]:
+    """
+    Generates the unified difference of two sequences of lines, like
+    `difflib.unified_diff`. After `maxHunks` hunks, the remaining hunks
+    are only counted.
+    """
+    groups = groupOpcodes(opcodes(matchingBlocks(a, b)), context)
+    for nr, group in enumerate(groups):
+        if nr == 0:
+            yield f"--- {fromfile}"
+            yield f"+++ {tofile}"
+        if nr == maxHunks:
+            yield f"... {sum(1 for _ in groups) + 1} more hunks"
+            return
+        first, last = group[0], group[-1]
+        yield f"@@ -{formatRange(first[1], last[2])} +{formatRange(first[3], last[4])} @@"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for line in a[i1:i2]:
+                    yield " " + line
+                continue
+            for line in a[i1:i2]:
+                yield "-" + line
+            for line in b[j1:j2]:
+                yield "+" + line
@@ -150,8 +150,8 @@ class TestEditForm(wx.Frame):
         self.edtExpOut.SetValue(str(self.test.expectStdout) if self.test.expectStdout is not None else "")
         self.edtExpErr.SetValue(str(self.test.expectStderr) if self.test.expectStderr is not None else "")
         self.edtExpCode.SetValue(str(self.test.expectRetCode) if self.test.expectRetCode is not None else "")
-        self.edtResOut.SetValue(self.test.output)
-        self.edtResErr.SetValue(self.test.error)
+        self.edtResOut.SetValue(str(self.test.output))
+        self.edtResErr.SetValue(str(self.test.error))
         self.edtResCode.SetValue(str(self.test.retCode))
 
     def save(self):
@@ -162,4 +162,5 @@ class TestEditForm(wx.Frame):
         self.test.expectStdout = self.edtExpOut.GetValue() if self.edtExpOut.GetValue().strip() != "" else None
         self.test.expectStderr = self.edtExpErr.GetValue() if self.edtExpErr.GetValue().strip() != "" else None
         self.test.expectRetCode = self.edtExpCode.GetValue() if self.edtExpCode.GetValue().strip() != "" else None
+        self.test.compile()
         self.gui.updateTest(self.idx, self.test)
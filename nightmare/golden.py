@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Comparison of outputs and files against (large) golden files.
+
+Golden files are opened only when a test is checked. The sizes are
+compared first, the contents are memory-mapped and compared block by
+block until the first difference. With a digest manifest (see
+:py:class:`Manifest`), unchanged golden files are compared by the hashes
+of their blocks, without reading them.
+"""
+
+from typing import Dict, List, Optional, Tuple, Union
+from contextlib import contextmanager
+
+import os
+import json
+import mmap
+import locale
+import hashlib
+import tempfile
+import threading
+
+from .capture import ChunkSize, SpilledOutput
+from .utils import logger
+
+BlockSize = 16 * ChunkSize
+"""The number of bytes compared at once"""
+
+Buffer = Union[bytes, bytearray, mmap.mmap]
+
+
+def fileDigest(fname: os.PathLike) -> str:
+    """
+    Hashes the contents of a file.
+    """
+    hsh = hashlib.sha256()
+    with open(fname, "rb") as fHnd:
+        for block in iter(lambda: fHnd.read(BlockSize), b""):
+            hsh.update(block)
+    return hsh.hexdigest()
+
+
+def fileDigests(fname: os.PathLike) -> Tuple[str, List[str]]:
+    """
+    Hashes the contents of a file, as a whole and block by block.
+    """
+    hsh = hashlib.sha256()
+    blocks = []
+    with open(fname, "rb") as fHnd:
+        for block in iter(lambda: fHnd.read(BlockSize), b""):
+            hsh.update(block)
+            blocks.append(hashlib.sha256(block).hexdigest())
+    return hsh.hexdigest(), blocks
+
+
+def bufferDigest(data: Buffer) -> str:
+    hsh = hashlib.sha256()
+    view = memoryview(data)
+    for offset in range(0, len(data), BlockSize):
+        hsh.update(view[offset : offset + BlockSize])
+    view.release()
+    return hsh.hexdigest()
+
+
+def matchesDigests(data: Buffer, blocks: List[str]) -> bool:
+    """
+    Compares a buffer with the block digests of a file of the same
+    size, stops at the first differing block.
+    """
+    if len(blocks) != (len(data) + BlockSize - 1) // BlockSize:
+        return False
+    for offset, digest in zip(range(0, len(data), BlockSize), blocks):
+        if hashlib.sha256(data[offset : offset + BlockSize]).hexdigest() != digest:
+            return False
+    return True
+
+
+@contextmanager
+def mapped(fname: os.PathLike):
+    """
+    Memory-maps a file for reading. Empty files can not be mapped and
+    are represented by an empty bytes object.
+    """
+    with open(fname, "rb") as fHnd:
+        if os.fstat(fHnd.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(fHnd.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+
+def equalBuffers(first: Buffer, second: Buffer) -> bool:
+    """
+    Compares two buffers block by block, stops at the first differing
+    block.
+    """
+    if len(first) != len(second):
+        return False
+    for offset in range(0, len(first), BlockSize):
+        if first[offset : offset + BlockSize] != second[offset : offset + BlockSize]:
+            return False
+    return True
+
+
+def outputBuffer(out) -> Buffer:
+    """
+    The raw bytes of an output. Decoded outputs are encoded again.
+    """
+    if isinstance(out, SpilledOutput):
+        return out.buffer
+    if isinstance(out, (bytes, bytearray, mmap.mmap)):
+        return out
+    return str(out).encode(locale.getpreferredencoding(False))
+
+
+class Manifest:
+    """
+    The precomputed digests of golden files, stored as a JSON file.
+
+    An entry is valid as long as the size and the modification time of
+    the golden file are unchanged. Outdated and missing entries are
+    computed on first use and written back, so the following runs do
+    not need to read the golden file any more.
+    """
+
+    def __init__(self, fname: os.PathLike):
+        self.fname = os.path.abspath(fname)
+        """The manifest file"""
+        self.entries: Optional[Dict[str, dict]] = None
+        """The digests of the whole file and its blocks with the size and modification time, by the path of the golden file"""
+        self.lock = threading.Lock()
+
+    def load(self) -> Dict[str, dict]:
+        if self.entries is None:
+            try:
+                with open(self.fname) as fHnd:
+                    self.entries = json.load(fHnd)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def save(self):
+        directory = os.path.dirname(self.fname)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmpName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fHnd:
+            json.dump(self.entries, fHnd, indent=1, sort_keys=True)
+        os.replace(tmpName, self.fname)
+
+    def entry(self, fname: os.PathLike) -> dict:
+        """
+        The up to date entry of a golden file.
+        """
+        path = os.path.relpath(os.path.abspath(fname), os.path.dirname(self.fname))
+        info = os.stat(fname)
+        with self.lock:
+            entry = self.load().get(path)
+            if (
+                entry is not None
+                and entry["size"] == info.st_size
+                and entry["mtime_ns"] == info.st_mtime_ns
+                and "blocks" in entry
+            ):
+                return entry
+        digest, blocks = fileDigests(fname)
+        entry = {"size": info.st_size, "mtime_ns": info.st_mtime_ns, "sha256": digest, "blocks": blocks}
+        with self.lock:
+            self.entries[path] = entry
+            try:
+                self.save()
+            except OSError:
+                # A read-only manifest is still used for this run
+                pass
+        return entry
+
+    def digest(self, fname: os.PathLike) -> str:
+        """
+        The digest of a golden file.
+        """
+        return self.entry(fname)["sha256"]
+
+    def blocks(self, fname: os.PathLike) -> List[str]:
+        """
+        The digests of the blocks of a golden file.
+        """
+        return self.entry(fname)["blocks"]
+
+
+_manifests: Dict[str, Manifest] = {}
+
+
+def loadManifest(fname: Optional[os.PathLike]) -> Optional[Manifest]:
+    """
+    The manifest stored in a file. Expectations with the same manifest
+    file share the same manifest.
+    """
+    if fname is None:
+        return None
+    key = os.path.abspath(fname)
+    if key not in _manifests:
+        _manifests[key] = Manifest(key)
+    return _manifests[key]
+
+
+def goldenDigest(fname: os.PathLike, manifest: Optional[Manifest] = None) -> str:
+    """
+    The digest of a golden file, taken from the manifest if possible.
+    """
+    return manifest.digest(fname) if manifest is not None else fileDigest(fname)
+
+
+def compareOutput(fname: os.PathLike, out, manifest: Optional[Manifest] = None) -> bool:
+    """
+    Compares an output byte-wise with a golden file.
+
+    A golden file, which can not be read, fails the comparison.
+    """
+    data = outputBuffer(out)
+    try:
+        if len(data) != os.stat(fname).st_size:
+            return False
+        if manifest is not None:
+            return matchesDigests(data, manifest.blocks(fname))
+        with mapped(fname) as expected:
+            return equalBuffers(expected, data)
+    except OSError as e:
+        logger.log(f"Sorry, but I couldn't read the golden file '{fname}': {e}")
+        return False
+
+
+def compareFiles(expect: os.PathLike, out: os.PathLike, manifest: Optional[Manifest] = None) -> bool:
+    """
+    Compares a generated file byte-wise with a golden file.
+
+    A missing file fails the comparison.
+    """
+    try:
+        if os.stat(expect).st_size != os.stat(out).st_size:
+            return False
+        if manifest is not None:
+            with mapped(out) as generated:
+                return matchesDigests(generated, manifest.blocks(expect))
+        with mapped(expect) as expected, mapped(out) as generated:
+            return equalBuffers(expected, generated)
+    except OSError as e:
+        logger.log(f"Sorry, but I couldn't compare '{out}' with the golden file '{expect}': {e}")
+        return False
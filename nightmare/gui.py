@@ -49,7 +49,7 @@ class TestRunnerGui(wx.App):
     """Graphical User Interface"""
 
     modes = ["Continuous", "Halt on Fail", "Halt on Error"]
-    benchtypes = [("nightmare", ".py"), ("All Files", "")]
+    benchtypes = [("nightmare", ".py"), ("nightmare JSON", ".json"), ("nightmare TOML", ".toml"), ("All Files", "")]
     duttypes = [("All Files", ""), ("Executables", ".exe")]
 
     def suiteSave(self, fn):
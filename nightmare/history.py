@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+A local database of past test results. (see :py:class:`History`)
+
+The durations and outcomes of every test run are stored in a small
+SQLite file, keyed by the testbench, the suite and the test. (see
+:py:func:`testKey`) They are used to schedule the tests of later runs.
+"""
+
+from typing import Dict, List, Iterable, Optional, Tuple
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import statistics
+
+from contextlib import closing
+
+from .case import Test, TestState
+from .cache import fingerprint
+from .utils import logger
+
+DefaultHistory = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "nightmare", "history.db")
+"""The default location of the history database"""
+
+Schema = """CREATE TABLE IF NOT EXISTS results (
+    bench TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    test TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    state TEXT NOT NULL,
+    fingerprint TEXT,
+    occurrence INTEGER NOT NULL DEFAULT 0
+)"""
+
+Columns = {"fingerprint": "TEXT", "occurrence": "INTEGER NOT NULL DEFAULT 0"}
+"""The columns added to the databases of earlier versions"""
+
+Indices = [
+    "DROP INDEX IF EXISTS results_test",
+    "CREATE INDEX IF NOT EXISTS results_key ON results (bench, suite, test, occurrence, started)",
+]
+
+Key = Tuple[str, int]
+"""A test of a suite in the history (see :py:func:`testKey`)"""
+
+
+def testKey(t: Test) -> Key:
+    """
+    Identifies a test by its name and the number of earlier tests with
+    the same name in its suite, so equally named tests don't share their
+    results.
+    """
+    return (t.name, t.occurrence)
+
+
+def testFingerprint(t: Test) -> Optional[str]:
+    """
+    A hash of the command and the expectations of a test, to detect
+    modified tests. None, if the test can not be fingerprinted.
+    """
+    try:
+        fields = {"command": t.cmd, "test": t.fingerprint() if hasattr(t, "fingerprint") else None}
+        return hashlib.sha256(json.dumps(fingerprint(fields), sort_keys=True).encode()).hexdigest()
+    except (TypeError, OSError):
+        return None
+
+
+class History:
+    """
+    The results of past runs of a single suite.
+
+    Only the latest `keep` results of every test are kept.
+    """
+
+    def __init__(self, fname: os.PathLike, bench: str, suite: str, keep: int = 20):
+        self.fname = fname
+        """The SQLite database file"""
+        self.bench = bench
+        """The (absolute) path of the testbench"""
+        self.suite = suite
+        """The name of the suite"""
+        self.keep = keep
+        """The number of results kept for each test"""
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens the database and creates the schema, if necessary.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.fname)), exist_ok=True)
+        connection = sqlite3.connect(self.fname, timeout=10.0)
+        connection.execute(Schema)
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(results)")]
+        for column, definition in Columns.items():
+            if column not in columns:
+                connection.execute(f"ALTER TABLE results ADD COLUMN {column} {definition}")
+        for statement in Indices:
+            connection.execute(statement)
+        return connection
+
+    def record(self, tests: Iterable[Test]):
+        """
+        Stores the results of executed tests.
+
+        Tests without a measured duration and replayed results are
+        skipped.
+        """
+        started = time.time()
+        rows = [
+            (self.bench, self.suite, *testKey(t), started, t.usage.wall, t.state.name, testFingerprint(t))
+            for t in tests
+            if getattr(t, "usage", None) is not None
+            and not getattr(t, "cached", False)
+            and t.state not in [TestState.Waiting, TestState.Disabled, TestState.InfoOnly]
+        ]
+        if len(rows) == 0:
+            return
+        with closing(self.connect()) as connection, connection:
+            connection.executemany(
+                "INSERT INTO results (bench, suite, test, occurrence, started, duration, state, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            # Window functions need SQLite 3.25, a limited subquery works with every version
+            connection.executemany(
+                """DELETE FROM results WHERE bench = ? AND suite = ? AND test = ? AND occurrence = ? AND rowid NOT IN (
+                    SELECT rowid FROM results WHERE bench = ? AND suite = ? AND test = ? AND occurrence = ?
+                    ORDER BY started DESC LIMIT ?
+                )""",
+                [row[:4] + row[:4] + (self.keep,) for row in rows],
+            )
+
+    def results(self) -> Dict[Key, List[sqlite3.Row]]:
+        """
+        The stored results of the suite by test (see :py:func:`testKey`),
+        latest first.
+        """
+        if not os.path.exists(self.fname):
+            return {}
+        results: Dict[Key, List[sqlite3.Row]] = {}
+        try:
+            with closing(self.connect()) as connection:
+                connection.row_factory = sqlite3.Row
+                rows = connection.execute(
+                    "SELECT * FROM results WHERE bench = ? AND suite = ? ORDER BY started DESC", (self.bench, self.suite)
+                )
+                for row in rows:
+                    results.setdefault((row["test"], row["occurrence"]), []).append(row)
+        except (OSError, sqlite3.Error) as e:
+            logger.log(f"Sorry, but I couldn't read the history '{self.fname}': {e}")
+        return results
+
+    def durations(self, window: int = 5) -> Dict[Key, float]:
+        """
+        The expected duration of each test: the median of its latest
+        results.
+        """
+        return {key: statistics.median(row["duration"] for row in rows[:window]) for key, rows in self.results().items()}
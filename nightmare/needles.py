@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Finding many texts in an output in a single pass. (see :py:class:`NeedleSet`)
+"""
+
+from typing import Iterable, Set, Dict, Tuple, Union, Pattern
+
+import re
+import mmap
+import locale
+
+from .capture import SpilledOutput
+
+MaxLeaders = 2
+"""Up to this number of distinct first characters, the texts are searched by the combined expression"""
+ManyNeedles = 100
+"""From this number of texts on, the combined expression is always used"""
+
+
+def triePattern(texts: Iterable[str]) -> str:
+    """
+    Combines texts into a regular expression, which shares the common
+    prefixes of the texts. At every position the longest text matches.
+    """
+    trie: Dict[str, dict] = {}
+    for text in texts:
+        node = trie
+        for ch in text:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != ""]
+        if len(branches) == 0:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A text ends here, longer texts are preferred
+            pattern = f"(?:{pattern})?" if len(branches) == 1 else pattern + "?"
+        return pattern
+
+    return build(trie)
+
+
+class NeedleSet:
+    """
+    A set of texts (needles), which are searched in a single pass over
+    an output.
+
+    The needles are compiled into one regular expression, for str as
+    well as for bytes, mmap and spilled outputs. Matches do not overlap:
+    a needle hidden inside or across the match of another needle is
+    checked separately afterwards. Spilled outputs with line breaks to
+    normalize are searched needle by needle, on the decoded text.
+
+    The expression is fast, if the needles start with a few distinct
+    characters or if there are many of them. Otherwise the substring
+    search of Python skips faster through the output, and every needle
+    is searched on its own.
+    """
+
+    def __init__(self, texts: Iterable[str]):
+        self.texts = list(dict.fromkeys(texts))
+        """The needles, without duplicates"""
+        self.patterns: Dict[type, Pattern] = {}
+        """The compiled expressions for str and bytes"""
+        self.encoding = locale.getpreferredencoding(False)
+        leaders = {text[:1] for text in self.texts}
+        self.combined = len(self.texts) >= ManyNeedles or (len(self.texts) > 1 and len(leaders) <= MaxLeaders)
+        """Flag, set if the combined expression is used"""
+
+    def pattern(self, kind: type) -> Pattern:
+        """
+        The combined expression for str or bytes, compiled on first use.
+        """
+        if kind not in self.patterns:
+            if kind is bytes:
+                self.patterns[kind] = re.compile(triePattern(self.encode(t) for t in self.texts).encode("latin-1"))
+            else:
+                self.patterns[kind] = re.compile(triePattern(self.texts))
+        return self.patterns[kind]
+
+    def encode(self, text: str) -> str:
+        """
+        The encoded text as latin-1 string, to build a bytes expression.
+        """
+        return text.encode(self.encoding).decode("latin-1")
+
+    def haystack(self, out) -> Union[str, bytes, mmap.mmap, SpilledOutput]:
+        """
+        The searchable buffer of an output. The raw buffer of a spilled
+        text output is only searched, if decoding does not change its
+        line breaks.
+        """
+        if isinstance(out, SpilledOutput):
+            return out.buffer if out.binary or out.buffer.find(b"\r") < 0 else out
+        if isinstance(out, (str, bytes, bytearray, mmap.mmap)):
+            return out
+        return str(out)
+
+    def contains(self, haystack, needle: str) -> bool:
+        """
+        Searches a single needle.
+        """
+        if isinstance(haystack, (str, SpilledOutput)):
+            return needle in haystack
+        return haystack.find(needle.encode(self.encoding)) >= 0
+
+    def find(self, out, stopAtFirst=False) -> Set[str]:
+        """
+        Finds the needles in an output.
+
+        Stops as soon as all needles (or with `stopAtFirst` the first
+        needle) are found.
+        """
+        haystack = self.haystack(out)
+        if not self.combined or isinstance(haystack, SpilledOutput):
+            found = set()
+            for text in self.texts:
+                if self.contains(haystack, text):
+                    found.add(text)
+                    if stopAtFirst:
+                        break
+            return found
+        isText = isinstance(haystack, str)
+        pattern = self.pattern(str if isText else bytes)
+        found = set()
+        for match in pattern.finditer(haystack):
+            found.add(match.group(0) if isText else match.group(0).decode(self.encoding, errors="replace"))
+            if stopAtFirst or len(found) == len(self.texts):
+                return found
+        for text in self.texts:
+            if text in found:
+                continue
+            if any(text in other for other in found):
+                found.add(text)
+            elif any(self.overlaps(other, text) for other in found) and self.contains(haystack, text):
+                found.add(text)
+        return found
+
+    @staticmethod
+    def overlaps(first: str, second: str) -> bool:
+        """
+        Checks whether the end of the first text is the beginning of
+        the second text, i.e. the match of the first text might hide the
+        second text.
+        """
+        return any(first.endswith(second[:size]) for size in range(1, min(len(first), len(second))))
+
+    def missing(self, out) -> Set[str]:
+        """
+        The needles which are not found in the output.
+        """
+        return set(self.texts) - self.find(out)
+
+    def __len__(self):
+        return len(self.texts)
+
+
+_compiled: Dict[Tuple[str, ...], NeedleSet] = {}
+
+
+def compileNeedles(texts: Iterable[str]) -> NeedleSet:
+    """
+    Compiles texts into a needle set. Expectations with the same texts
+    share the same set.
+    """
+    key = tuple(sorted(set(texts)))
+    if key not in _compiled:
+        _compiled[key] = NeedleSet(key)
+    return _compiled[key]
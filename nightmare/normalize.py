@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Normalization of the DUT output before it is checked.
+
+The stages (see :py:class:`Normalizer`) are declared on a test or a
+suite and compiled into a single :py:class:`Normalization`, which is
+shared by all tests with the same stages.
+"""
+
+from typing import Callable, List, Optional, Sequence, Dict, Tuple
+
+import re
+import locale
+
+from .capture import OutputCapture, SpilledOutput, StreamResult
+
+Pass = Callable[[str], str]
+"""A compiled stage, normalizing a text with `\\n` line breaks"""
+
+
+class Normalizer:
+    """
+    A stage of the output normalization.
+    """
+
+    def compile(self) -> Optional[Pass]:
+        """
+        The function applying the stage, None if the stage does not
+        change the text.
+        """
+        return None
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class IgnoreEmptyLines(Normalizer):
+    """
+    Removes empty lines.
+    """
+
+    def compile(self) -> Pass:
+        return lambda text: "\n".join(line for line in text.splitlines() if line != "")
+
+
+class CollapseWhitespace(Normalizer):
+    """
+    Collapses every run of whitespace into a single space and strips
+    the lines.
+    """
+
+    def compile(self) -> Pass:
+        return lambda text: "\n".join(" ".join(line.split()) for line in text.splitlines())
+
+
+class Mask(Normalizer):
+    """
+    Replaces every match of a regular expression, e.g. timestamps, PIDs
+    or temporary paths.
+    """
+
+    def __init__(self, pattern: str, replacement: str = "*"):
+        self.pattern = pattern
+        self.replacement = replacement
+
+    def compile(self) -> Pass:
+        regex = re.compile(self.pattern)
+        # The replacement is inserted literally, without expanding group references
+        return lambda text: regex.sub(lambda match: self.replacement, text)
+
+    def __repr__(self):
+        return f"Mask({self.pattern!r}, {self.replacement!r})"
+
+
+class LineEndings(Normalizer):
+    """
+    The line ending policy: lines are joined by `linesep`, which also
+    replaces `$n` in the expectations.
+    """
+
+    def __init__(self, linesep: str = "\n"):
+        self.linesep = linesep
+
+    def __repr__(self):
+        return f"LineEndings({self.linesep!r})"
+
+
+class Normalization:
+    """
+    The compiled stages of a normalization.
+
+    The stages are applied one after the other, in the given order.
+    Every mask is compiled on its own, so its groups and backreferences
+    keep their numbers.
+    """
+
+    def __init__(self, stages: Sequence[Normalizer]):
+        self.stages = list(stages)
+        self.passes: List[Pass] = [normalize for normalize in (stage.compile() for stage in stages) if normalize is not None]
+        """The compiled stages, which change the text"""
+        endings = [stage.linesep for stage in stages if isinstance(stage, LineEndings)]
+        self.linesep: Optional[str] = endings[-1] if len(endings) > 0 else None
+        """The line separator of the policy, None to keep the separator"""
+
+    @property
+    def changesText(self) -> bool:
+        """
+        Flag, set if the stages change more than the line separator.
+        """
+        return len(self.passes) > 0
+
+    def lines(self, text: str) -> List[str]:
+        """
+        Normalizes a text and splits it into lines.
+        """
+        for normalize in self.passes:
+            text = normalize(text)
+        return text.splitlines()
+
+    def normalizeLines(self, lines: List[str]) -> List[str]:
+        """
+        Normalizes a text, which is already split into lines.
+        """
+        return self.lines("\n".join(lines))
+
+    def normalizeSpilled(self, out: SpilledOutput, spillLimit: int) -> StreamResult:
+        """
+        Normalizes a spilled output block by block into a new capture,
+        without loading the whole output. The blocks end at line breaks,
+        a mask does not match across two blocks.
+
+        The lines are joined by `\\n`, the text of a capture has no other
+        line breaks. Other line separators need the text in memory.
+        """
+        if self.linesep not in [None, "\n"]:
+            return self(str(out))
+        encoding = locale.getpreferredencoding(False)
+        capture = OutputCapture(spillLimit=spillLimit)
+        pending, separator = "", ""
+        for chunk in out.chunks():
+            text = pending + chunk
+            end = text.rfind("\n") + 1
+            if end == 0:
+                pending = text
+                continue
+            pending = text[end:]
+            for line in self.lines(text[:end]):
+                capture.write((separator + line).encode(encoding, errors="replace"))
+                separator = "\n"
+        for line in self.lines(pending):
+            capture.write((separator + line).encode(encoding, errors="replace"))
+            separator = "\n"
+        return capture.result()
+
+    def __call__(self, text: str) -> str:
+        return (self.linesep or "\n").join(self.lines(text))
+
+    def __repr__(self):
+        return repr(self.stages)
+
+
+_compiled: Dict[Tuple[str, ...], Normalization] = {}
+
+
+def compileNormalization(stages: Sequence[Normalizer]) -> Optional[Normalization]:
+    """
+    Compiles normalization stages. Tests with equal stages share the
+    same compiled normalization. Returns None, if there are no stages.
+    """
+    if len(stages) == 0:
+        return None
+    key = tuple(repr(stage) for stage in stages)
+    if key not in _compiled:
+        _compiled[key] = Normalization(stages)
+    return _compiled[key]
@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import os
 import re
 import sys
 import time
 import math
+import asyncio
 import argparse
 import itertools
 import struct
@@ -24,9 +25,17 @@ except:
 
 from .utils import TermColor, logger
 from .case import Test, TestState, TestGroup, TestAny, TestAll
-from .case import Expectation, ExpectFile, Stringifier, StringifiedFile, CompareFiles
-from .case import BadWord, Regex, NonZero, Negative, Contains, ContainsNot, Startswith
+from .case import Expectation, ExpectFile, Stringifier, StringifiedFile, CompareFiles, Snapshot
+from .case import BadWord, Benchmark, Regex, NonZero, Negative, Contains, ContainsNot, Startswith
+from .case import MaxDuration, MaxCPU, MaxRSS, NoSlowerThan
+from .normalize import IgnoreEmptyLines, CollapseWhitespace, Mask, LineEndings
 from .suite import TestSuite, TestSuiteMode
+from .cache import ResultCache, CacheEnvironment
+from .history import History, DefaultHistory
+from .snapshot import SnapshotStore
+from .bytecode import compileBench, DefaultBytecode
+from .declarative import isDeclarative, loadBench, saveBench
+from .scheduling import Orders, readDurations
 from .arnold_converter import syntax, buildTestList
 
 import nightmare
@@ -88,6 +97,47 @@ class TestRunner(object):
         group.add_argument("--dut", "--DUT", action="store", nargs=1, help="Set the device under test.")
         group.add_argument("--test", action="store", nargs="+", type=int, help="Run only the specified tests")
         group.add_argument("--timeout", action="store", nargs=1, type=float, help="Set a global timeout for all tests.")
+        group.add_argument(
+            "--shard",
+            action="store",
+            type=self.parseShard,
+            default=None,
+            dest="shard",
+            help="Run only the I-th of N deterministic partitions of the tests (1 <= I <= N).",
+            metavar="I/N",
+        )
+        group.add_argument(
+            "--budget",
+            action="store",
+            type=float,
+            default=None,
+            dest="budget",
+            help="Run only the most valuable tests, which fit into a time budget of SECONDS.",
+            metavar="SECONDS",
+        )
+        group.add_argument(
+            "--shard-plan",
+            action="store_true",
+            default=False,
+            dest="shardPlan",
+            help="Print the assignment of the tests to the shards and their expected durations.",
+        )
+        group.add_argument(
+            "--durations",
+            action="store",
+            default=None,
+            dest="durations",
+            help="Balance the shards and the budget by the expected durations in the JSON FILE, shared by all machines.",
+            metavar="FILE",
+        )
+        group.add_argument(
+            "--save-durations",
+            action="store",
+            default=None,
+            dest="saveDurations",
+            help="Merge the durations of the executed tests into the JSON FILE.",
+            metavar="FILE",
+        )
         group.add_argument(
             "--arnold",
             "-a",
@@ -96,14 +146,38 @@ class TestRunner(object):
             dest="arnold",
             help="Use the arnold mode (requires pyparsing module)",
         )
-        group.add_argument("--save", action="store", nargs=1, help="Save the testsuite as FILE", metavar="FILE")
+        group.add_argument(
+            "--save", action="store", nargs=1, help="Save the testsuite as FILE (declarative for .json)", metavar="FILE"
+        )
+        group.add_argument(
+            "--bytecode",
+            action="store",
+            nargs="?",
+            const=DefaultBytecode,
+            default=None,
+            dest="bytecode",
+            help=f"Cache the compiled testbench in DIR (without DIR: {DefaultBytecode}).",
+            metavar="DIR",
+        )
+        group.add_argument(
+            "--no-bytecode", action="store_const", const=None, dest="bytecode", help="Compile the testbench on every run."
+        )
         group = args.add_argument_group("Output Control")
         group.add_argument(
             "--limit",
             action="store",
             type=int,
-            default=2000,
-            help="Set a (soft) limit for a number of Bytes, after which output piping will we stopped. Checks are made after each line.",
+            default=None,
+            help="Set a (soft) limit for a number of Bytes, after which output piping will we stopped. "
+            "Checks are made after each line.",
+        )
+        group.add_argument(
+            "--spill-limit",
+            action="store",
+            type=int,
+            default=None,
+            dest="spillLimit",
+            help="Set a limit for a number of Bytes, after which the captured output is moved from memory to a temporary file.",
         )
         group.add_argument(
             "--quiet",
@@ -130,6 +204,23 @@ class TestRunner(object):
             dest="commands",
             help="Show the command executed for each test.",
         )
+        group.add_argument(
+            "--slowest",
+            action="store",
+            type=int,
+            default=None,
+            dest="slowest",
+            help="Number of slowest tests listed in the statistics (default: 5).",
+            metavar="N",
+        )
+        group.add_argument(
+            "--benchmark-file",
+            action="store",
+            default=None,
+            dest="benchmarkFile",
+            help="Save the results of the benchmarks as JSON file.",
+            metavar="FILE",
+        )
         group.add_argument(
             "--length",
             "-l",
@@ -188,6 +279,102 @@ class TestRunner(object):
             dest="mode",
             help="Same as '-c', but will halt if an error occurs.",
         )
+        group.add_argument(
+            "--jobs",
+            "-j",
+            action="store",
+            type=int,
+            default=1,
+            dest="jobs",
+            help="Run up to JOBS tests in parallel.",
+            metavar="JOBS",
+        )
+        group.add_argument(
+            "--asyncio",
+            action="store_true",
+            default=False,
+            dest="asyncio",
+            help="Supervise the tests with an asyncio event loop instead of a thread per test.",
+        )
+        group.add_argument(
+            "--early-kill",
+            "-k",
+            action="store_true",
+            default=None,
+            dest="earlyKill",
+            help="Check the output while it is streamed and kill the DUT as soon as an expectation fails.",
+        )
+        group.add_argument(
+            "--cache",
+            action="store",
+            default=os.environ.get("NIGHTMARE_CACHE"),
+            dest="cache",
+            help="Replay the results of unchanged tests from the cache in DIR (default: $NIGHTMARE_CACHE).",
+            metavar="DIR",
+        )
+        group.add_argument(
+            "--no-cache", action="store_const", const=None, dest="cache", help="Execute all tests without using the cache."
+        )
+        group.add_argument(
+            "--cache-env",
+            action="append",
+            default=[],
+            dest="cacheEnv",
+            help="Add the environment variable NAME to the cache key of every test (can be repeated).",
+            metavar="NAME",
+        )
+        group.add_argument(
+            "--refresh",
+            action="store_true",
+            default=False,
+            dest="refresh",
+            help="Execute all tests and replace their results in the cache.",
+        )
+        group.add_argument(
+            "--history",
+            action="store",
+            nargs="?",
+            const=DefaultHistory,
+            default=None,
+            dest="history",
+            help=f"Record the results of every run in the database FILE (without FILE: {DefaultHistory}).",
+            metavar="FILE",
+        )
+        group.add_argument(
+            "--no-history", action="store_const", const=False, dest="history", help="Don't record the results of the run."
+        )
+        group.add_argument(
+            "--snapshots",
+            action="store",
+            default=None,
+            dest="snapshots",
+            help="Store the snapshots of the Snapshot expectations in DIR (default: 'snapshots' next to the testbench).",
+            metavar="DIR",
+        )
+        group.add_argument(
+            "--record",
+            action="store_const",
+            const="record",
+            default="update",
+            dest="snapshotMode",
+            help="Record the snapshots of all tests, instead of verifying them.",
+        )
+        group.add_argument(
+            "--verify",
+            action="store_const",
+            const="verify",
+            dest="snapshotMode",
+            help="Only verify the snapshots, tests without a snapshot fail. (By default missing snapshots are recorded)",
+        )
+        group.add_argument(
+            "--order",
+            action="store",
+            choices=Orders,
+            default=None,
+            dest="order",
+            help="Execution order of the tests: as in the bench (default), the historically longest first or the most likely "
+            "to fail first. The orders by the history imply --history.",
+        )
         group.add_argument(
             "--ignoreEmptyLines", "-L", action="store_true", default=None, dest="ignoreEmptyLines", help="Ignore empty lines"
         )
@@ -224,6 +411,13 @@ class TestRunner(object):
         self.options["suite"] = self.options["suite"][0]
         self.options["dut"] = self.options["dut"][0]
         self.options["timeout"] = self.options["timeout"][0]
+        if self.options["order"] in ["longest", "risk"] and self.options["history"] is None:
+            self.options["history"] = DefaultHistory
+        elif self.options["order"] in ["longest", "risk"] and self.options["history"] is False:
+            logger.log(f"\tSorry, but the '{self.options['order']}' order needs the history, I'll keep the order of the bench")
+            self.options["order"] = "bench"
+        if self.options["history"] is False:
+            self.options["history"] = None
 
         logMessages = [
             (
@@ -236,10 +430,23 @@ class TestRunner(object):
             ),
             ("suite", lambda v: f"I'm using the testsuite '{v}'"),
             ("test", lambda v: f"I'm only running test {v}" if len(v) > 0 else ""),
+            ("shard", lambda v: f"I'm only running shard {v[0]} of {v[1]}"),
+            ("budget", lambda v: f"I'm only running tests for {v} seconds"),
+            ("durations", lambda v: f"I'm balancing the shards by the durations in '{v}'"),
+            ("saveDurations", lambda v: f"I will save the durations to '{v}'"),
             ("bench", lambda v: f"I'm using testbench '{v}'"),
             ("timeout", lambda v: f"Setting global timeout to {v}"),
+            ("jobs", lambda v: f"I'm running up to {v} tests in parallel" if v > 1 else ""),
+            ("asyncio", lambda v: "I'm using the asyncio engine" if v else ""),
+            ("earlyKill", lambda v: "I will kill tests as soon as their output fails" if v else ""),
+            ("cache", lambda v: f"I'm caching the results in '{v}'"),
+            ("refresh", lambda v: "I will refresh the cached results" if v else ""),
+            ("order", lambda v: f"I'm executing the tests in '{v}' order"),
+            ("history", lambda v: f"I'm recording the results in the history '{v}'"),
+            ("snapshotMode", lambda v: f"I will {v} the snapshots" if v != "update" else ""),
             ("dut", lambda v: f"Device under Test is: {v}"),
             ("commands", lambda v: "I will print every command I'll execute." if v else ""),
+            ("benchmarkFile", lambda v: f"I will save the benchmark results to '{v}'"),
             ("length", lambda v: "I will only print the number of tests" if v else ""),
             ("info", lambda v: "I will only print the test information." if v else ""),
             ("pipe", lambda v: "I will pipe all tests outputs to their respective streams" if v else ""),
@@ -253,6 +460,19 @@ class TestRunner(object):
                     logger.log(f"\t{msg}")
         logger.flush(self.options["quiet"])
 
+    @staticmethod
+    def parseShard(text: str) -> Tuple[int, int]:
+        """
+        Parses a shard selection 'I/N'.
+        """
+        try:
+            index, count = (int(value) for value in text.split("/"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"'{text}' is not of the form I/N")
+        if count < 1 or not 1 <= index <= count:
+            raise argparse.ArgumentTypeError(f"shard {index} does not exist in {count} shards")
+        return (index, count)
+
     def addTest(self) -> Test:
         test = Test(name="New Test", description="Add a description", DUT=self.options["dut"])
         test.pipe = self.options["pipe"]
@@ -325,6 +545,7 @@ class TestRunner(object):
             # nightmare specific things
             "Test": Test,
             "BadWord": BadWord,
+            "Benchmark": Benchmark,
             "Group": TestGroup,
             "Any": TestAny,
             "All": TestAll,
@@ -336,6 +557,7 @@ class TestRunner(object):
             "Stringifier": Stringifier,
             "StringifiedFile": StringifiedFile,
             "CompareFiles": CompareFiles,
+            "Snapshot": Snapshot,
             # "Syntactic sugar"
             "Regex": Regex,
             "NonZero": NonZero,
@@ -343,13 +565,43 @@ class TestRunner(object):
             "Contains": Contains,
             "ContainsNot": ContainsNot,
             "Startswith": Startswith,
+            # Performance expectations
+            "MaxDuration": MaxDuration,
+            "MaxCPU": MaxCPU,
+            "MaxRSS": MaxRSS,
+            "NoSlowerThan": NoSlowerThan,
+            # Output normalization
+            "IgnoreEmptyLines": IgnoreEmptyLines,
+            "CollapseWhitespace": CollapseWhitespace,
+            "Mask": Mask,
+            "LineEndings": LineEndings,
             # Helping functions
             "readFile": lambda fname: open(fname).read().rstrip() if os.path.exists(fname) else "File not found",
         }
         ctx = {self.options["suite"]: None, "DUT": None}
-        exec(open(self.options["bench"]).read(), glb, ctx)
+        exec(compileBench(self.options["bench"], self.options["bytecode"]), glb, ctx)
+        return self.collectSuites(ctx)
+
+    def loadDeclarative(self) -> Optional[TestSuite]:
+        """
+        Loads a declarative (JSON or TOML) testbench, without executing
+        any code. (see :py:mod:`nightmare.declarative`)
+        """
+        self.suites.clear()
+        try:
+            suites, DUT = loadBench(self.options["bench"])
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.log(f"Sorry, but I couldn't load the testbench '{self.options['bench']}': {e}")
+            return None
+        return self.collectSuites({self.options["suite"]: None, **suites, "DUT": DUT})
+
+    def collectSuites(self, ctx: dict) -> Optional[TestSuite]:
+        """
+        Reads the suites and the DUT of a testbench from its namespace
+        and returns the selected suite.
+        """
+        suite = None
         if self.options["suite"] in ctx:
-            suite = None
             if "DUT" in ctx and ctx["DUT"] is not None and self.options["dut"] is None:
                 self.setDUT(ctx["DUT"])
             for key, value in ctx.items():
@@ -368,6 +620,16 @@ class TestRunner(object):
             logger.log("Sorry, but there was no test-suite in the file")
         return suite
 
+    def snapshotStore(self) -> SnapshotStore:
+        """
+        The snapshot store of the selected suite.
+        """
+        directory = self.options["snapshots"]
+        if directory is None:
+            directory = os.path.join(os.path.dirname(os.path.abspath(self.options["bench"])), "snapshots")
+        name = f"{os.path.splitext(os.path.basename(self.options['bench']))[0]}.{self.options['suite']}"
+        return SnapshotStore(directory, name, self.options["snapshotMode"])
+
     def loadSuite(self, fname: os.PathLike = None) -> Optional[TestSuite]:
         """Loads a python based suite from a file"""
         if fname is not None:
@@ -380,10 +642,14 @@ class TestRunner(object):
                 self.options["bench"] = os.path.basename(self.options["bench"])
             if self.options["arnold"]:
                 self.runsuite = self.loadArnold()
+            elif isDeclarative(self.options["bench"]):
+                self.runsuite = self.loadDeclarative()
             else:
                 self.runsuite = self.loadPython()
             if self.runsuite is not None:
                 self.runsuite.options["commands"] = self.options["commands"]
+                if self.options["slowest"] is not None:
+                    self.runsuite.options["slowest"] = self.options["slowest"]
                 self.runsuite.setAll(
                     state=TestState.InfoOnly if self.options["info"] else TestState.Waiting,
                     pipe=self.options["pipe"],
@@ -392,7 +658,37 @@ class TestRunner(object):
                     timeout=self.options["timeout"],
                     linesep=self.options["linesep"],
                     ignoreEmptyLines=self.options["ignoreEmptyLines"],
+                    pipeLimit=self.options["limit"],
+                    spillLimit=self.options["spillLimit"],
+                    earlyKill=self.options["earlyKill"],
+                    snapshots=self.snapshotStore(),
+                    override=True,
                 )
+                if self.options["shard"] is not None:
+                    self.runsuite.options["shard"] = self.options["shard"]
+                if self.options["durations"] is not None:
+                    try:
+                        self.runsuite.durations = readDurations(self.options["durations"])
+                    except (OSError, ValueError, KeyError, TypeError) as e:
+                        # Other machines would partition the tests differently
+                        logger.log(f"Sorry, but I couldn't read the durations '{self.options['durations']}': {e}")
+                        self.runsuite = None
+                        logger.flush(self.options["quiet"])
+                        return None
+                if self.options["budget"] is not None:
+                    self.runsuite.options["budget"] = self.options["budget"]
+                if self.options["order"] is not None:
+                    self.runsuite.options["order"] = self.options["order"]
+                if self.options["history"] is not None:
+                    self.runsuite.history = History(
+                        self.options["history"], os.path.abspath(self.options["bench"]), self.options["suite"]
+                    )
+                if self.options["cache"] is not None:
+                    self.runsuite.cache = ResultCache(
+                        self.options["cache"],
+                        refresh=self.options["refresh"],
+                        environment=CacheEnvironment + self.options["cacheEnv"],
+                    )
                 self.testCount = len(self.runsuite.testList)
                 logger.log(f"I have loaded {self.testCount} Testcase{'s' if self.testCount > 0 else ''}")
 
@@ -413,19 +709,62 @@ class TestRunner(object):
         """Thread run function"""
         if self.options["length"]:
             print(len(self.runsuite.getTests()))
+        elif self.options["shardPlan"]:
+            if self.options["shard"] is None:
+                logger.log("Sorry, but I need the number of shards (--shard I/N) for a plan")
+            else:
+                self.runsuite.shardPlan(self.options["test"])
         elif len(self.options["save"]) == 1:
             logger.log(f"Saving Suite to {self.options['save'][0]}")
             self.saveToFile(self.options["save"][0])
         else:
             logger.flush(self.options["quiet"])
             self.runsuite.setMode(self.options["mode"])
-            for test in self.runsuite.run(self.options["quiet"], tests=self.options["test"]):
+            if self.options["asyncio"]:
+                execution = self.iterateAsync(
+                    self.runsuite.arun(self.options["quiet"], tests=self.options["test"], jobs=self.options["jobs"])
+                )
+            else:
+                execution = self.runsuite.run(self.options["quiet"], tests=self.options["test"], jobs=self.options["jobs"])
+            for test in execution:
                 yield test
             self.runsuite.stats(self.options["quiet"])
+            if self.options["benchmarkFile"] is not None:
+                self.runsuite.saveBenchmarks(self.options["benchmarkFile"])
+            if self.options["saveDurations"] is not None:
+                self.runsuite.saveDurations(self.options["saveDurations"])
         if self.finished is not None:
             self.finished()
         logger.flush(self.options["quiet"])
 
+    @staticmethod
+    def iterateAsync(agen):
+        """
+        Drives an asynchronous generator on a new event loop and yields
+        its items synchronously.
+        """
+        loop = asyncio.new_event_loop()
+        watcher = None
+        if sys.version_info < (3, 12) and hasattr(asyncio, "PidfdChildWatcher") and hasattr(os, "pidfd_open"):
+            # Avoid the default watcher, which spawns a thread per child process
+            previous = asyncio.get_child_watcher()
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(loop)
+            asyncio.set_child_watcher(watcher)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(agen.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(agen.aclose())
+            loop.close()
+            if watcher is not None:
+                # The watcher is global, later event loops of the process get the previous one again
+                watcher.close()
+                asyncio.set_child_watcher(previous)
+
     def countTests(self):
         return len(self.runsuite.testList)
 
@@ -437,8 +776,12 @@ class TestRunner(object):
 
     def saveToFile(self, fn: str):
         """
-        Save the testsuite into a file
+        Save the testsuite into a file, declarative testbenches (see
+        :py:meth:`saveDeclarative`) by their extension.
         """
+        if isDeclarative(fn):
+            self.saveDeclarative(fn)
+            return
         fHnd = open(fn, "w")
         fHnd.write("#!/usr/bin/env python\n\n")
         fHnd.write("# nightmare - Testbench\n")
@@ -456,3 +799,14 @@ class TestRunner(object):
         fHnd.write(",\n".join(tests))
         fHnd.write("\n]\n")
         fHnd.close()
+
+    def saveDeclarative(self, fn: str):
+        """
+        Save the testsuite into a declarative testbench. (see
+        :py:func:`nightmare.declarative.saveBench`)
+        """
+        dut = os.path.relpath(self.options["dut"]) if self.options["dut"] is not None else None
+        try:
+            saveBench(fn, {self.options["suite"]: self.getSuite()}, dut)
+        except (OSError, TypeError) as e:
+            logger.log(f"Sorry, but I couldn't save the testbench '{fn}': {e}")
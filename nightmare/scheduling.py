@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Strategies for the execution order of the tests in a suite and for
+their distribution across multiple machines.
+
+The order never changes which tests are executed. (see :py:func:`orderTests`)
+"""
+
+from typing import List, Dict, Iterable, Optional, Tuple
+
+import os
+import json
+import hashlib
+import tempfile
+import statistics
+
+from .case import Test, TestState
+from .history import History, Key, testKey, testFingerprint
+
+Orders = ["bench", "longest", "risk"]
+"""The available execution orders"""
+
+
+def estimate(tests: List[Test], durations: Dict[Key, float]) -> List[float]:
+    """
+    The expected durations of the tests. Tests without a history are
+    expected to take the median duration.
+    """
+    keys = [testKey(t) for t in tests]
+    known = [durations[key] for key in keys if key in durations]
+    default = statistics.median(known) if len(known) > 0 else 0.0
+    return [durations.get(key, default) for key in keys]
+
+
+def longestFirst(tests: List[Test], durations: Dict[Key, float]) -> List[Test]:
+    """
+    Longest processing time first: sorts the tests by their expected
+    duration, the slowest test first.
+
+    Started in this order, a pool of workers ends up with an evenly
+    balanced tail. Ties keep the order of the bench.
+    """
+    expected = estimate(tests, durations)
+    return [tests[nr] for nr in sorted(range(len(tests)), key=lambda nr: expected[nr], reverse=True)]
+
+
+def failureRate(states: List[str], decay: float = 0.8) -> float:
+    """
+    The weighted rate of failed results (latest first). Every older
+    result weighs `decay` times the result after it.
+    """
+    weights = [decay**nr for nr in range(len(states))]
+    failed = [w for w, state in zip(weights, states) if state not in [TestState.Success.name, TestState.Clean.name]]
+    return sum(failed) / sum(weights) if len(weights) > 0 else 0.0
+
+
+def changed(t: Test, rows: list) -> bool:
+    """
+    Checks whether the command or the expectations of a test changed
+    since its latest recorded result.
+    """
+    current = testFingerprint(t)
+    return current is not None and rows[0]["fingerprint"] != current
+
+
+def riskFirst(tests: List[Test], results: Dict[Key, list], window: int = 10) -> List[Test]:
+    """
+    Sorts the tests by their risk to fail, the riskiest test first.
+
+    The risk of a test is its recent failure rate (see
+    :py:func:`failureRate`), raised by one if its command or its
+    expectations changed since the last recorded run, or if it was
+    never recorded. Ties keep the order of the bench.
+    """
+
+    def risk(t: Test) -> float:
+        rows = results.get(testKey(t), [])[:window]
+        if len(rows) == 0:
+            return 1.0
+        return failureRate([row["state"] for row in rows]) + (1.0 if changed(t, rows) else 0.0)
+
+    risks = [risk(t) for t in tests]
+    return [tests[nr] for nr in sorted(range(len(tests)), key=lambda nr: risks[nr], reverse=True)]
+
+
+def orderTests(tests: List[Test], order: str = "bench", history: Optional[History] = None) -> List[Test]:
+    """
+    Orders the selected tests for execution.
+
+    - `bench`: The order of the testbench
+    - `longest`: The historically slowest tests first
+      (see :py:func:`longestFirst`)
+    - `risk`: The tests most likely to fail first
+      (see :py:func:`riskFirst`)
+    """
+    if order == "longest" and history is not None:
+        return longestFirst(tests, history.durations())
+    if order == "risk" and history is not None:
+        return riskFirst(tests, history.results())
+    return tests
+
+
+def budgetTests(
+    tests: List[Test], results: Dict[Key, list], durations: Dict[Key, float], budget: float, window: int = 10
+) -> List[Test]:
+    """
+    Selects the most valuable tests, which are expected to fit into a
+    budget of seconds, in the order of their value:
+
+    1. Recently failing tests, the highest failure rate first
+    2. Tests with a changed command or expectations
+    3. Tests without a recorded result
+    4. All other tests, in the order of the bench
+
+    Tests which would exceed the budget are skipped in favour of
+    shorter tests of lower value.
+    """
+
+    def priority(t: Test) -> Tuple[int, float]:
+        rows = results.get(testKey(t), [])[:window]
+        if len(rows) == 0:
+            return (2, 0.0)
+        rate = failureRate([row["state"] for row in rows])
+        if rate > 0.0:
+            return (0, -rate)
+        return (1, 0.0) if changed(t, rows) else (3, 0.0)
+
+    expected = estimate(tests, durations)
+    selected = []
+    used = 0.0
+    for nr in sorted(range(len(tests)), key=lambda nr: priority(tests[nr])):
+        if used + expected[nr] <= budget:
+            selected.append(tests[nr])
+            used += expected[nr]
+    return selected
+
+
+def stableHash(name: str) -> int:
+    """
+    A hash of a test name, which is the same on every machine and for
+    every run (unlike the builtin `hash`).
+    """
+    return int.from_bytes(hashlib.sha256(name.encode("utf-8")).digest()[:8], "big")
+
+
+def readDurations(fname: os.PathLike) -> Dict[Key, float]:
+    """
+    Reads the expected durations of the tests from a JSON file (see
+    :py:func:`writeDurations`).
+    """
+    with open(fname) as fHnd:
+        entries = json.load(fHnd)
+    return {(entry["name"], entry.get("occurrence", 0)): float(entry["duration"]) for entry in entries}
+
+
+def writeDurations(fname: os.PathLike, tests: Iterable[Test]):
+    """
+    Stores the measured durations of the tests in a JSON file, which is
+    shared by the machines running the shards of a suite. The durations
+    of other tests already in the file are kept.
+    """
+    try:
+        durations = readDurations(fname)
+    except (OSError, ValueError, KeyError, TypeError):
+        durations = {}
+    for t in tests:
+        if getattr(t, "usage", None) is not None:
+            durations[testKey(t)] = t.usage.wall
+    entries = [
+        {"name": name, "occurrence": occurrence, "duration": duration} for (name, occurrence), duration in durations.items()
+    ]
+    directory = os.path.dirname(os.path.abspath(fname))
+    fd, tmpName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as fHnd:
+        json.dump(entries, fHnd, indent=1)
+    os.replace(tmpName, fname)
+
+
+def planShards(tests: List[Test], count: int, durations: Optional[Dict[Key, float]] = None) -> List[List[Test]]:
+    """
+    Partitions the tests into `count` shards.
+
+    Without durations, every test is assigned by the stable hash of its
+    name. With durations, the tests are assigned greedily, the longest
+    test first, to the shard with the lowest expected duration. Both
+    partitions are deterministic, as long as every machine uses the same
+    durations, so they are only read from a shared file (see
+    :py:func:`readDurations`), never from the local history. Inside a
+    shard the tests keep the order of the bench.
+    """
+    shards: List[List[int]] = [[] for _ in range(count)]
+    if not durations:
+        for nr, t in enumerate(tests):
+            shards[stableHash(t.name) % count].append(nr)
+    else:
+        expected = estimate(tests, durations)
+        loads = [0.0] * count
+        for nr in sorted(range(len(tests)), key=lambda nr: (-expected[nr], testKey(tests[nr]), nr)):
+            target = min(range(count), key=lambda shard: (loads[shard], shard))
+            shards[target].append(nr)
+            loads[target] += expected[nr]
+    return [[tests[nr] for nr in sorted(shard)] for shard in shards]
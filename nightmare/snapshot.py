@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Recorded outputs of tests, checked by the :py:class:`nightmare.case.Snapshot`
+expectation. (see :py:class:`SnapshotStore`)
+
+The store is a directory of zlib-compressed objects, addressed by the
+hash of their content, so equal outputs of different tests are stored
+only once. An index file per testbench and suite maps every test and
+stream to the hash of its recorded output.
+"""
+
+from typing import Dict, Optional, Tuple
+
+import os
+import json
+import zlib
+import tempfile
+import threading
+
+from .golden import bufferDigest, outputBuffer
+
+SnapshotModes = ["update", "record", "verify"]
+"""
+The modes of the store: record missing snapshots and verify the others
+(update), record all snapshots (record) or only verify them (verify)
+"""
+
+
+class SnapshotStore:
+    """
+    Records and verifies the snapshots of a single suite.
+    """
+
+    def __init__(self, directory: os.PathLike, name: str, mode: str = "update"):
+        self.directory = os.path.abspath(directory)
+        """The directory holding the index files and objects"""
+        self.name = name
+        """The name of the index (testbench and suite)"""
+        self.mode = mode
+        """The mode of the store (see :py:data:`SnapshotModes`)"""
+        self.index: Optional[Dict[str, Dict[str, str]]] = None
+        """The digests of the snapshots, by test and stream"""
+        self.modified = False
+        """Flag, set if the index needs to be saved"""
+        self.recorded = 0
+        """The number of snapshots recorded in this run"""
+        self.lock = threading.Lock()
+
+    @property
+    def indexFile(self) -> str:
+        return os.path.join(self.directory, f"{self.name}.json")
+
+    def objectFile(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest[:2], digest[2:])
+
+    @staticmethod
+    def entry(test: Tuple[str, int], stream: str) -> Tuple[str, str]:
+        """
+        The entry of a stream in the index, for a test identified by its
+        name and the number of earlier tests with that name. Equally named
+        tests are told apart by the number behind the stream.
+        """
+        name, occurrence = test
+        return (name, stream if occurrence == 0 else f"{stream}#{occurrence}")
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        if self.index is None:
+            try:
+                with open(self.indexFile) as fHnd:
+                    self.index = json.load(fHnd)
+            except (OSError, ValueError):
+                self.index = {}
+        return self.index
+
+    def save(self):
+        """
+        Writes the index, if snapshots were recorded.
+        """
+        with self.lock:
+            if not self.modified:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmpName = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as fHnd:
+                json.dump(self.index, fHnd, indent=1, sort_keys=True)
+            os.replace(tmpName, self.indexFile)
+            self.modified = False
+
+    def read(self, digest: str) -> bytes:
+        """
+        The content of a recorded snapshot.
+        """
+        with open(self.objectFile(digest), "rb") as fHnd:
+            return zlib.decompress(fHnd.read())
+
+    def write(self, digest: str, out):
+        """
+        Stores an output, unless an equal output is stored already.
+        """
+        fname = self.objectFile(digest)
+        if os.path.exists(fname):
+            return
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        fd, tmpName = tempfile.mkstemp(dir=os.path.dirname(fname), suffix=".tmp")
+        with os.fdopen(fd, "wb") as fHnd:
+            fHnd.write(zlib.compress(outputBuffer(out)))
+        os.replace(tmpName, fname)
+
+    def record(self, test: Tuple[str, int], stream: str, out, digest: str):
+        self.write(digest, out)
+        name, field = self.entry(test, stream)
+        with self.lock:
+            self.load().setdefault(name, {})[field] = digest
+            self.modified = True
+            self.recorded += 1
+
+    def snapshotDigest(self, test: Tuple[str, int], stream: str) -> Optional[str]:
+        name, field = self.entry(test, stream)
+        with self.lock:
+            return self.load().get(name, {}).get(field)
+
+    def check(self, test: Tuple[str, int], stream: str, out) -> bool:
+        """
+        Verifies an output against its snapshot or records it,
+        depending on the mode. Only the digests are compared.
+        """
+        digest = bufferDigest(outputBuffer(out))
+        expected = self.snapshotDigest(test, stream)
+        if self.mode == "record" or (expected is None and self.mode == "update"):
+            if expected != digest:
+                self.record(test, stream, out, digest)
+            return True
+        return expected == digest
@@ -2,12 +2,23 @@
 # -*- coding: utf-8 -*-
 
 
-from typing import List
+from typing import List, Iterable, Iterator, Dict, Optional
+
+import time
+import json
+import sqlite3
+import asyncio
+import threading
 
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
 
-from .case import Test, TestState
-from .utils import logger, TermColor
+from .case import Test, TestState, Benchmark
+from .cache import ResultCache
+from .history import History, Key, testKey
+from .snapshot import SnapshotStore
+from .scheduling import orderTests, planShards, budgetTests, estimate, writeDurations
+from .utils import logger, TermColor, formatBytes, percentile
 
 
 class TestSuiteMode(Enum):
@@ -44,17 +55,30 @@ class TestSuite:
             "ignoreEmptyLines": None,
             "commands": False,
             "pipeLimit": None,
+            "spillLimit": None,
+            "earlyKill": None,
+            "slowest": 5,
+            "order": "bench",
+            "shard": None,
+            "budget": None,
+            "normalize": None,
         }
         self.options.update({k: v for k, v in options.items() if v is not None})
         self.setMode(self.options["mode"])
         """The test suite mode"""
         self.testList = [t for t in tests]
+        self.compiled = False
+        """Flag, set if the expectations of all tests are compiled for the current options"""
         self.setAll(
             pipe=self.options["pipe"],
             out=self.options["outputOnFail"],
             timeout=self.options["timeout"],
             ignoreEmptyLines=self.options["ignoreEmptyLines"],
             pipeLimit=self.options["pipeLimit"],
+            spillLimit=self.options["spillLimit"],
+            earlyKill=self.options["earlyKill"],
+            normalize=self.options["normalize"],
+            compileTests=False,
         )
         self.setDUT(self.options["DUT"])
         """The collection of tests"""
@@ -76,6 +100,26 @@ class TestSuite:
         """The result of the last test"""
         self.rate = 0
         """The success rate of the testrun"""
+        self.finished: List[Test] = []
+        """The tests of the last testrun, in the order they were reported"""
+        self.started = time.perf_counter()
+        """The start time of the testrun"""
+        self.duration = 0.0
+        """The wall-clock duration of the testrun"""
+        self.skipped = 0
+        """The number of selected tests, which were not executed due to the budget"""
+        self.messages: Dict[int, List[str]] = {}
+        """The messages logged while running each test, until the test is reported (by the id of the test)"""
+        self.lock = threading.Lock()
+        """Guards the counters updated by concurrently running tests"""
+        self.cache: Optional[ResultCache] = None
+        """The cache replaying the results of unchanged tests"""
+        self.history: Optional[History] = None
+        """The database recording the results of every run"""
+        self.durations: Optional[Dict[Key, float]] = None
+        """The expected durations shared by all machines, balancing the shards"""
+        self.snapshots: Optional[SnapshotStore] = None
+        """The store of the recorded outputs (see :py:class:`nightmare.case.Snapshot`)"""
 
     def __len__(self):
         return len(self.testList)
@@ -112,6 +156,7 @@ class TestSuite:
 
     def addTest(self, test: Test):
         self.testList.append(test)
+        test.compile()
 
     def getTests(self):
         return self.testList
@@ -126,11 +171,30 @@ class TestSuite:
         linesep=None,
         ignoreEmptyLines=None,
         pipeLimit=None,
+        spillLimit=None,
+        earlyKill=None,
+        normalize=None,
+        snapshots=None,
+        override=False,
+        compileTests=True,
     ):
         """
         Applies the suite options to all tests in the suite.
+
+        The normalization stages of the suite are applied to the output
+        of every test, before the stages of the test itself. With
+        `override` the options are given on the command line, the values
+        of the testbench are kept for saving it. Without `compileTests`
+        the tests are compiled before the next run, the runner applies
+        its options and compiles them when the suite is loaded.
         """
+        if snapshots is not None:
+            self.snapshots = snapshots
         for t in self.testList:
+            if override:
+                for field, value in [("pipe", pipe), ("outputOnFail", out), ("diff", diff), ("timeout", timeout)]:
+                    if value is not None:
+                        t.declared.setdefault(field, getattr(t, field, None))
             t.state = state
             if pipe is not None:
                 t.pipe = pipe
@@ -146,53 +210,323 @@ class TestSuite:
                 t.ignoreEmptyLines = ignoreEmptyLines
             if pipeLimit is not None:
                 t.pipeLimit = pipeLimit
+            if spillLimit is not None:
+                t.spillLimit = spillLimit
+            if earlyKill is not None:
+                t.earlyKill = earlyKill
+            if normalize is not None:
+                t.suiteNormalize = list(normalize)
+            if snapshots is not None:
+                t.snapshots = snapshots
+        if compileTests:
+            self.compile()
+        else:
+            self.compiled = False
+
+    def compile(self):
+        """
+        Compiles the expectation strings of all tests once and reports
+        invalid expectations up front. Tests with invalid expectations
+        end in the error state, without being executed.
+        """
+        for nr, t in enumerate(self.testList):
+            previous = t.compileError
+            if not t.compile() and str(t.compileError) != str(previous):
+                logger.log(
+                    f"Sorry, but {TermColor.colorText('Test', TermColor.Purple)}[{nr: 03}] {t.name} "
+                    f"has an invalid expectation or normalization: {t.compileError}"
+                )
+        self.compiled = True
+
+    def _getTests(self, tests, jobs: int = 1) -> List[Test]:
+        """
+        The selected tests, in the order of execution.
+        (see :py:func:`nightmare.scheduling.orderTests`)
 
-    def _getTests(self, tests):
+        With a time budget, only the most valuable tests that are
+        expected to fit into the budget are selected, in the order of
+        their value. (see :py:func:`nightmare.scheduling.budgetTests`)
+        """
         if len(tests) == 0:
             tests = range(len(self))
-        for t in tests:
-            if t < len(self):
-                yield self[t]
+        self._numberNames()
+        selected = [self[t] for t in tests if t < len(self)]
+        if self.options["shard"] is not None:
+            index, count = self.options["shard"]
+            selected = self._shards(selected, count)[index - 1]
+        if self.options["budget"] is not None:
+            results = {} if self.history is None else self.history.results()
+            selected = budgetTests(selected, results, self._durations(), self.options["budget"] * max(jobs, 1))
+            if self.options["order"] == "bench":
+                return selected
+        return orderTests(selected, self.options["order"], self.history)
 
-    def run(self, quiet=False, tests: List[int] = []):
+    def _numberNames(self):
         """
-        Runs the tests in the suite.
+        Numbers the tests sharing a name, to keep their results apart.
+        (see :py:func:`nightmare.history.testKey`)
+        """
+        occurrences: Dict[str, int] = {}
+        for t in self.testList:
+            t.occurrence = occurrences.get(t.name, 0)
+            occurrences[t.name] = t.occurrence + 1
 
-        If no tests are selected, all tests will be run.
+    def _durations(self) -> Dict[Key, float]:
+        """
+        The expected durations of the tests: the shared durations, if
+        given, otherwise those of the history.
+        """
+        if self.durations is not None:
+            return self.durations
+        return {} if self.history is None else self.history.durations()
+
+    def _shards(self, tests: List[Test], count: int) -> List[List[Test]]:
+        """
+        Partitions the tests for `count` machines. Only the shared
+        durations balance the shards, a local history would assign the
+        tests differently on every machine.
+        (see :py:func:`nightmare.scheduling.planShards`)
+        """
+        return planShards(tests, count, self.durations)
+
+    def shardPlan(self, tests: List[int] = []):
+        """
+        Displays the assignment of the tests to the shards and their
+        expected durations, without running them.
+        """
+        if len(tests) == 0:
+            tests = range(len(self))
+        self._numberNames()
+        selected = [self[t] for t in tests if t < len(self)]
+        index, count = self.options["shard"]
+        durations = self._durations()
+        for nr, shard in enumerate(self._shards(selected, count), start=1):
+            expected = estimate(shard, durations)
+            marker = " <--" if nr == index else ""
+            logger.log(f"Shard {nr}/{count}: {len(shard)} tests, expected {sum(expected):.3f}s{marker}")
+            for t, duration in zip(shard, expected):
+                known = f"{duration:.3f}s" if testKey(t) in durations else "?"
+                logger.log(
+                    f"\t{TermColor.colorText('Test', TermColor.Purple)}[{self.testList.index(t): 03}] {t.name} ({known})"
+                )
+
+    def _execute(self, tests: Iterable[Test], jobs: int = 1) -> Iterator[Test]:
+        """
+        Executes the tests and yields them in order, once they are
+        finished.
+
+        With more than one job, the tests are executed by a pool of
+        worker threads. Closing the generator cancels all queued tests
+        and kills the tests that are still running.
+        """
+        if jobs <= 1:
+            for t in tests:
+                if self._runTest(t) is not None:
+                    yield t
+            return
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            pending = [(t, pool.submit(self._runTest, t)) for t in tests]
+            try:
+                for t, future in pending:
+                    if future.result() is not None:
+                        yield t
+            finally:
+                for t, future in pending:
+                    if not future.cancel() and not future.done():
+                        t.cancel()
+
+    def _dispatchable(self) -> bool:
+        """
+        Checks whether the time budget allows to start another test.
+        Counts the tests, which are not started.
+        """
+        if self.options["budget"] is None or time.perf_counter() - self.started < self.options["budget"]:
+            return True
+        with self.lock:
+            self.skipped += 1
+        return False
+
+    def _runTest(self, t: Test) -> Optional[TestState]:
+        """
+        Executes a test, unless its result is replayed from the cache.
+
+        Returns None, if the budget is used up and the test was not
+        executed. The messages logged by the test are kept until it is
+        reported, concurrent tests would mix them up otherwise.
+        """
+        if not self._dispatchable():
+            return None
+        with logger.capture() as messages:
+            self.messages[id(t)] = messages
+            if self.cache is None:
+                return t.run()
+            key = self.cache.key(t)
+            if self.cache.lookup(t, key):
+                return t.state
+            state = t.run()
+            self.cache.store(t, key)
+            return state
+
+    async def _arunTest(self, t: Test) -> Optional[TestState]:
+        """
+        Executes a test on the asyncio event loop, unless its result is
+        replayed from the cache. (see :py:meth:`_runTest`)
+        """
+        if not self._dispatchable():
+            return None
+        with logger.capture() as messages:
+            self.messages[id(t)] = messages
+            if self.cache is None:
+                return await t.arun()
+            key = self.cache.key(t)
+            if self.cache.lookup(t, key):
+                return t.state
+            state = await t.arun()
+            self.cache.store(t, key)
+            return state
+
+    def _reset(self):
+        """
+        Resets the counters before a test run.
         """
         self.success = 0
         self.failed = 0
         self.count = 0
         self.error = 0
+        self.timedout = 0
+        self.assertions = 0
+        self.segfaults = 0
         self.lastResult = TestState.Waiting
-        for t in self._getTests(tests):
-            self.lastResult = t.run()
-            if t.descr is not None:
-                logger.log(f"{TermColor.colorText('Test', TermColor.Purple)}[{self.count: 03}] {t.name} - {t.descr}: {t.state}")
-            else:
-                logger.log(f"{TermColor.colorText('Test', TermColor.Purple)}[{self.count: 03}] {t.name}: {t.state}")
-            if self.options["commands"]:
-                logger.log(f" --> {t.cmd}", showTime=False)
-            logger.flush(quiet)
-            if self.lastResult in [TestState.Success, TestState.Clean]:
-                self.success += 1
-            elif self.lastResult == TestState.Fail:
-                self.failed += 1
-            elif self.lastResult == TestState.Error:
-                self.error += 1
-            elif self.lastResult == TestState.Timeout:
-                self.timedout += 1
-            elif self.lastResult == TestState.SegFault:
-                self.segfaults += 1
-            elif self.lastResult == TestState.Assertion:
-                self.assertions += 1
-            self.count = self.count + 1
-            yield t
-            if self.lastResult != TestState.Disabled:
-                if (self.mode == TestSuiteMode.BreakOnFail) and (self.lastResult != TestState.Success):
+        self.finished = []
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.skipped = 0
+        self.messages = {}
+        for t in self.testList:
+            # A test cancelled by an earlier run runs again
+            t.cancelled = False
+        if self.cache is not None:
+            self.cache.hits = 0
+            self.cache.misses = 0
+        if self.snapshots is not None:
+            self.snapshots.recorded = 0
+
+    def _record(self):
+        """
+        Stores the results of the last test run in the history and
+        saves the recorded snapshots.
+        """
+        if self.snapshots is not None:
+            try:
+                self.snapshots.save()
+            except OSError as e:
+                logger.log(f"Sorry, but I couldn't save the snapshots '{self.snapshots.indexFile}': {e}")
+        if self.history is None:
+            return
+        try:
+            self.history.record(self.finished)
+        except (OSError, sqlite3.Error) as e:
+            logger.log(f"Sorry, but I couldn't update the history '{self.history.fname}': {e}")
+
+    def _report(self, t: Test, quiet=False):
+        """
+        Logs the result of a finished test and updates the counters.
+        """
+        logger.replay(self.messages.pop(id(t), []))
+        self.lastResult = t.state
+        state = f"{t.state} (cached)" if getattr(t, "cached", False) else f"{t.state}"
+        if t.descr is not None:
+            logger.log(f"{TermColor.colorText('Test', TermColor.Purple)}[{self.count: 03}] {t.name} - {t.descr}: {state}")
+        else:
+            logger.log(f"{TermColor.colorText('Test', TermColor.Purple)}[{self.count: 03}] {t.name}: {state}")
+        if self.options["commands"]:
+            logger.log(f" --> {t.cmd}", showTime=False)
+        logger.flush(quiet)
+        if self.lastResult in [TestState.Success, TestState.Clean]:
+            self.success += 1
+        elif self.lastResult == TestState.Fail:
+            self.failed += 1
+        elif self.lastResult == TestState.Error:
+            self.error += 1
+        elif self.lastResult == TestState.Timeout:
+            self.timedout += 1
+        elif self.lastResult == TestState.SegFault:
+            self.segfaults += 1
+        elif self.lastResult == TestState.Assertion:
+            self.assertions += 1
+        self.count = self.count + 1
+        self.finished.append(t)
+        self.duration = time.perf_counter() - self.started
+
+    def _halted(self) -> bool:
+        """
+        Checks whether the suite mode halts the run after the last result.
+        """
+        if self.lastResult != TestState.Disabled:
+            if (self.mode == TestSuiteMode.BreakOnFail) and (self.lastResult != TestState.Success):
+                return True
+            if (self.mode == TestSuiteMode.BreakOnError) and (self.lastResult == TestState.Error):
+                return True
+        return False
+
+    def run(self, quiet=False, tests: List[int] = [], jobs: int = 1):
+        """
+        Runs the tests in the suite.
+
+        If no tests are selected, all tests will be run.
+        With `jobs` greater than one, up to `jobs` tests run at the same
+        time. The tests are still reported in order, piped output of
+        concurrent tests might interleave.
+        """
+        if not self.compiled:
+            self.compile()
+        self._reset()
+        execution = self._execute(self._getTests(tests, jobs), jobs)
+        try:
+            for t in execution:
+                self._report(t, quiet)
+                yield t
+                if self._halted():
                     break
-                if (self.mode == TestSuiteMode.BreakOnError) and (self.lastResult == TestState.Error):
+        finally:
+            execution.close()
+            self._record()
+
+    async def arun(self, quiet=False, tests: List[int] = [], jobs: int = 0):
+        """
+        Runs the tests in the suite on the asyncio event loop.
+
+        All tests are started as tasks of the running loop, `jobs` limits
+        the number of concurrently executed tests (0 for no limit).
+        The tests are reported in order, like :py:meth:`run` does.
+        When the suite mode halts the run, the remaining tasks are
+        cancelled, which kills their processes.
+        """
+        if not self.compiled:
+            self.compile()
+        self._reset()
+        limit = asyncio.Semaphore(jobs) if jobs > 0 else None
+
+        async def runTest(t: Test) -> TestState:
+            if limit is None:
+                return await self._arunTest(t)
+            async with limit:
+                return await self._arunTest(t)
+
+        tasks = [(t, asyncio.ensure_future(runTest(t))) for t in self._getTests(tests, jobs)]
+        try:
+            for t, task in tasks:
+                if await task is None:
+                    continue
+                self._report(t, quiet)
+                yield t
+                if self._halted():
                     break
+        finally:
+            for t, task in tasks:
+                task.cancel()
+            await asyncio.gather(*(task for t, task in tasks), return_exceptions=True)
+            self._record()
 
     def calcRate(self):
         """
@@ -225,6 +559,13 @@ class TestSuite:
                 logger.log(TermColor.colorText(f"\tSegFaults: {self.segfaults}", TermColor.Yellow))
             if self.timedout > 0:
                 logger.log(TermColor.colorText(f"\tTimeouts: {self.timedout}", TermColor.Purple))
+            self.resourceStats()
+            self.budgetStats()
+            self.benchmarkStats()
+            if self.cache is not None:
+                logger.log(f"\tCache: {self.cache.hits} hits, {self.cache.misses} misses")
+            if self.snapshots is not None and self.snapshots.recorded > 0:
+                logger.log(f"\tSnapshots: {self.snapshots.recorded} recorded")
             # A little bit of fun
             if self.success == len(self) and self.count > 3:
                 logger.log("\tCongratulations, you passed all tests!")
@@ -251,6 +592,95 @@ class TestSuite:
                     logger.log("\tYou know, memory garbage doesn't collect itself?!")
         return self.calcRate()
 
+    def resourceStats(self):
+        """
+        Displays the resources used by the test run: totals, percentiles
+        of the durations and the slowest tests.
+        """
+        measured = [(nr, t, t.usage) for nr, t in enumerate(self.finished) if getattr(t, "usage", None) is not None]
+        if len(measured) == 0:
+            return
+        walls = [usage.wall for nr, t, usage in measured]
+        cpus = [usage.cpu for nr, t, usage in measured if usage.cpu is not None]
+        rss = [usage.maxRSS for nr, t, usage in measured if usage.maxRSS is not None]
+        total = f"\tDuration: {self.duration:.3f}s, {sum(walls):.3f}s in tests"
+        if len(cpus) > 0:
+            total += f", {sum(cpus):.3f}s CPU"
+        if len(rss) > 0:
+            total += f", peak RSS {formatBytes(max(rss))}"
+        logger.log(total)
+        logger.log(
+            "\tPercentiles: "
+            + ", ".join(f"p{p} {percentile(walls, p):.3f}s" for p in [50, 90, 99])
+            + f", max {max(walls):.3f}s"
+        )
+        slowest = sorted(measured, key=lambda m: m[2].wall, reverse=True)[: self.options["slowest"]]
+        if len(slowest) > 1:
+            logger.log("\tSlowest tests:")
+            for nr, t, usage in slowest:
+                logger.log(f"\t\t{TermColor.colorText('Test', TermColor.Purple)}[{nr: 03}] {usage} {t.name}")
+
+    def budgetStats(self):
+        """
+        Displays the coverage of a test run with a time budget.
+        """
+        if self.options["budget"] is None:
+            return
+        coverage = float(self.count) / float(len(self)) * 100 if len(self) > 0 else 0.0
+        logger.log(
+            f"\tBudget: {self.options['budget']:.1f}s, used {self.duration:.1f}s, "
+            f"coverage {self.count} of {len(self)} tests ({coverage:.1f}%)"
+        )
+        if self.skipped > 0:
+            logger.log(TermColor.colorText(f"\tNot started within the budget: {self.skipped}", TermColor.Yellow))
+
+    def benchmarks(self) -> Dict[str, dict]:
+        """
+        The results of the benchmarks of the last test run, by name.
+        Benchmarks sharing a name are told apart by their occurrence:
+        'name#1' is the second benchmark of the name.
+        """
+        results = {}
+        for t in self.finished:
+            if isinstance(t, Benchmark) and t.results() is not None:
+                name, occurrence = testKey(t)
+                results[name if occurrence == 0 else f"{name}#{occurrence}"] = t.results()
+        return results
+
+    def benchmarkStats(self):
+        """
+        Displays the statistics of the benchmarks of the test run.
+        """
+        benchmarks = self.benchmarks()
+        if len(benchmarks) == 0:
+            return
+        logger.log("\tBenchmarks:")
+        for name, results in benchmarks.items():
+            logger.log(f"\t\t{TermColor.colorText('Benchmark', TermColor.Purple)} {name} ({results['repeat']} rounds)")
+            for metric in ["wall", "cpu"]:
+                if results[metric] is not None:
+                    stats = results[metric]
+                    logger.log(
+                        f"\t\t\t{metric}: median {stats['median']:.4f}s, min {stats['min']:.4f}s, "
+                        f"mean {stats['mean']:.4f}s \u00b1 {stats['stddev']:.4f}s, p95 {stats['p95']:.4f}s"
+                    )
+
+    def saveBenchmarks(self, fname: str):
+        """
+        Writes the results of the benchmarks as JSON file.
+        The file can be used as baseline for :py:class:`NoSlowerThan`.
+        """
+        with open(fname, "w") as fHnd:
+            json.dump(self.benchmarks(), fHnd, indent=2)
+
+    def saveDurations(self, fname: str):
+        """
+        Merges the durations of the last test run into a JSON file, which
+        balances the shards of later runs.
+        (see :py:func:`nightmare.scheduling.writeDurations`)
+        """
+        writeDurations(fname, self.finished)
+
     def __str__(self):
         self.toString(prefix="")
 
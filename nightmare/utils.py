@@ -5,13 +5,18 @@
 This file contains an assorted collection of utilities:
     - Terminal coloring
     - A custom logger
+    - Formatting and statistics helpers
 """
 
-from typing import List
+from typing import List, Sequence, Dict, Iterator, Optional
 
 import sys
 import os
 import time
+import math
+import statistics
+import contextlib
+import contextvars
 
 
 class TermColor:
@@ -69,6 +74,8 @@ class logger:
     """Auto flush logged messages"""
     logListener = logPrinter
     """Listener to redirect output"""
+    _captured: contextvars.ContextVar = contextvars.ContextVar("captured", default=None)
+    """The messages of the current thread or task, while they are captured"""
 
     @staticmethod
     def log(msg: str, showTime=True):
@@ -83,11 +90,41 @@ class logger:
             )
         else:
             msg = "           " + msg.strip("\r\n")
-        if logger.autoflush:
+        captured: Optional[List[str]] = logger._captured.get()
+        if captured is not None:
+            captured.append(msg)
+        elif logger.autoflush:
             logger.logListener(msg)
         else:
             logger._buffer.append(msg)
 
+    @staticmethod
+    @contextlib.contextmanager
+    def capture() -> Iterator[List[str]]:
+        """
+        Captures the messages logged by the current thread (or asyncio
+        task), instead of writing them to the buffer. Concurrent tests
+        keep their messages apart, until they are replayed.
+        (see :py:meth:`replay`)
+        """
+        messages: List[str] = []
+        token = logger._captured.set(messages)
+        try:
+            yield messages
+        finally:
+            logger._captured.reset(token)
+
+    @staticmethod
+    def replay(messages: List[str]):
+        """
+        Writes captured messages to the buffer.
+        """
+        for msg in messages:
+            if logger.autoflush:
+                logger.logListener(msg)
+            else:
+                logger._buffer.append(msg)
+
     @staticmethod
     def flush(quiet=False):
         """
@@ -105,3 +142,40 @@ class logger:
         Clears the buffer
         """
         logger._buffer = []
+
+
+def formatBytes(size: float) -> str:
+    """
+    Formats a number of bytes with a binary unit prefix.
+    """
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """
+    Nearest-rank percentile of a list of values (p in 0..100).
+    """
+    ordered = sorted(values)
+    if len(ordered) == 0:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    """
+    Summary statistics of repeated measurements: min, median, mean,
+    standard deviation, 95th percentile and max.
+    """
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "mean": statistics.mean(values),
+        "stddev": statistics.stdev(values) if len(values) > 1 else 0.0,
+        "p95": percentile(values, 95),
+        "max": max(values),
+    }
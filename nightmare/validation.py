@@ -69,6 +69,14 @@ else:
             command="echo this should be a success 1>&2",
             stderr='lambda s: s.strip().split(" ") == ["this","should","be","a","success"]',
         ),
+        Test(
+            name="missing program",
+            description="A program which can not be started returns 127, like in a shell",
+            command="does_not_exist_bin arg",
+            shell=False,
+            stderr=Contains("does_not_exist_bin"),
+            returnCode=127,
+        ),
     ]
 
     failTests = [
@@ -108,6 +116,13 @@ else:
             command="echo this should be a fail 1>&2",
             stderr='lambda s: s.strip().split(" ") == ["this","should","be","a","success"]',
         ),
+        Test(
+            name="missing program",
+            description="A program which can not be started does not succeed",
+            command="does_not_exist_bin arg",
+            shell=False,
+            returnCode=0,
+        ),
     ]
 
     timeoutTests = [
@@ -127,6 +142,20 @@ else:
         ),
     ]
 
+    budgetTests = [
+        Test(name=f"Budget {nr:02}", description="Takes half a second", command="python nightmare/validation.py sleep")
+        for nr in range(4)
+    ]
+
+    killTests = [
+        Test(
+            name="Kill 01",
+            description="The children of the DUT are killed with it on a timeout",
+            command="sh -c 'sleep 31.4159 & sleep 31.4159'",
+            timeout=0.5,
+        ),
+    ]
+
     badwordTests = [
         BadWord(
             name="There should be a 'Test()' in one of the python files", path="nightmare/", pattern="*.py", words=["Test\("]
@@ -139,6 +168,139 @@ else:
         ),
     ]
 
+    badwordEscapeTests = [
+        BadWord(
+            name="A hex escape should not hide the 'Test()' in the validation",
+            path="nightmare/",
+            pattern="validation.py",
+            words=["\\x54est\\("],
+        ),
+        BadWord(
+            name="An octal escape should not hide the 'Test()' in the validation",
+            path="nightmare/",
+            pattern="validation.py",
+            words=["\\124est\\("],
+        ),
+    ]
+
+    spillTests = [
+        Test(
+            name="Spilled Output 01",
+            description="A spilled output is searched like the output kept in memory (run with a small spill limit)",
+            command="printf 'x\\r\\n%.0s' $(seq 3000)",
+            stdout=[
+                Contains("x\nx\n"),
+                Startswith("x\nx"),
+                'lambda s: len(s) == 6000 and s.find("\\nx", 3000) == 3001 and s == "x\\n" * 3000',
+            ],
+        ),
+        Test(
+            name="Spilled Output 02",
+            description="A spilled output is normalized block by block",
+            command="printf 'a  %s\\r\\n' $(seq 1000)",
+            normalize=[Mask(r"\d+", "n"), CollapseWhitespace()],
+            stdout='lambda s: s == "\\n".join(["a n"] * 1000)',
+        ),
+    ]
+
+    earlyKillTests = [
+        Test(
+            name="Early Kill 01",
+            description="The DUT is killed once its output fails, long before the timeout (run with --early-kill)",
+            command="echo error; sleep 10",
+            stdout=ContainsNot("error"),
+            timeout=5.0,
+        ),
+        Test(
+            name="Early Kill 02",
+            description="A DUT whose output can still succeed is left running",
+            command="echo first; sleep 0.2; echo second",
+            stdout=Contains("first", "second"),
+            timeout=5.0,
+        ),
+    ]
+
+    snapshotTests = [
+        Test(
+            name="Snapshot 01",
+            description="The output is compared with its recorded snapshot",
+            command="echo snapshot",
+            stdout=Snapshot(),
+            returnCode=Snapshot(),
+        ),
+        Test(
+            name="Snapshot 01",
+            description="Tests sharing a name keep their own snapshot",
+            command="echo another snapshot",
+            stdout=Snapshot(),
+        ),
+    ]
+
+    needleTests = [
+        Test(
+            name="Needles 01",
+            description="Needles hidden inside or across the match of another needle are found",
+            command="echo abcd",
+            stdout=[Contains("abc", "abcd", "bcd", "b"), Contains("ab", "bc")],
+        ),
+        Test(
+            name="Needles 02",
+            description="Many needles are found in a single pass",
+            command="seq 1000",
+            stdout=Contains(*[str(nr) for nr in range(900, 1000)]),
+        ),
+        Test(
+            name="Needles 03",
+            description="Many absent needles are not found",
+            command="seq 1000",
+            stdout=ContainsNot(*[str(nr) for nr in range(1001, 1101)]),
+        ),
+        Test(
+            name="Needles 04",
+            description="A missing needle fails the test",
+            command="seq 1000",
+            stdout=Contains(*[str(nr) for nr in range(995, 1002)]),
+        ),
+    ]
+
+    performanceTests = [
+        Test(name="MaxDuration 01", description="Fast enough", command="sleep 0.1", performance=MaxDuration(2.0)),
+        Test(name="MaxDuration 02", description="Too slow", command="sleep 0.3", performance=MaxDuration(0.1)),
+        Test(name="MaxCPU 01", description="Idle enough", command="sleep 0.1", performance=MaxCPU(0.5)),
+        Test(
+            name="MaxCPU 02",
+            description="Too busy",
+            command='python -c "sum(range(20000000))"',
+            performance=MaxCPU(0.05),
+        ),
+        Test(name="MaxRSS 01", description="Small enough", command="true", performance=MaxRSS(1024 * 1024 * 1024)),
+        Test(
+            name="MaxRSS 02",
+            description="Too large",
+            command="python -c \"x = b' ' * 200 * 1024 * 1024\"",
+            performance=MaxRSS(100 * 1024 * 1024),
+        ),
+        Test(name="NoSlowerThan 01", description="Not slower than 1s", command="true", performance=NoSlowerThan(1.0)),
+        Test(name="NoSlowerThan 02", description="Slower than 0.1s", command="sleep 0.3", performance=NoSlowerThan(0.1)),
+        Test(
+            name="NoSlowerThan 03",
+            description="Not slower than the baseline file",
+            command="true",
+            performance=NoSlowerThan("example/baseline.json", key="true"),
+        ),
+        Test(
+            name="NoSlowerThan 04",
+            description="Slower than the median of the benchmark in the baseline file",
+            command="sleep 0.3",
+            performance=NoSlowerThan("example/baseline.json", key="Sleep"),
+        ),
+    ]
+
+    benchmarkTests = [
+        Benchmark(name="Sleep", description="Measured three times", command="sleep 0.01", warmup=1, repeat=3),
+        Benchmark(name="Sleep", description="Shares the name", command="sleep 0.02", warmup=0, repeat=2),
+    ]
+
     # Ported over the old example tests
     suiteInstance = Suite(
         Test(name="Example 1", description="This test should be a success", command="$DUT success", stdout="success"),
@@ -227,6 +389,85 @@ else:
         DUT="echo",
     )
 
+    normalizationTests = [
+        Test(
+            name="Normalization 01",
+            description="Masks are applied in order and keep their backreferences",
+            command="echo id 11 at 12",
+            normalize=[Mask(r"(\d)\1", "<twin>"), Mask(r"\d+", "<n>")],
+            stdout="id <twin> at <n>",
+        ),
+        Test(
+            name="Normalization 02",
+            description="A mask sees the collapsed whitespace of an earlier stage",
+            command="printf 'a   b\\n'",
+            normalize=[CollapseWhitespace(), Mask("a b", "ok")],
+            stdout="ok",
+        ),
+        Test(
+            name="Normalization 03",
+            description="Ignoring empty lines only applies to line comparisons (run with -L)",
+            command="printf 'a\\n\\nb\\n'",
+            stdout=["a\nb", "regex:a\n\nb"],
+        ),
+    ]
+
+    import os
+    import tempfile
+
+    goldenManifest = os.path.join(tempfile.gettempdir(), "nightmare-validation-golden.json")
+
+    goldenTests = [
+        Test(
+            name="Golden 01",
+            description="A missing golden file fails the test",
+            command="echo golden",
+            stdout=ExpectFile("nightmare/missing.golden"),
+        ),
+        Test(
+            name="Golden 02",
+            description="A missing golden file fails the comparison of a generated file",
+            command="echo golden",
+            stdout=CompareFiles("nightmare/missing.golden", "nightmare/__init__.py"),
+        ),
+        Test(
+            name="Golden 03",
+            description="The output equals the golden file",
+            command="cat nightmare/__init__.py",
+            stdout=ExpectFile("nightmare/__init__.py"),
+        ),
+        Test(
+            name="Golden 04",
+            description="The output equals the golden file, compared by the digests of the manifest",
+            command="cat nightmare/__init__.py",
+            stdout=ExpectFile("nightmare/__init__.py", manifest=goldenManifest),
+        ),
+        Test(
+            name="Golden 05",
+            description="The generated file equals the golden file, compared by the digests of the manifest",
+            command="echo golden",
+            stdout=CompareFiles("nightmare/__init__.py", "nightmare/__init__.py", manifest=goldenManifest),
+        ),
+        Test(
+            name="Golden 06",
+            description="An output of another size fails the test, without reading the golden file",
+            command="echo golden",
+            stdout=ExpectFile("nightmare/__init__.py", manifest=goldenManifest),
+        ),
+        Test(
+            name="Golden 07",
+            description="An output of the same size with a different block fails the test",
+            command="tr a-z A-Z < nightmare/__init__.py",
+            stdout=ExpectFile("nightmare/__init__.py", manifest=goldenManifest),
+        ),
+        Test(
+            name="Golden 08",
+            description="An output of the same size with a different block fails the test, also without a manifest",
+            command="tr a-z A-Z < nightmare/__init__.py",
+            stdout=ExpectFile("nightmare/__init__.py"),
+        ),
+    ]
+
     stringifierTests = [
         Test(
             name="Stringifier 01",
@@ -242,6 +483,27 @@ else:
         ),
     ]
 
+    diffTests = [
+        Test(
+            name="Diff 01",
+            description="Every tenth line differs, the difference is cut off after 20 hunks (run with -u)",
+            command="seq 1000",
+            stdout="\n".join(str(nr) if nr % 10 != 0 else f"x{nr}" for nr in range(1, 1001)),
+        ),
+        Test(
+            name="Diff 02",
+            description="Repeated lines without unique anchors are matched line by line",
+            command="for i in $(seq 20); do echo a; echo b; done",
+            stdout="b\na\n" * 20,
+        ),
+        Test(
+            name="Diff 03",
+            description="Large regions without unique anchors are replaced as a whole",
+            command="for i in $(seq 300); do echo a; echo b; done",
+            stdout="b\na\n" * 300,
+        ),
+    ]
+
     continuationModeRegression = [
         Test(
             name="Continuation Mode Regression 01",
@@ -284,6 +546,20 @@ else:
             stdout=Contains(f"I ran 4 out of 4 tests in total", f"Success: 2", f"Failed: 2"),
             returnCode=2,  # Continuation mode will return the number of failed tests: 2
         ),
+        Test(
+            name="Parallel Mode 01",
+            description="Make sure a parallel testsuite will halt on the first fail",
+            command='$DUT --no-gui --bench nightmare/validation.py --dut "$DUT" --suite continuationModeRegression -j 4',
+            stdout=Contains(f"I ran 2 out of 4 tests in total", f"Success: 1", f"Failed: 1"),
+            returnCode=State.Fail.value,
+        ),
+        Test(
+            name="Parallel Mode 02",
+            description="Make sure a parallel testsuite will run all test in continuation mode",
+            command='$DUT --no-gui --bench nightmare/validation.py --dut "$DUT" --suite continuationModeRegression -c -j 4',
+            stdout=Contains(f"I ran 4 out of 4 tests in total", f"Success: 2", f"Failed: 2"),
+            returnCode=2,
+        ),
     ]
 
     validateThisNightmare = [
@@ -377,5 +653,303 @@ else:
                 f"I ran {len(regressionTests)} out of {len(regressionTests)} tests in total", f"Success: {len(regressionTests)}"
             ),
         ),
+        Test(
+            name="CLI-12",
+            description="Badwords with escaped characters",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite badwordEscapeTests -c --no-color",
+            stdout=Contains(
+                "hex escape should not hide the 'Test()' in the validation - :  BADWORD",
+                "octal escape should not hide the 'Test()' in the validation - :  BADWORD",
+            ),
+        ),
+        Test(
+            name="CLI-13",
+            description="Shards are assigned by a stable hash of the test names, the same on every machine",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite suiteWithPython --shard 1/2 --shard-plan --no-color",
+            stdout=Contains(
+                "Shard 1/2: 4 tests",
+                *[f"Test[ {nr:02}] Python Test {nr:02}" for nr in [1, 2, 3, 4]],
+                "Shard 2/2: 6 tests",
+                *[f"Test[ {nr:02}] Python Test {nr:02}" for nr in [0, 5, 6, 7, 8, 9]],
+            ),
+        ),
+        Test(
+            name="CLI-14",
+            description="The second run replays all results from the cache",
+            command='d=$(mktemp -d) && $DUT --no-gui --bench nightmare/validation.py --suite successTests --cache "$d" '
+            '&& $DUT --no-gui --bench nightmare/validation.py --suite successTests --cache "$d"; rm -rf "$d"',
+            stdout=Contains(
+                f"Cache: 0 hits, {len(successTests)} misses",
+                f"Cache: {len(successTests)} hits, 0 misses",
+            ),
+        ),
+        Test(
+            name="CLI-15",
+            description="Spilled outputs",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite spillTests --spill-limit 1024",
+            stdout=Contains(f"I ran {len(spillTests)} out of {len(spillTests)} tests in total", f"Success: {len(spillTests)}"),
+            returnCode=0,
+        ),
+        Test(
+            name="CLI-16",
+            description="Missing golden files",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite goldenTests -c",
+            stdout=Contains(
+                f"I ran {len(goldenTests)} out of {len(goldenTests)} tests in total",
+                "Success: 3",
+                "Failed: 5",
+                "Sorry, but I couldn't read the golden file",
+                "Sorry, but I couldn't compare 'nightmare/__init__.py' with the golden file 'nightmare/missing.golden'",
+            ),
+        ),
+        Test(
+            name="CLI-17",
+            description="Output normalization",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite normalizationTests -L",
+            stdout=Contains(
+                f"I ran {len(normalizationTests)} out of {len(normalizationTests)} tests in total",
+                f"Success: {len(normalizationTests)}",
+            ),
+            returnCode=0,
+        ),
+        Test(
+            name="CLI-18",
+            description="A saved testbench loads again, without the options of the command line",
+            command="d=$(mktemp -d) && $DUT --no-gui --bench nightmare/validation.py --suite goldenTests --timeout 30 "
+            '--save "$d/bench.json" && (grep -q timeout "$d/bench.json" || echo "No timeout saved") '
+            '&& $DUT --no-gui --bench "$d/bench.json" --suite goldenTests -c; rm -rf "$d"',
+            stdout=Contains(
+                "No timeout saved",
+                f"I ran {len(goldenTests)} out of {len(goldenTests)} tests in total",
+                "Success: 3",
+                "Failed: 5",
+            ),
+        ),
+        Test(
+            name="CLI-19",
+            description="Doomed DUTs are killed early",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite earlyKillTests --early-kill -c",
+            stdout=Contains(
+                f"I ran {len(earlyKillTests)} out of {len(earlyKillTests)} tests in total", "Success: 1", "Failed: 1"
+            ),
+            timeout=4.0,
+        ),
+        Test(
+            name="CLI-20",
+            description="The failures recorded in the history are run first",
+            command="d=$(mktemp -d) && $DUT --no-gui --bench nightmare/validation.py --suite suiteInstance --dut echo -c "
+            '--history "$d/history.db"; $DUT --no-gui --bench nightmare/validation.py --suite suiteInstance --dut echo -c '
+            '--history "$d/history.db" --order risk --no-color; rm -rf "$d"',
+            stdout=Contains("Test[ 00] Example 2 - ", "Test[ 04] Example 8 - ", "Test[ 05] Example 1 - "),
+        ),
+        Test(
+            name="CLI-21",
+            description="Snapshots are recorded once and verified afterwards",
+            command="d=$(mktemp -d) && $DUT --no-gui --bench nightmare/validation.py --suite snapshotTests -c --snapshots $d "
+            "--verify; $DUT --no-gui --bench nightmare/validation.py --suite snapshotTests -c --snapshots $d "
+            "&& $DUT --no-gui --bench nightmare/validation.py --suite snapshotTests -c --snapshots $d --verify; "
+            'r=$?; rm -rf "$d"; exit $r',
+            stdout=Contains("Sorry, but there is no snapshot of the stdout of Snapshot 01", "Snapshots: 3 recorded"),
+            returnCode=0,
+        ),
+        Test(
+            name="CLI-22",
+            description="Many needles",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite needleTests -c",
+            stdout=Contains(
+                f"I ran {len(needleTests)} out of {len(needleTests)} tests in total",
+                f"Success: {len(needleTests) - 1}",
+                "Failed: 1",
+                "missing '1001'",
+            ),
+        ),
+        Test(
+            name="CLI-23",
+            description="Bad words skip excluded and ignored directories",
+            command='d=$(mktemp -d) && mkdir -p "$d/src/vendor" "$d/src/gen" && echo clean > "$d/src/a.txt" '
+            '&& echo SECRET > "$d/src/vendor/b.txt" && echo SECRET > "$d/src/gen/c.txt" && echo SECRET > "$d/src/keep.log" '
+            "&& printf 'gen/\\n*.log\\n!keep.log\\n' > \"$d/src/.gitignore\" "
+            """&& printf '{"suites": {"walk": [%s, %s]}}' """
+            """'{"type": "BadWord", "name": "Ignored", "path": "'"$d"'/src", "pattern": "**/*.txt", "words": ["SECRET"], '"""
+            """'"exclude": ["vendor/"], "gitignore": true}' """
+            """'{"type": "BadWord", "name": "Included", "path": "'"$d"'/src", "pattern": "**/*", "words": ["SECRET"], '"""
+            """'"exclude": ["vendor/"], "gitignore": true}' > "$d/bench.json" """
+            '&& $DUT --no-gui --bench "$d/bench.json" --suite walk -c --no-color; rm -rf "$d"',
+            stdout=[Contains("Ignored - :  CLEAN", "keep.log[0]: 'SECRET'"), ContainsNot("b.txt", "c.txt")],
+        ),
+        Test(
+            name="CLI-24",
+            description="The asyncio engine halts on the first fail",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite failTests --asyncio",
+            stdout=Contains(f"I ran 1 out of {len(failTests)} tests in total", "Failed: 1"),
+            returnCode=NonZero(),
+        ),
+        Test(
+            name="CLI-25",
+            description="The asyncio engine continues after fails and errors, also in parallel",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite suiteInstance --dut echo -c --asyncio -j 4",
+            stdout=Contains(
+                f"I ran {len(suiteInstance)} out of {len(suiteInstance)} tests in total", "Errors: 1", "Success: 4", "Failed: 4"
+            ),
+        ),
+        Test(
+            name="CLI-26",
+            description="The asyncio engine kills tests after their timeout",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite timeoutTests -c --asyncio",
+            stdout=Contains(
+                f"I ran {len(timeoutTests)} out of {len(timeoutTests)} tests in total", "Timeouts: 1", "Success: 1"
+            ),
+        ),
+        Test(
+            name="CLI-27",
+            description="Spilled outputs are replayed from the cache, an unwritable cache is only reported",
+            command="d=$(mktemp -d) && for i in 1 2; do $DUT --no-gui --bench nightmare/validation.py --suite spillTests "
+            '--spill-limit 1024 --cache "$d/cache"; done; ls "$d"/cache/*/*.stdout > /dev/null && echo "Spill files stored"; '
+            'touch "$d/file"; '
+            '$DUT --no-gui --bench nightmare/validation.py --suite successTests --cache "$d/file"; rm -rf "$d"',
+            stdout=Contains(
+                f"Cache: {len(spillTests)} hits, 0 misses",
+                f"Success: {len(spillTests)}",
+                "Spill files stored",
+                "Sorry, but I couldn't store the result of 'stdout String' in the cache",
+                f"Success: {len(successTests)}",
+            ),
+        ),
+        Test(
+            name="CLI-28",
+            description="The orders by the history record the history, or fall back to the order of the bench",
+            command='d=$(mktemp -d) && XDG_CACHE_HOME="$d" $DUT --no-gui --bench nightmare/validation.py '
+            '--suite suiteWithPython --order longest --no-color; ls "$d/nightmare/history.db" '
+            "&& $DUT --no-gui --bench nightmare/validation.py "
+            '--suite suiteWithPython --order risk --no-history --no-color; rm -rf "$d"',
+            stdout=Contains(
+                "I'm recording the results in the history",
+                "nightmare/history.db",
+                "Sorry, but the 'risk' order needs the history, I'll keep the order of the bench",
+                "I'm executing the tests in 'bench' order",
+            ),
+        ),
+        Test(
+            name="CLI-29",
+            description="Performance expectations",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite performanceTests -c",
+            stdout=Contains(
+                f"I ran {len(performanceTests)} out of {len(performanceTests)} tests in total",
+                "Success: 5",
+                "Failed: 5",
+                "MaxDuration(0.1): ",
+                "MaxCPU(0.05): ",
+                "MaxRSS(104857600): ",
+                "NoSlowerThan(0.1, ",
+                "NoSlowerThan('example/baseline.json', tolerance=0.1, key='Sleep', ",
+            ),
+        ),
+        Test(
+            name="CLI-30",
+            description="Benchmark statistics, benchmarks sharing a name are kept apart",
+            command="f=$(mktemp) && $DUT --no-gui --bench nightmare/validation.py --suite benchmarkTests --no-color "
+            '--benchmark-file "$f" && cat "$f"; rm -f "$f"',
+            stdout=Contains(
+                f"I ran {len(benchmarkTests)} out of {len(benchmarkTests)} tests in total",
+                "Benchmark Sleep (3 rounds)",
+                "Benchmark Sleep#1 (2 rounds)",
+                "wall: median 0.0",
+                '"Sleep": {',
+                '"Sleep#1": {',
+            ),
+            returnCode=0,
+        ),
+        Test(
+            name="CLI-31",
+            description="A timeout kills the whole process group of the DUT",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite killTests; "
+            'sleep 0.2; pgrep -f "slee[p] 31.4159" || echo "No sleep left"',
+            stdout=Contains("Timeouts: 1", "No sleep left"),
+            performance=MaxDuration(5.0),
+        ),
+        Test(
+            name="CLI-32",
+            description="No test is started after the budget is used up",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite budgetTests --budget 0.8",
+            stdout=Contains(
+                f"I ran 2 out of {len(budgetTests)} tests in total",
+                f"coverage 2 of {len(budgetTests)} tests (50.0%)",
+                "Not started within the budget: 2",
+            ),
+            returnCode=0,
+        ),
+        Test(
+            name="CLI-33",
+            description="The differences are cut into hunks and the hunks are cut off",
+            command="$DUT --no-gui --bench nightmare/validation.py --suite diffTests -c -u --no-color",
+            stdout=Contains(
+                "@@ -7,7 +7,7 @@",
+                "-10",
+                "+x10",
+                "@@ -197,7 +197,7 @@",
+                "... 80 more hunks",
+                "@@ -1,3 +1,4 @@",
+                "@@ -37,4 +38,3 @@",
+                "@@ -1,600 +1,600 @@",
+                f"Failed: {len(diffTests)}",
+            ),
+            returnCode=NonZero(),
+        ),
+        Test(
+            name="CLI-34",
+            description="Golden files of several blocks are compared by the digests of the manifest",
+            command='d=$(mktemp -d) && head -c 3145728 /dev/zero > "$d/golden" && cp "$d/golden" "$d/changed" '
+            '&& printf X | dd of="$d/changed" bs=1 seek=1500000 conv=notrunc 2> /dev/null '
+            """&& printf '{"suites": {"golden": [%s, %s]}}' """
+            """'{"name": "Same", "command": "cat '"$d"'/golden", """
+            """"stdout": {"ExpectFile": {"fname": "'"$d"'/golden", "manifest": "'"$d"'/golden.json"}}}' """
+            """'{"name": "Block", "command": "cat '"$d"'/changed", """
+            """"stdout": {"ExpectFile": {"fname": "'"$d"'/golden", "manifest": "'"$d"'/golden.json"}}}' > "$d/bench.json" """
+            '&& $DUT --no-gui --bench "$d/bench.json" --suite golden -c --no-color '
+            '; $DUT --no-gui --bench "$d/bench.json" --suite golden -c --no-color '
+            """; python -c "import json, sys; """
+            """print('Blocks:', [len(e['blocks']) for e in json.load(open(sys.argv[1])).values()])" """
+            '"$d/golden.json"; rm -rf "$d"',
+            stdout=Contains("Same - :  SUCCESS", "Block - :  FAIL", "Success: 1", "Failed: 1", "Blocks: [3]"),
+        ),
+        Test(
+            name="CLI-35",
+            description="The bad word index only rescans modified files",
+            command='d=$(mktemp -d) && mkdir "$d/src" && echo SECRET > "$d/src/a.txt" && echo SECRET > "$d/src/b.txt" '
+            '&& echo clean > "$d/src/c.txt" '
+            """&& printf '{"suites": {"index": [{"type": "BadWord", "name": "Indexed", "path": "%s/src", "pattern": "*.txt", """
+            """"words": ["SECRET"], "index": "%s/index.json"}]}}' "$d" "$d" > "$d/bench.json" """
+            '&& $DUT --no-gui --bench "$d/bench.json" --suite index -c --no-color > "$d/first.log" '
+            '; echo "still clean" >> "$d/src/c.txt" '
+            '; $DUT --no-gui --bench "$d/bench.json" --suite index -c --no-color > "$d/second.log" '
+            '; grep -h "I scanned" "$d/first.log" "$d/second.log" '
+            """; for log in first second; do grep -o "[a-z]*\\.txt\\[.*" "$d/$log.log" > "$d/$log.hits"; done """
+            '; cmp -s "$d/first.hits" "$d/second.hits" && cat "$d/second.hits" && echo "The same hits"; rm -rf "$d"',
+            stdout=Contains(
+                "I scanned 3 of 3 files",
+                "I scanned 1 of 3 files",
+                "a.txt[0]: 'SECRET'",
+                "b.txt[0]: 'SECRET'",
+                "The same hits",
+            ),
+        ),
+        Test(
+            name="CLI-36",
+            description="The compiled testbench is cached until the testbench changes",
+            command="d=$(mktemp -d) "
+            """&& printf 'suite = [Test(name="Before", command="true", returnCode=0)]\\n' > "$d/bench.py" """
+            '&& $DUT --no-gui --bench "$d/bench.py" --suite suite --bytecode "$d/cache" -c --no-color > /dev/null '
+            '&& ls "$d/cache" | grep -c "[.]bench$" && first=$(stat -c %y "$d"/cache/*.bench) '
+            '&& $DUT --no-gui --bench "$d/bench.py" --suite suite --bytecode "$d/cache" -c --no-color > /dev/null '
+            '&& [ "$first" = "$(stat -c %y "$d"/cache/*.bench)" ] && echo "The cache is used" '
+            '&& sed -i "s/Before/After/" "$d/bench.py" '
+            '&& $DUT --no-gui --bench "$d/bench.py" --suite suite --bytecode "$d/cache" -c --no-color '
+            '&& [ "$first" != "$(stat -c %y "$d"/cache/*.bench)" ] && echo "The cache is renewed"; rm -rf "$d"',
+            stdout=[
+                Startswith("1\n"),
+                Contains("The cache is used", "After - :  SUCCESS", "The cache is renewed"),
+                ContainsNot("Before"),
+            ],
+        ),
     ]
 
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Finding files by a glob pattern, without descending into excluded
+directories. (see :py:func:`findFiles`)
+
+Unlike `pathlib.Path.glob`, the directory tree is walked with
+`os.scandir` and pruned while walking: directories which can not
+contain a match, which are excluded or ignored by a `.gitignore` file
+are never read.
+"""
+
+from typing import List, Optional, Iterable, Set, Tuple, Pattern
+
+import os
+import re
+import fnmatch
+
+
+def translate(pattern: str) -> str:
+    """
+    Translates a gitignore style pattern into a regular expression
+    matching a path relative to the directory of the pattern.
+    """
+    result = []
+    pos = 0
+    while pos < len(pattern):
+        if pattern.startswith("**/", pos):
+            result.append("(?:.*/)?")
+            pos += 3
+        elif pattern.startswith("**", pos):
+            result.append(".*")
+            pos += 2
+        elif pattern[pos] == "*":
+            result.append("[^/]*")
+            pos += 1
+        elif pattern[pos] == "?":
+            result.append("[^/]")
+            pos += 1
+        elif pattern[pos] == "[" and "]" in pattern[pos + 2 :]:
+            end = pattern.index("]", pos + 2)
+            content = pattern[pos + 1 : end]
+            result.append("[" + ("^" + content[1:] if content.startswith("!") else content).replace("\\", "\\\\") + "]")
+            pos = end + 1
+        elif pattern[pos] == "\\" and pos + 1 < len(pattern):
+            result.append(re.escape(pattern[pos + 1]))
+            pos += 2
+        else:
+            result.append(re.escape(pattern[pos]))
+            pos += 1
+    return "".join(result) + r"\Z"
+
+
+class IgnoreRules:
+    """
+    Excluded paths, given as gitignore style patterns:
+
+    - Patterns without a slash match the name of a file or directory
+      at any depth, other patterns match the path relative to the
+      directory of the rules.
+    - A trailing slash only matches directories.
+    - A leading `!` includes a path again, the last matching rule wins.
+    """
+
+    def __init__(self, patterns: Iterable[str] = (), base: str = ""):
+        self.base = base
+        """The directory of the rules, relative to the walked directory"""
+        self.rules: List[Tuple[Pattern, bool, bool]] = []
+        """The expression, the negation flag and the directory flag of every rule"""
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern: str):
+        pattern = pattern.rstrip("\n").rstrip(" ") if not pattern.endswith("\\ ") else pattern
+        if pattern == "" or pattern.startswith("#"):
+            return
+        negate = pattern.startswith("!")
+        pattern = pattern[1:] if negate else pattern
+        directory = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if "/" not in pattern:
+            pattern = "**/" + pattern
+        self.rules.append((re.compile(translate(pattern.lstrip("/"))), negate, directory))
+
+    @staticmethod
+    def read(fname: str, base: str) -> "IgnoreRules":
+        """
+        Reads the rules of a `.gitignore` file.
+        """
+        with open(fname, errors="replace") as fHnd:
+            return IgnoreRules(fHnd.readlines(), base)
+
+    def match(self, path: str, isDir: bool) -> Optional[bool]:
+        """
+        Checks a path relative to the walked directory. Returns None, if
+        no rule matches.
+        """
+        if self.base != "":
+            if not path.startswith(self.base + "/"):
+                return None
+            path = path[len(self.base) + 1 :]
+        ignored = None
+        for expression, negate, directory in self.rules:
+            if (isDir or not directory) and expression.match(path):
+                ignored = not negate
+        return ignored
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def ignored(rules: List[IgnoreRules], path: str, isDir: bool) -> bool:
+    """
+    Checks a path against a stack of rules, the innermost rules win.
+    """
+    for rule in reversed(rules):
+        verdict = rule.match(path, isDir)
+        if verdict is not None:
+            return verdict
+    return False
+
+
+def findFiles(
+    root: os.PathLike,
+    pattern: str,
+    exclude: Iterable[str] = (),
+    gitignore: bool = False,
+    maxSize: Optional[int] = None,
+) -> List[str]:
+    """
+    Finds the files below `root` matching the glob `pattern` (like
+    `pathlib.Path.glob`, `**` matches any number of directories).
+
+    Files and directories matching an `exclude` pattern (see
+    :py:class:`IgnoreRules`) are skipped, with `gitignore` also those
+    ignored by `.gitignore` files and the `.git` directory. Files larger
+    than `maxSize` bytes are skipped. The files are ordered by name, every
+    directory in place of its name.
+    """
+    parts = [part for part in pattern.replace(os.sep, "/").split("/") if part not in ["", "."]]
+    rules = [IgnoreRules(exclude)]
+    if gitignore:
+        rules[0].add(".git/")
+    found = []
+
+    def closure(states: Set[int]) -> Set[int]:
+        # '**' also matches no directory at all
+        result = set(states)
+        for state in sorted(states):
+            while state < len(parts) and parts[state] == "**":
+                state += 1
+                result.add(state)
+        return result
+
+    def matches(state: int, name: str) -> bool:
+        return parts[state] != "**" and fnmatch.fnmatch(name, parts[state])
+
+    def visit(directory: str, relative: str, states: Set[int], rules: List[IgnoreRules]):
+        if gitignore and os.path.isfile(os.path.join(directory, ".gitignore")):
+            rules = rules + [IgnoreRules.read(os.path.join(directory, ".gitignore"), relative)]
+        states = closure(states)
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            path = entry.name if relative == "" else f"{relative}/{entry.name}"
+            try:
+                isDir = entry.is_dir()
+            except OSError:
+                continue
+            if ignored(rules, path, isDir):
+                continue
+            if isDir:
+                # Like pathlib, '**' does not follow symbolic links
+                following = {s for s in states if s < len(parts) and parts[s] == "**" and not entry.is_symlink()}
+                following |= {s + 1 for s in states if s < len(parts) - 1 and matches(s, entry.name)}
+                if len(following) > 0:
+                    visit(entry.path, path, following, rules)
+            elif any(s == len(parts) - 1 and matches(s, entry.name) for s in states):
+                try:
+                    if maxSize is None or entry.stat().st_size <= maxSize:
+                        found.append(entry.path)
+                except OSError:
+                    # Dangling symbolic links
+                    continue
+
+    visit(os.fspath(root), "", {0}, rules)
+    return found